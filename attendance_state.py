@@ -0,0 +1,209 @@
+from datetime import datetime, timedelta
+import threading
+
+from models import Attendance
+
+# a pending half older than this can't be on today's local day in any timezone
+PENDING_LOOKBACK = timedelta(days=2)
+
+# returned by PendingPairTracker.get when only the database knows
+UNKNOWN = object()
+
+
+class PendingPair:
+    __slots__ = ("attendance_id", "kind", "timestamp")
+
+    def __init__(self, attendance_id: int, kind: str, timestamp: datetime):
+        self.attendance_id = attendance_id
+        self.kind = kind  # half already stored: "selfie" or "location"
+        self.timestamp = timestamp  # UTC time of that half
+
+
+class Transition:
+    """
+    What a selfie or a location does to a user's attendance:
+    new_record - no pending half today; start a record with this one
+    delay_expired - the pending half is older than the delay; start a new record
+    already_received - the same half is pending and still within the delay
+    merged - the other half is pending within the delay; complete its record
+    """
+
+    __slots__ = ("outcome", "kind", "timestamp", "pair", "delay")
+
+    def __init__(
+        self,
+        outcome: str,
+        kind: str,
+        timestamp: datetime,
+        pair: PendingPair = None,
+        delay: float = 0,
+    ):
+        self.outcome = outcome
+        self.kind = kind
+        self.timestamp = timestamp
+        self.pair = pair
+        self.delay = delay
+
+    @property
+    def other(self):
+        return "location" if self.kind == "selfie" else "selfie"
+
+    def replies(self):
+        """
+        HTML texts for the user; the first answers their message
+        """
+        delay = f"<b>{self.delay / 60:.1f}</b> minutes"
+        if self.outcome == "new_record":
+            return [
+                f"{self.kind.title()} has been added, "
+                f"Please share your {self.other} for attendance"
+            ]
+        if self.outcome == "delay_expired":
+            missed = self.other if self.pair.kind == self.kind else self.kind
+            return [
+                f"Oops.. You are unable to send {missed} within {delay}",
+                f"We have added your {self.kind}, "
+                f"Please share your {self.other} within {delay} for attendance",
+            ]
+        if self.outcome == "already_received":
+            elapsed = (self.timestamp - self.pair.timestamp).total_seconds()
+            return [
+                f"{self.kind.title()} has been already received; "
+                f"Please send your {self.other} in "
+                f"<b>{(self.delay - elapsed) / 60:.1f}</b> minutes for attendance"
+            ]
+        return ["Your attendance has been added 👍"]
+
+
+def next_transition(pair, kind: str, timestamp: datetime, calendar, delay: float):
+    """
+    Decide where a selfie or a location goes
+    :param pair: PendingPair of the user or None
+    :param kind: "selfie" or "location"
+    :param timestamp: UTC time it was sent
+    :param calendar: DayCalendar of the user's timezone
+    :param delay: seconds allowed between the two halves
+    """
+    if pair is None or calendar.day_of(pair.timestamp) != calendar.day_of(timestamp):
+        return Transition("new_record", kind, timestamp)
+    if (timestamp - pair.timestamp).total_seconds() > delay:
+        return Transition("delay_expired", kind, timestamp, pair, delay)
+    if pair.kind == kind:
+        return Transition("already_received", kind, timestamp, pair, delay)
+    return Transition("merged", kind, timestamp, pair, delay)
+
+
+class PendingPairTracker:
+    """
+    The newest attendance record of every user while it is missing its
+    selfie or its location, so pairing the second half needs no read query.
+    It is a hint, not the source of truth: another process or a restart may
+    have written since, so `Attendance.start_pair` and `complete_pair` check
+    the pending record they were given and raise `StalePendingPair` when it
+    moved on, and the caller decides again from the database.
+    Loaded from the database at startup; a user whose write failed is
+    looked up in the database again on their next message, as is everyone
+    before `rebuild`. One small slotted entry per user at most.
+    """
+
+    def __init__(self):
+        self._pairs = {}  # {user_id: PendingPair}
+        self._stale = set()  # user IDs to be read from the database
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def rebuild(self, session=None):
+        """
+        Load the pending halves of the last PENDING_LOOKBACK from the database
+        :param session: session to be used instead of the thread's session
+        :return: number of pending pairs
+        """
+        since = datetime.utcnow() - PENDING_LOOKBACK
+        records = Attendance.get_newest_records(since, session=session)
+        pairs = {}
+        for record in records:
+            pair = self._from_record(record)
+            if pair is not None:
+                pairs[record.user_id] = pair
+        with self._lock:
+            self._pairs = pairs
+            self._stale.clear()
+            self._loaded = True
+        return len(pairs)
+
+    def get(self, user_id: int):
+        """
+        Get the pending pair of a user
+        :param user_id: user ID of user
+        :return: PendingPair, None without one, or UNKNOWN when the last
+            record has to be read and passed to `load`
+        """
+        with self._lock:
+            if not self._loaded or user_id in self._stale:
+                self.misses += 1
+                return UNKNOWN
+            self.hits += 1
+            return self._pairs.get(user_id)
+
+    def load(self, user_id: int, record):
+        """
+        Track the last attendance record of a user read from the database
+        :param user_id: user ID of user
+        :param record: Attendance or None
+        :return: PendingPair or None
+        """
+        pair = None if record is None else self._from_record(record)
+        with self._lock:
+            if pair is None:
+                self._pairs.pop(user_id, None)
+            else:
+                self._pairs[user_id] = pair
+            self._stale.discard(user_id)
+        return pair
+
+    def apply(self, user_id: int, transition: Transition, attendance_id: int = None):
+        """
+        Record a transition once its write is committed
+        :param user_id: user ID of user
+        :param transition: Transition that was carried out
+        :param attendance_id: ID of the record it created, if any
+        """
+        with self._lock:
+            if transition.outcome == "merged":
+                self._pairs.pop(user_id, None)
+            elif transition.outcome != "already_received":
+                self._pairs[user_id] = PendingPair(
+                    attendance_id, transition.kind, transition.timestamp
+                )
+
+    def invalidate(self, user_id: int):
+        """
+        Forget a user, e.g. when their write failed and may or may not be
+        committed; their next message reads the database
+        """
+        with self._lock:
+            self._pairs.pop(user_id, None)
+            self._stale.add(user_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pairs),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def __len__(self):
+        return len(self._pairs)
+
+    @staticmethod
+    def _from_record(record):
+        if record.selfie_time and record.location_time:
+            return None
+        if record.selfie_time:
+            return PendingPair(record.id, "selfie", record.selfie_time)
+        if record.location_time:
+            return PendingPair(record.id, "location", record.location_time)
+        return None
@@ -0,0 +1,137 @@
+"""
+Attendance lookup benchmark
+
+Grows a throwaway TA.db step by step and measures the latency of
+`Attendance.get_last_attendance_record` and `Attendance.get_attendance_records`
+at every step. With the (user_id, *_time) indexes the numbers should stay flat
+from 10k to 5M rows. Also times the in-memory pairing that replaces the last
+record lookup on the handlers' path, and rebuilding it from the table at startup.
+
+usage: python benchmarks/bench_attendance_lookup.py [--sizes 10000 100000 ...]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ["DB_LOCATION"] = os.path.join(tempfile.mkdtemp(), "TA.db")
+os.environ.setdefault("SUPER_HR_EMP_ID", "HR-0")
+os.environ.setdefault("SUPER_HR_NAME", "Super HR")
+os.environ.setdefault("SUPER_HR_PWD", "bench")
+
+from sqlalchemy import insert, text  # noqa: E402
+
+from attendance_state import PendingPairTracker, next_transition  # noqa: E402
+from db_backend import engine  # noqa: E402
+from migrations import init_db  # noqa: E402
+from models import Attendance  # noqa: E402
+from settings import SELFIE_LOCATION_DELAY  # noqa: E402
+from timezones import get_calendar  # noqa: E402
+
+EPOCH = datetime(2024, 1, 1)
+
+
+def grow(current: int, target: int, users: int, days: int):
+    """
+    Insert synthetic completed attendance rows until the table holds `target` rows
+    """
+    rows = []
+    with engine.begin() as conn:
+        for _ in range(current, target):
+            selfie_time = EPOCH + timedelta(
+                days=random.randrange(days), seconds=random.randrange(86400)
+            )
+            rows.append(
+                {
+                    "user_id": random.randrange(1, users + 1),
+                    "selfie_time": selfie_time,
+                    "location": {"latitude": 0.0, "longitude": 0.0},
+                    "location_time": selfie_time + timedelta(seconds=30),
+                }
+            )
+            if len(rows) == 50_000:
+                conn.execute(insert(Attendance), rows)
+                rows = []
+        if rows:
+            conn.execute(insert(Attendance), rows)
+
+
+def measure(func, samples: int):
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--samples", type=int, default=500)
+    args = parser.parse_args()
+    init_db()
+
+    def last_record():
+        day = EPOCH + timedelta(days=random.randrange(args.days), hours=10)
+        Attendance.get_last_attendance_record(random.randrange(1, args.users + 1), day)
+
+    def month_records():
+        start = EPOCH + timedelta(days=30 * random.randrange(args.days // 30))
+        Attendance.get_attendance_records(
+            start, start + timedelta(days=30), random.randrange(1, args.users + 1)
+        )
+
+    tracker = PendingPairTracker()
+    calendar = get_calendar()
+
+    def pending_pair():
+        pair = tracker.get(random.randrange(1, args.users + 1))
+        next_transition(
+            pair, "location", datetime.utcnow(), calendar, SELFIE_LOCATION_DELAY
+        )
+
+    with engine.connect() as conn:
+        plan = conn.execute(
+            text(
+                "EXPLAIN QUERY PLAN SELECT id FROM attendance WHERE user_id = 1 AND "
+                "((selfie_time >= '2024-01-01' AND selfie_time < '2024-01-02') OR "
+                "(location_time >= '2024-01-01' AND location_time < '2024-01-02'))"
+            )
+        ).fetchall()
+    print("query plan:", *[row[-1] for row in plan], sep="\n  ")
+
+    current = 0
+    for size in sorted(args.sizes):
+        grow(current, size, args.users, args.days)
+        current = size
+        start = time.perf_counter()
+        tracker.rebuild()
+        rebuild_ms = round((time.perf_counter() - start) * 1000, 3)
+        print(
+            f"rows={size:>9}",
+            f"last_record={measure(last_record, args.samples)}",
+            f"pending_pair={measure(pending_pair, args.samples)}",
+            f"month_records={measure(month_records, args.samples // 5 or 1)}",
+            f"rebuild_ms={rebuild_ms}",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+Load test of the bot handlers
+
+Builds synthetic Telegram updates for the main flows (login, selfie, live
+location and its edits, HR commands) and pushes them through
+`bot.process_new_updates` of main.py from many threads. The Telegram HTTP
+API is replaced by a local stub, and everything runs against a throwaway
+TA.db seeded with the requested number of users and attendance history.
+Prints throughput plus p50/p95/p99 handler latency per flow as JSON.
+
+usage: python benchmarks/bench_handlers.py [--users 200] [--rounds 5] [--concurrency 16] [--history 100]
+"""
+
+import argparse
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+from datetime import datetime, timedelta
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telebot import apihelper, types
+
+PASSWORD = "bench"
+CHAT_ID_BASE = 10_000_000
+
+
+def use_throwaway_database():
+    """
+    Point the bot at a fresh TA.db and selfie store in a temporary directory.
+    Settings are read when the bot's modules are imported, so call this
+    before importing any of them
+    :return: the temporary directory
+    """
+    workdir = tempfile.mkdtemp()
+    os.environ["DB_LOCATION"] = os.path.join(workdir, "TA.db")
+    os.environ["SELFIE_STORE_DIR"] = os.path.join(workdir, "selfies")
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ.setdefault("SUPER_HR_EMP_ID", "HR-0")
+    os.environ.setdefault("SUPER_HR_NAME", "Super HR")
+    os.environ.setdefault("SUPER_HR_PWD", "bench")
+    return workdir
+
+
+class StubTelegram:
+    """
+    Answers every Bot API call like Telegram would, without the network
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        with self._lock:
+            self.calls[api_method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        params = params or {}
+        return _StubResponse(
+            {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        )
+
+
+class _StubResponse:
+    status_code = 200
+
+    def __init__(self, result):
+        self.text = json.dumps({"ok": True, "result": result})
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class StubFiles:
+    """
+    Serves a small JPEG for every file_id instead of the Telegram file endpoint
+    """
+
+    def __init__(self, size: int = 800):
+        self.size = size
+
+    def fetch(self, file_id: str):
+        import hashlib
+        import io
+
+        from PIL import Image
+
+        color = tuple(hashlib.sha256(file_id.encode()).digest()[:3])
+        output = io.BytesIO()
+        Image.new("RGB", (self.size, self.size), color).save(output, "JPEG")
+        return output.getvalue()
+
+
+class Updates:
+    """
+    Synthetic updates as Telegram would deliver them
+    """
+
+    def __init__(self, latitude: float, longitude: float, live_period: int):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.live_period = live_period
+        self._ids = itertools.count(1)
+
+    def _message(self, chat_id: int, **fields):
+        message_id = next(self._ids)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+        }
+        message.update(fields)
+        return message
+
+    def _update(self, message: dict, kind: str = "message"):
+        return types.Update.de_json({"update_id": next(self._ids), kind: message})
+
+    def text(self, chat_id: int, text: str):
+        entities = None
+        if text.startswith("/"):
+            command = text.split("\n", 1)[0]
+            entities = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return self._update(self._message(chat_id, text=text, entities=entities))
+
+    def photo(self, chat_id: int):
+        photo_id = next(self._ids)
+        return self._update(
+            self._message(
+                chat_id,
+                photo=[
+                    {
+                        "file_id": f"bench-{photo_id}-{size}",
+                        "file_unique_id": f"bench-{photo_id}-{size}",
+                        "width": size,
+                        "height": size,
+                        "file_size": size * 100,
+                    }
+                    for size in (90, 320, 800)
+                ],
+            )
+        )
+
+    def live_location(self, chat_id: int):
+        message = self._message(chat_id, location=self._location())
+        return message, self._update(message)
+
+    def live_location_edit(self, message: dict):
+        edited = dict(message, edit_date=int(time.time()), location=self._location())
+        return self._update(edited, kind="edited_message")
+
+    def _location(self):
+        return {
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "live_period": self.live_period,
+        }
+
+
+def seed(users: int, hr_users: int, history: int):
+    """
+    Create employees, HR accounts, their targets and past attendance
+    """
+    from db_backend import session_scope
+    from helpers import get_hashed
+    from migrations import init_db
+    from models import Attendance, User
+
+    with session_scope() as session:
+        init_db(session=session)
+    password = get_hashed(PASSWORD)
+    accounts = [
+        {"employee_id": f"EMP-{i}", "fullname": f"Employee {i}", "role": "Employee"}
+        for i in range(users)
+    ]
+    accounts += [
+        {"employee_id": f"HR-{i + 1}", "fullname": f"HR {i + 1}", "role": "HR"}
+        for i in range(hr_users)
+    ]
+    accounts += [
+        {"employee_id": f"TARGET-{i}", "fullname": f"Target {i}", "role": "Employee"}
+        for i in range(hr_users)
+    ]
+    with session_scope() as session:
+        session.bulk_insert_mappings(
+            User, [dict(account, temp_pwd=password) for account in accounts]
+        )
+    with session_scope() as session:
+        user_ids = [user.id for user in session.query(User.id)]
+        start = datetime.utcnow() - timedelta(days=history)
+        for day in range(history):
+            selfie_time = start + timedelta(days=day)
+            session.bulk_insert_mappings(
+                Attendance,
+                [
+                    {
+                        "user_id": user_id,
+                        "selfie_time": selfie_time,
+                        "location_time": selfie_time + timedelta(seconds=30),
+                        "location": {"latitude": 0, "longitude": 0},
+                    }
+                    for user_id in user_ids
+                ],
+            )
+
+
+def employee_flow(bot, updates: Updates, record, index: int, rounds: int):
+    chat_id = CHAT_ID_BASE + index
+    record("login", bot, updates.text(chat_id, f"/login\nEMP-{index}\n{PASSWORD}"))
+    for _ in range(rounds):
+        record("selfie", bot, updates.photo(chat_id))
+        message, update = updates.live_location(chat_id)
+        record("location", bot, update)
+        record("live_update", bot, updates.live_location_edit(message))
+
+
+def hr_flow(bot, updates: Updates, record, index: int, rounds: int):
+    chat_id = CHAT_ID_BASE - 1 - index
+    record("login", bot, updates.text(chat_id, f"/login\nHR-{index + 1}\n{PASSWORD}"))
+    for _ in range(rounds):
+        record("hr", bot, updates.text(chat_id, f"/deactive\nTARGET-{index}"))
+        record("hr", bot, updates.text(chat_id, f"/reactive\nTARGET-{index}"))
+
+
+def percentiles(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": round(values[len(values) // 2], 3),
+        "p95_ms": round(values[int(len(values) * 0.95)], 3),
+        "p99_ms": round(values[int(len(values) * 0.99)], 3),
+        "max_ms": round(values[-1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--hr-users", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--history", type=int, default=100, help="past days per user")
+    parser.add_argument(
+        "--api-latency", type=float, default=0.0, help="seconds per stubbed API call"
+    )
+    parser.add_argument(
+        "--rate-limits",
+        action="store_true",
+        help="keep the outbound Telegram rate limits instead of sending at once",
+    )
+    args = parser.parse_args()
+    use_throwaway_database()
+
+    stub = StubTelegram(args.api_latency)
+    apihelper.CUSTOM_REQUEST_SENDER = stub
+
+    # the handlers log a line per update; keep stdout for the result
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import main as bot_main
+        from log import stop_logging
+        from settings import MIN_LIVE_LOCATION_DURATION, OFFICE_LAT, OFFICE_LNG
+
+        seed(args.users, args.hr_users, args.history)
+        bot_main.load_index()
+        bot_main.pending_pairs.rebuild()
+        bot_main.selfie_fetcher.source = StubFiles()
+        bot = bot_main.bot
+        bot.threaded = False  # run handlers on the calling thread to time them
+        if not args.rate_limits:
+            bot_main.outbox.global_rate = float("inf")
+            bot_main.outbox.per_chat_interval = 0
+
+        updates = Updates(OFFICE_LAT, OFFICE_LNG, MIN_LIVE_LOCATION_DURATION * 2)
+        latencies = defaultdict(list)
+        lock = threading.Lock()
+
+        def record(flow: str, bot, update):
+            start = time.perf_counter()
+            bot.process_new_updates([update])
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies[flow].append(elapsed)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            futures = [
+                pool.submit(employee_flow, bot, updates, record, i, args.rounds)
+                for i in range(args.users)
+            ]
+            futures += [
+                pool.submit(hr_flow, bot, updates, record, i, args.rounds)
+                for i in range(args.hr_users)
+            ]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        deadline = time.monotonic() + 60
+        while bot_main.outbox.stats()["queued"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        from db_backend import session_scope
+        from models import Attendance, Selfie
+
+        with session_scope() as session:
+            completed = (
+                session.query(Attendance)
+                .filter(
+                    Attendance.selfie_time.isnot(None),
+                    Attendance.location_time.isnot(None),
+                )
+                .count()
+            )
+        bot_main.selfie_fetcher.stop()
+        with session_scope() as session:
+            downloaded = session.query(Selfie).filter(Selfie.sha256.isnot(None)).count()
+        stop_logging()  # flush before stdout is restored
+
+    handled = sum(len(values) for values in latencies.values())
+    print(
+        json.dumps(
+            {
+                "users": args.users,
+                "hr_users": args.hr_users,
+                "rounds": args.rounds,
+                "concurrency": args.concurrency,
+                "history_days": args.history,
+                "updates": handled,
+                "seconds": round(elapsed, 3),
+                "updates_per_second": round(handled / elapsed, 1),
+                "flows": {
+                    flow: dict(
+                        percentiles(values),
+                        per_second=round(len(values) / elapsed, 1),
+                    )
+                    for flow, values in sorted(latencies.items())
+                },
+                "completed_attendance": completed,
+                "selfies_downloaded": downloaded,
+                "api_calls": dict(stub.calls),
+                "outbound": bot_main.outbox.stats(),
+                "write_behind": bot_main.attendance_writer.stats(),
+                "pending_pairs": bot_main.pending_pairs.stats(),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Attendance latency during a login burst
+
+Runs the selfie/live location flow of logged in employees through
+`bot.process_new_updates`, first alone and then while other threads keep
+sending /login updates whose OTPs are verified with scrypt. The burst runs
+once with the credential service's process pool and once with hashing done
+inline on the handler threads, to show what the pool buys. Prints p50/p95/p99
+latencies as JSON.
+
+usage: python benchmarks/bench_login_burst.py [--employees 100] [--login-users 50] [--login-threads 8]
+"""
+
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_handlers import (  # noqa: E402
+    CHAT_ID_BASE,
+    PASSWORD,
+    StubTelegram,
+    Updates,
+    percentiles,
+    seed,
+    use_throwaway_database,
+)
+from telebot import apihelper  # noqa: E402
+
+
+class InlineCredentialService:
+    """
+    Same interface as CredentialService, hashing on the calling thread
+    """
+
+    def hash(self, password: str, timeout: float = None):
+        from credentials import hash_password
+
+        return hash_password(password)
+
+    def verify(self, password: str, stored: str, timeout: float = None):
+        from credentials import verify_password
+
+        return verify_password(password, stored)
+
+
+def attendance_rounds(bot, updates, employees: int, rounds: int, concurrency: int):
+    latencies = defaultdict(list)
+    lock = threading.Lock()
+
+    def record(flow: str, update):
+        start = time.perf_counter()
+        bot.process_new_updates([update])
+        with lock:
+            latencies[flow].append((time.perf_counter() - start) * 1000)
+
+    def flow(index: int):
+        chat_id = CHAT_ID_BASE + index
+        for _ in range(rounds):
+            record("selfie", updates.photo(chat_id))
+            message, update = updates.live_location(chat_id)
+            record("location", update)
+            record("live_update", updates.live_location_edit(message))
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(flow, i) for i in range(employees)]:
+            future.result()
+    return latencies
+
+
+def login_burst(bot, updates, first: int, users: int, threads: int, stop):
+    latencies = []
+    lock = threading.Lock()
+
+    def login(thread: int):
+        index = thread
+        while not stop.is_set():
+            user = first + index % users
+            update = updates.text(
+                CHAT_ID_BASE + user, f"/login\nEMP-{user}\n{PASSWORD}"
+            )
+            start = time.perf_counter()
+            bot.process_new_updates([update])
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+            index += threads
+
+    workers = [threading.Thread(target=login, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    return workers, latencies
+
+
+def summary(latencies: dict):
+    return {flow: percentiles(values) for flow, values in sorted(latencies.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--employees", type=int, default=100)
+    parser.add_argument("--login-users", type=int, default=50)
+    parser.add_argument("--login-threads", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    use_throwaway_database()
+
+    apihelper.CUSTOM_REQUEST_SENDER = StubTelegram()
+    result = {
+        "employees": args.employees,
+        "login_users": args.login_users,
+        "login_threads": args.login_threads,
+        "cpus": os.cpu_count(),
+    }
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import main as bot_main
+        import models
+        from credentials import credential_service
+        from log import stop_logging
+        from settings import MIN_LIVE_LOCATION_DURATION, OFFICE_LAT, OFFICE_LNG
+
+        seed(args.employees + args.login_users, 0, 0)
+        bot_main.load_index()
+        credential_service.start()
+        bot = bot_main.bot
+        bot.threaded = False
+        bot_main.outbox.global_rate = float("inf")
+        bot_main.outbox.per_chat_interval = 0
+        updates = Updates(OFFICE_LAT, OFFICE_LNG, MIN_LIVE_LOCATION_DURATION * 2)
+
+        # log everyone in once; this also upgrades their legacy hashes
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            for i in range(args.employees + args.login_users):
+                pool.submit(
+                    bot.process_new_updates,
+                    [updates.text(CHAT_ID_BASE + i, f"/login\nEMP-{i}\n{PASSWORD}")],
+                )
+
+        baseline = attendance_rounds(
+            bot, updates, args.employees, args.rounds, args.concurrency
+        )
+        result["baseline"] = summary(baseline)
+
+        for mode, service in (
+            ("process_pool", credential_service),
+            ("inline", InlineCredentialService()),
+        ):
+            models.credential_service = service
+            stop = threading.Event()
+            workers, logins = login_burst(
+                bot,
+                updates,
+                args.employees,
+                args.login_users,
+                args.login_threads,
+                stop,
+            )
+            start = time.perf_counter()
+            during = attendance_rounds(
+                bot, updates, args.employees, args.rounds, args.concurrency
+            )
+            stop.set()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+            result[mode] = dict(
+                summary(during),
+                login=dict(
+                    percentiles(logins), per_second=round(len(logins) / elapsed, 1)
+                ),
+            )
+        models.credential_service = credential_service
+        stop_logging()
+    credential_service.stop()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
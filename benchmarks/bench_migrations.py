@@ -0,0 +1,312 @@
+"""
+Schema migrations on a multi-million-row database of an old release
+
+Builds a throwaway TA.db with the original schema (selfies as JSON on
+attendance, no selfie or summary tables, no indexes) holding the requested
+number of attendance rows, then runs `migrations.migrate` while a writer
+thread keeps inserting check-ins like a serving bot. Every backfill is
+interrupted once midway and resumed by running migrate again. Checks that
+every selfie was moved exactly once and that the summaries match a full
+rebuild, and prints the time of each migration plus the latency of the
+concurrent writes during each as JSON. Exits non-zero if a check fails.
+
+usage: python benchmarks/bench_migrations.py [--rows 2000000] [--users 2000]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_handlers import percentiles, use_throwaway_database  # noqa: E402
+
+EPOCH = datetime(2024, 1, 1)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # how SQLAlchemy stores DateTime in sqlite
+
+LEGACY_SCHEMA = """
+CREATE TABLE user_account (
+    id INTEGER PRIMARY KEY, employee_id VARCHAR(30) UNIQUE,
+    fullname VARCHAR(30), role VARCHAR(10), temp_pwd VARCHAR(10),
+    last_chat_id VARCHAR(10), is_active BOOLEAN, is_pwd_expired BOOLEAN,
+    is_logged_in BOOLEAN
+);
+CREATE TABLE attendance (
+    id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES user_account (id),
+    selfie JSON UNIQUE, selfie_time DATETIME, location JSON,
+    location_time DATETIME
+);
+"""
+
+# a full rebuild of the summaries, to compare the batched backfill with
+EXPECTED_SUMMARY = """
+SELECT user_id, date(check_in, '+330 minutes') AS day, min(check_in),
+       max(check_in), count(*)
+FROM (
+    SELECT user_id, max(selfie_time, location_time) AS check_in
+    FROM attendance
+    WHERE selfie_time IS NOT NULL AND location_time IS NOT NULL
+)
+GROUP BY user_id, day
+"""
+
+
+class Interrupted(Exception):
+    pass
+
+
+def build_legacy(path: str, rows: int, users: int, reused: float):
+    """
+    Old release database; a share of selfies reuses an earlier photo
+    :return: number of distinct photos
+    """
+    connection = sqlite3.connect(path)
+    connection.executescript(LEGACY_SCHEMA)
+    connection.executemany(
+        "INSERT INTO user_account VALUES (?, ?, ?, 'Employee', '', ?, 1, 0, 1)",
+        ((i, f"EMP-{i}", f"Employee {i}", str(i)) for i in range(1, users + 1)),
+    )
+    photos = 0
+
+    def attendance():
+        nonlocal photos
+        for i in range(rows):
+            if photos and random.random() < reused:
+                photo = random.randrange(photos)
+            else:
+                photo, photos = photos, photos + 1
+            selfie = json.dumps(
+                [
+                    {
+                        "file_id": f"small-{i}",
+                        "file_unique_id": f"small-{photo}",
+                        "width": 90,
+                        "height": 90,
+                        "file_size": 1000,
+                    },
+                    {
+                        "file_id": f"large-{i}",
+                        "file_unique_id": f"large-{photo}",
+                        "width": 1280,
+                        "height": 1280,
+                        "file_size": 100000,
+                    },
+                ]
+            )
+            selfie_time = EPOCH + timedelta(seconds=random.randrange(365 * 86400))
+            completed = random.random() < 0.95
+            yield (
+                random.randrange(1, users + 1),
+                selfie,
+                selfie_time.strftime(TIMESTAMP_FORMAT),
+                '{"latitude": 0.0, "longitude": 0.0}' if completed else None,
+                (
+                    (selfie_time + timedelta(seconds=45)).strftime(TIMESTAMP_FORMAT)
+                    if completed
+                    else None
+                ),
+            )
+
+    connection.executemany(
+        "INSERT INTO attendance (user_id, selfie, selfie_time, location, location_time)"
+        " VALUES (?, ?, ?, ?, ?)",
+        attendance(),
+    )
+    connection.commit()
+    connection.close()
+    return photos
+
+
+class Writer(threading.Thread):
+    """
+    Inserts a check-in every `interval` seconds the way both the old and
+    the new bot can (pending, without a selfie), timing each commit
+    """
+
+    def __init__(self, users: int, interval: float):
+        super().__init__(daemon=True)
+        self.users = users
+        self.interval = interval
+        self.phase = "schema"
+        self.latencies = {}
+        self.errors = 0
+        self._stopping = threading.Event()
+
+    def run(self):
+        from sqlalchemy import text
+
+        from db_backend import engine
+
+        while not self._stopping.wait(self.interval):
+            phase, start = self.phase, time.perf_counter()
+            try:
+                with engine.begin() as connection:
+                    connection.execute(
+                        text(
+                            "INSERT INTO attendance (user_id, selfie_time)"
+                            " VALUES (:user_id, :now)"
+                        ),
+                        {
+                            "user_id": random.randrange(1, self.users + 1),
+                            "now": datetime.utcnow(),
+                        },
+                    )
+            except Exception:
+                self.errors += 1
+                continue
+            latency = (time.perf_counter() - start) * 1000
+            self.latencies.setdefault(phase, []).append(latency)
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+
+def run_migrations(writer: Writer, batch_size: int, pause: float, interrupt_after: int):
+    """
+    Migrate, interrupting every backfill once after `interrupt_after`
+    batches and resuming it
+    :return: {migration: seconds}, {migration: position it was resumed
+        from}, {migration: milliseconds of each batch}
+    """
+    from db_backend import session_scope
+    from migrations import MIGRATIONS, migrate
+    from models import SchemaMigration
+
+    seconds, resumed_at, batches, batch_ms = {}, {}, {}, {}
+    for migration in MIGRATIONS:
+        if migration.schema is not None:
+
+            def timed(bind, migration=migration, schema=migration.schema):
+                writer.phase = migration.name
+                start = time.perf_counter()
+                schema(bind)
+                seconds[migration.name] = time.perf_counter() - start
+
+            migration.schema = timed
+
+    last_batch = time.perf_counter()
+
+    def on_batch(migration, position):
+        nonlocal last_batch
+        now = time.perf_counter()
+        batch_ms.setdefault(migration.name, []).append((now - last_batch) * 1000)
+        writer.phase, last_batch = migration.name, now
+        batches[migration.name] = batches.get(migration.name, 0) + 1
+        if batches[migration.name] == interrupt_after:
+            resumed_at[migration.name] = position
+            raise Interrupted
+
+    while True:
+        try:
+            with session_scope() as session:
+                migrate(batch_size, pause, on_batch, session=session)
+            break
+        except Interrupted:
+            pass  # run again, the backfill resumes from its last batch
+
+    with session_scope() as session:
+        for row in session.query(SchemaMigration):
+            if row.name not in seconds:
+                seconds[row.name] = (row.applied_at - row.started_at).total_seconds()
+    return seconds, resumed_at, batch_ms
+
+
+def check(photos: int):
+    """
+    :return: {check: passed}
+    """
+    from db_backend import engine
+
+    with engine.connect() as connection:
+
+        def scalar(sql):
+            return connection.exec_driver_sql(sql).scalar()
+
+        actual = (
+            "SELECT user_id, date, first_check_in, last_check_in, completed_pairs"
+            " FROM daily_attendance_summary"
+        )
+        return {
+            "selfies_moved_once": scalar("SELECT count(*) FROM selfie") == photos,
+            "no_json_selfies_left": scalar(
+                "SELECT count(*) FROM attendance WHERE selfie IS NOT NULL"
+            )
+            == 0,
+            "summaries_match_full_rebuild": scalar(
+                f"SELECT count(*) FROM ({EXPECTED_SUMMARY} EXCEPT {actual})"
+            )
+            == 0
+            and scalar(f"SELECT count(*) FROM ({actual} EXCEPT {EXPECTED_SUMMARY})")
+            == 0,
+            "all_applied": scalar(
+                "SELECT count(*) FROM schema_migration WHERE applied_at IS NULL"
+            )
+            == 0,
+        }
+
+
+def main():
+    use_throwaway_database()
+    from settings import MIGRATION_BATCH_SIZE, MIGRATION_PAUSE
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument(
+        "--reused", type=float, default=0.01, help="share of reused photos"
+    )
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument(
+        "--pause",
+        type=float,
+        default=MIGRATION_PAUSE,
+        help="seconds between batches",
+    )
+    parser.add_argument(
+        "--interrupt-after", type=int, default=3, help="batches before interrupting"
+    )
+    parser.add_argument(
+        "--write-interval", type=float, default=0.02, help="seconds between writes"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    photos = build_legacy(os.environ["DB_LOCATION"], args.rows, args.users, args.reused)
+    result = {"rows": args.rows, "build_s": round(time.perf_counter() - start, 3)}
+
+    writer = Writer(args.users, args.write_interval)
+    writer.start()
+    seconds, resumed_at, batch_ms = run_migrations(
+        writer, args.batch_size, args.pause, args.interrupt_after
+    )
+    writer.stop()
+
+    result["migrations"] = {
+        name: {
+            "seconds": round(elapsed, 3),
+            "batches": percentiles(batch_ms[name]) if name in batch_ms else None,
+            "resumed_at": resumed_at.get(name),
+            "writes": (
+                percentiles(writer.latencies[name])
+                if writer.latencies.get(name)
+                else None
+            ),
+        }
+        for name, elapsed in seconds.items()
+    }
+    result["write_errors"] = writer.errors
+    result["checks"] = check(photos)
+    print(json.dumps(result, indent=2))
+    if writer.errors or not all(result["checks"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Cold start of the bot
+
+Initializes a throwaway database with `manage.py init`, then starts fresh
+interpreters that import main.py and handle one /start update against a
+stubbed Telegram API. Reports the median import time, time to the first
+handled update and whole process time, plus the slowest imports from
+`python -X importtime`, as JSON. Track these to catch startup regressions.
+
+usage: python benchmarks/bench_startup.py [--runs 5] [--top 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+# runs in the fresh interpreter; stdout carries the bot's logs, so the
+# result goes to stderr
+CHILD = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+sys.path.insert(0, {BENCH_DIR!r})
+from bench_handlers import StubTelegram, Updates
+from telebot import apihelper
+
+stub = apihelper.CUSTOM_REQUEST_SENDER = StubTelegram()
+main.bot.threaded = False
+update = Updates(0, 0, 60).text(1, "/start")
+handling = time.perf_counter()
+main.bot.process_new_updates([update])
+while not stub.calls:  # the reply leaves through the outbound queue
+    time.sleep(0.0005)
+handled = time.perf_counter()
+print(json.dumps({{
+    "import_s": imported - start,
+    "first_update_s": imported - start + handled - handling,
+}}), file=sys.stderr)
+"""
+
+
+def environment(directory: str):
+    env = dict(os.environ)
+    env.update(
+        DB_LOCATION=os.path.join(directory, "TA.db"),
+        SELFIE_STORE_DIR=os.path.join(directory, "selfies"),
+        REPORT_CACHE_DIR=os.path.join(directory, "reports"),
+        BOT_TOKEN="0:bench",
+        SUPER_HR_EMP_ID="HR-0",
+        SUPER_HR_NAME="Super HR",
+        SUPER_HR_PWD="bench",
+        METRICS_PORT="0",
+        PYTHONPATH=os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")])),
+    )
+    return env
+
+
+def run(args: list, env: dict):
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, *args],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    return time.perf_counter() - start, process.stderr
+
+
+def slowest_imports(env: dict, top: int):
+    _, output = run(["-X", "importtime", "-c", "import main"], env)
+    imports = []
+    for line in output.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                imports.append((int(cumulative), name.strip()))
+    imports.sort(reverse=True)
+    return {name: round(micros / 1e6, 4) for micros, name in imports[:top]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports listed")
+    args = parser.parse_args()
+
+    env = environment(tempfile.mkdtemp())
+    init_seconds, _ = run(["manage.py", "init"], env)
+    samples = []
+    for _ in range(args.runs):
+        process_seconds, output = run(["-c", CHILD], env)
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["process_s"] = process_seconds
+        samples.append(sample)
+
+    print(
+        json.dumps(
+            {
+                "runs": args.runs,
+                "init_s": round(init_seconds, 4),
+                **{
+                    key: round(statistics.median(s[key] for s in samples), 4)
+                    for key in ("import_s", "first_update_s", "process_s")
+                },
+                "slowest_imports_s": slowest_imports(env, args.top),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
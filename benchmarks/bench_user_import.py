@@ -0,0 +1,127 @@
+"""
+Bulk user import against one /create per employee
+
+Writes a CSV and an XLSX list of new employees, imports each with
+`user_import.import_users` (streamed parse, full validation, parallel OTP
+hashing, one executemany), and compares with what onboarding the same
+number of people through /create costs: one hash and one commit per user.
+Prints seconds and users per second of each as JSON.
+
+usage: python benchmarks/bench_user_import.py [--users 2000]
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_handlers import use_throwaway_database  # noqa: E402
+
+COLUMNS = ["Employee ID", "Full name", "Role", "OTP"]
+
+
+def employees(prefix: str, count: int):
+    return [
+        [f"{prefix}-{i}", f"Employee {i}", "Employee", f"{i:06d}"] for i in range(count)
+    ]
+
+
+def write_csv(path: str, rows: list):
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+
+def write_xlsx(path: str, rows: list):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def one_by_one(rows: list, credential_service):
+    """
+    What /create does for every row
+    """
+    from db_backend import db_session
+    from models import User
+
+    for employee_id, fullname, role, otp in rows:
+        db_session.add(
+            User(
+                employee_id=employee_id,
+                fullname=fullname,
+                role=role,
+                temp_pwd=credential_service.hash(otp),
+            )
+        )
+        db_session.commit()
+    db_session.remove()
+
+
+def bulk(path: str, credential_service):
+    from db_backend import db_session
+    from user_import import import_users
+
+    created, errors = import_users(path, credential_service)
+    assert not errors, errors[:5]
+    db_session.remove()
+    return created
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+    use_throwaway_database()
+
+    result = {"users": args.users, "cpus": os.cpu_count()}
+    directory = tempfile.mkdtemp()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        from credentials import credential_service
+        from db_backend import session_scope
+        from migrations import init_db
+
+        with session_scope() as session:
+            init_db(session=session)
+        credential_service.start()
+        runs = {
+            "create_one_by_one": lambda: one_by_one(
+                employees("ONE", args.users), credential_service
+            ),
+        }
+        for extension, writer in ((".csv", write_csv), (".xlsx", write_xlsx)):
+            path = os.path.join(directory, "users" + extension)
+            writer(path, employees(extension[1:].upper(), args.users))
+            runs["import" + extension.replace(".", "_")] = lambda path=path: bulk(
+                path, credential_service
+            )
+        for name, run in runs.items():
+            seconds = timed(run)
+            result[name] = {
+                "seconds": round(seconds, 3),
+                "users_per_second": round(args.users / seconds, 1),
+            }
+        credential_service.stop()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
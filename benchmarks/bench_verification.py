@@ -0,0 +1,146 @@
+"""
+Selfie verification throughput at peak check-in
+
+Seeds employees with an enrolled reference photo and a morning's worth of
+check-in selfies (a noisy copy of the reference, or another employee's
+photo for a share of impostors), then verifies every selfie the way the
+selfie fetcher does, from several threads, once per pool size. Prints
+selfies per second, p50/p95/p99 latency per verification and how many were
+matched as JSON.
+
+usage: python benchmarks/bench_verification.py [--employees 500] [--impostors 0.1] [--threads 8]
+"""
+
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_handlers import percentiles, seed, use_throwaway_database  # noqa: E402
+
+
+def photo(seed_value: int, noise: int = 0, size: int = 640):
+    """
+    JPEG of a random blocky "face" for a seed, with optional pixel noise
+    standing in for another shot of the same person
+    """
+    import numpy
+    from PIL import Image
+
+    blocks = numpy.random.default_rng(seed_value).integers(0, 256, (8, 8, 3))
+    pixels = numpy.kron(blocks, numpy.ones((size // 8, size // 8, 1)))
+    if noise:
+        rng = numpy.random.default_rng()
+        pixels = pixels + rng.integers(-noise, noise + 1, pixels.shape)
+    image = Image.fromarray(pixels.clip(0, 255).astype("uint8"))
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=85)
+    return output.getvalue()
+
+
+def enroll(store, employees: int, impostors: float):
+    """
+    Enroll a reference per employee and add one check-in selfie each
+    :return: (file_unique_id, sha256) of every check-in
+    """
+    from db_backend import session_scope
+    from models import Attendance, Selfie, User
+
+    checkins = []
+    with session_scope() as session:
+        users = session.query(User).filter(User.employee_id.like("EMP-%")).all()
+        for index, user in enumerate(users[:employees]):
+            user.reference_sha256 = store.put(photo(index))
+            impostor = random.random() < impostors
+            sha256 = store.put(
+                photo((index + 1) % employees) if impostor else photo(index, noise=20)
+            )
+            selfie = Selfie(
+                file_unique_id=f"checkin-{index}",
+                user_id=user.id,
+                file_id=f"checkin-{index}",
+                sha256=sha256,
+            )
+            session.add(
+                Attendance(
+                    user_id=user.id, selfie=selfie, selfie_time=datetime.utcnow()
+                )
+            )
+            checkins.append((selfie.file_unique_id, sha256))
+    return checkins
+
+
+def run(verifier, checkins: list, threads: int):
+    latencies = []
+
+    def verify(checkin):
+        start = time.perf_counter()
+        outcome = verifier.verify(*checkin)
+        latencies.append((time.perf_counter() - start) * 1000)
+        return outcome
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        outcomes = list(pool.map(verify, checkins))
+    elapsed = time.perf_counter() - start
+    return dict(
+        percentiles(latencies),
+        per_second=round(len(checkins) / elapsed, 1),
+        outcomes={outcome: outcomes.count(outcome) for outcome in set(outcomes)},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--employees", type=int, default=500)
+    parser.add_argument(
+        "--impostors", type=float, default=0.1, help="share of someone else's photo"
+    )
+    parser.add_argument("--threads", type=int, default=8, help="fetcher threads")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, os.cpu_count()}),
+        help="pool sizes to compare",
+    )
+    args = parser.parse_args()
+    use_throwaway_database()
+
+    result = {"employees": args.employees, "cpus": os.cpu_count(), "runs": {}}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        from log import setup_logging, stop_logging
+        from selfie_store import SelfieStore
+        from settings import SELFIE_MATCH_MAX_DISTANCE, SELFIE_STORE_DIR
+        from verification import SelfieVerifier
+
+        setup_logging()
+        seed(args.employees, 0, 0)
+        store = SelfieStore(SELFIE_STORE_DIR)
+        checkins = enroll(store, args.employees, args.impostors)
+        for workers in args.workers:
+            verifier = SelfieVerifier(
+                store, workers, max_distance=SELFIE_MATCH_MAX_DISTANCE
+            ).start()
+            try:
+                # first pass hashes every reference, the second finds them cached
+                result["runs"][f"workers_{workers}"] = {
+                    "cold_cache": run(verifier, checkins, args.threads),
+                    "warm_cache": run(verifier, checkins, args.threads),
+                }
+            finally:
+                verifier.stop()
+        stop_logging()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Group commit benchmark
+
+Inserts attendance rows from many threads, once with a commit per row (the
+old handler behaviour) and once through WriteBehindQueue, and prints the
+throughput plus the batch size / commit latency distribution as JSON.
+
+usage: python benchmarks/bench_write_behind.py [--threads 32] [--rows 200]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ["DB_LOCATION"] = os.path.join(tempfile.mkdtemp(), "TA.db")
+os.environ.setdefault("SUPER_HR_EMP_ID", "HR-0")
+os.environ.setdefault("SUPER_HR_NAME", "Super HR")
+os.environ.setdefault("SUPER_HR_PWD", "bench")
+
+from db_backend import db_session  # noqa: E402
+from migrations import init_db  # noqa: E402
+from models import Attendance  # noqa: E402
+from write_behind import WriteBehindQueue  # noqa: E402
+
+
+def commit_per_row(user_id: int, rows: int):
+    for _ in range(rows):
+        db_session.add(Attendance(user_id=user_id, selfie_time=datetime.utcnow()))
+        db_session.commit()
+    db_session.remove()
+
+
+def group_commit(writer: WriteBehindQueue):
+    def worker(user_id: int, rows: int):
+        for _ in range(rows):
+            attendance = Attendance(user_id=user_id, selfie_time=datetime.utcnow())
+            writer.submit(lambda session: session.add(attendance)).result()
+
+    return worker
+
+
+def run(worker, threads: int, rows: int):
+    pool = [
+        threading.Thread(target=worker, args=(i, rows)) for i in range(1, threads + 1)
+    ]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(threads * rows / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--max-batch", type=int, default=200)
+    parser.add_argument("--max-delay", type=float, default=0.005)
+    args = parser.parse_args()
+    init_db()
+
+    writer = WriteBehindQueue(args.max_batch, args.max_delay)
+    result = {
+        "commit_per_row": run(commit_per_row, args.threads, args.rows),
+        "group_commit": run(group_commit(writer), args.threads, args.rows),
+    }
+    writer.stop()
+    result["group_commit"].update(writer.stats())
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
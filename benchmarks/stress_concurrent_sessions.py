@@ -0,0 +1,165 @@
+"""
+Concurrency stress test for the session-per-update database layer
+
+Runs many threads against one throwaway TA.db, each doing what the selfie and
+location handlers do (lookup user, read last record, insert or update, commit,
+release session). Exits non-zero if any unit of work failed or any write was lost.
+
+usage: python benchmarks/stress_concurrent_sessions.py [--threads 32] [--updates 200]
+"""
+
+import argparse
+from contextlib import contextmanager
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def use_throwaway_database():
+    """
+    Point the bot at a fresh TA.db in a temporary directory. Settings are
+    read when the bot's modules are imported, so call this before importing
+    any of them
+    :return: the temporary directory
+    """
+    workdir = tempfile.mkdtemp()
+    os.environ["DB_LOCATION"] = os.path.join(workdir, "TA.db")
+    os.environ.setdefault("SUPER_HR_EMP_ID", "HR-0")
+    os.environ.setdefault("SUPER_HR_NAME", "Super HR")
+    os.environ.setdefault("SUPER_HR_PWD", "stress")
+    return workdir
+
+
+@contextmanager
+def unit_of_work(sessions):
+    """
+    `session_scope` for any scoped session: commit on success, rollback on
+    error and always release the thread's session
+    """
+    try:
+        yield sessions
+        sessions.commit()
+    except Exception:
+        sessions.rollback()
+        raise
+    finally:
+        sessions.remove()
+
+
+def worker(index: int, updates: int, errors: list, sessions=None):
+    """
+    Register one employee and alternate selfie and location writes for them
+    :param index: number of the employee, unique per thread
+    :param updates: units of work after the registration
+    :param errors: list the failed units of work are appended to
+    :param sessions: scoped session to be used instead of the bot's `db_session`
+    """
+    from models import Attendance, User
+
+    if sessions is None:
+        from db_backend import db_session as sessions
+
+    chat_id = str(1000 + index)
+    with unit_of_work(sessions) as session:
+        session.add(
+            User(employee_id=f"E{index}", fullname=f"E{index}", last_chat_id=chat_id)
+        )
+
+    now = datetime(2024, 1, 1, 4)
+    for step in range(updates):
+        now += timedelta(seconds=10)
+        try:
+            with unit_of_work(sessions) as session:
+                user = User.get_by_chat_id(chat_id, session=session)
+                last = Attendance.get_last_attendance_record(
+                    user.id, now, session=session
+                )
+                if step % 2 == 0 or last is None:
+                    session.add(Attendance(user_id=user.id, selfie_time=now))
+                else:
+                    last.location = {"latitude": 0.0, "longitude": 0.0}
+                    last.location_time = now
+        except Exception as e:  # noqa: BLE001
+            errors.append(f"{chat_id}: {e}")
+
+
+def run(threads: int, updates: int, sessions=None):
+    """
+    Run `worker` on as many threads and count what reached the database
+    :param threads: number of concurrent workers
+    :param updates: units of work per worker
+    :param sessions: scoped session to be used instead of the bot's `db_session`
+    :return: dict of errors, rows, completed pairs, expected counts and seconds
+    """
+    from models import Attendance
+
+    if sessions is None:
+        from db_backend import db_session as sessions
+
+    errors = []
+    workers = [
+        threading.Thread(target=worker, args=(i, updates, errors, sessions))
+        for i in range(threads)
+    ]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    expected_rows = threads * ((updates + 1) // 2)
+    completed = (
+        sessions.query(Attendance).filter(Attendance.location_time.isnot(None)).count()
+    )
+    rows = sessions.query(Attendance).count()
+    sessions.remove()
+    return {
+        "errors": errors,
+        "rows": rows,
+        "completed": completed,
+        "expected_rows": expected_rows,
+        "expected_completed": threads * updates - expected_rows,
+        "elapsed": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--updates", type=int, default=200)
+    args = parser.parse_args()
+    use_throwaway_database()
+
+    from migrations import init_db
+
+    init_db()
+    result = run(args.threads, args.updates)
+
+    total = args.threads * args.updates
+    errors = result["errors"]
+    print(
+        f"{total} units of work in {result['elapsed']:.2f}s ({total / result['elapsed']:.0f}/s)"
+    )
+    print(
+        f"rows={result['rows']} (expected {result['expected_rows']}), "
+        f"completed pairs={result['completed']}, errors={len(errors)}"
+    )
+    for error in errors[:10]:
+        print("  ", error)
+    if (
+        errors
+        or result["rows"] != result["expected_rows"]
+        or result["completed"] != result["expected_completed"]
+    ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
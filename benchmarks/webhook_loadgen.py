@@ -0,0 +1,110 @@
+"""
+Local stand-in for Telegram's webhook delivery
+
+Posts synthetic text updates to a webhook receiver as fast as the given
+concurrency allows and reports the ingestion rate and response codes.
+Without --url it starts its own WebhookServer around a bot with a single
+no-op handler, which measures the receiver alone.
+
+usage: python benchmarks/webhook_loadgen.py [--url http://127.0.0.1:8443/webhook] [--updates 20000]
+"""
+
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from webhook import SECRET_HEADER, WebhookServer  # noqa: E402
+
+
+def synthetic_update(update_id: int):
+    chat_id = 100_000 + update_id % 5_000
+    return json.dumps(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "load"},
+                "text": "hello",
+            },
+        }
+    ).encode()
+
+
+def post_updates(url: str, secret: str, update_ids, statuses: Counter, lock):
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    local = Counter()
+    for update_id in update_ids:
+        connection.request(
+            "POST",
+            parts.path,
+            body=synthetic_update(update_id),
+            headers={"Content-Type": "application/json", SECRET_HEADER: secret},
+        )
+        response = connection.getresponse()
+        response.read()
+        local[response.status] += 1
+    connection.close()
+    with lock:
+        statuses.update(local)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url")
+    parser.add_argument("--secret", default="loadgen-secret")
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    server = None
+    handled = Counter()
+    if not args.url:
+        import telebot
+
+        bot = telebot.TeleBot("0:loadgen", threaded=False)
+
+        @bot.message_handler(func=lambda msg: True)
+        def count(message):
+            handled["updates"] += 1
+
+        server = WebhookServer(bot, args.secret, "127.0.0.1", 0, queue_size=10_000)
+        server.start()
+        args.url = f"http://127.0.0.1:{server.port}/webhook"
+
+    statuses, lock = Counter(), threading.Lock()
+    chunks = [range(i, args.updates, args.concurrency) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for chunk in chunks:
+            pool.submit(post_updates, args.url, args.secret, chunk, statuses, lock)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "updates": args.updates,
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(args.updates / elapsed),
+        "statuses": dict(statuses),
+    }
+    if server:
+        while not server.updates.empty():
+            time.sleep(0.01)
+        server.stop()
+        result["handled"] = handled["updates"]
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class IdentityCache:
+    """
+    Bounded LRU cache with a per-entry TTL, safe to share between handler threads.
+    Every entry belongs to an owner (e.g. a user ID) so that all entries of an
+    owner can be dropped at once when its record changes.
+    A value read from the database before an invalidation must not be cached
+    after it: callers take `generation()` before their query and pass it to
+    `put`, which skips the value when its owner or key was invalidated since.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        :param maxsize: maximum number of entries kept
+        :param ttl: seconds after which an entry is considered stale
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {key: (owner, value, expires_at)}
+        self._owners = {}  # {owner: {key, ...}}
+        # {("owner", owner) or ("key", key): generation of its last invalidation},
+        # oldest first; generations up to `_forgotten` are no longer tracked
+        self._invalidated = OrderedDict()
+        self._generation = 0
+        self._forgotten = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def get(self, key):
+        """
+        Get a fresh value for key or None
+        :param key: cache key
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] < time.monotonic():
+                self._drop(key)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self):
+        """
+        Current generation, to be taken before reading a value for `put`
+        """
+        with self._lock:
+            return self._generation
+
+    def put(self, key, value, owner, generation: int = None):
+        """
+        Store value for key, evicting the least recently used entries when full
+        :param key: cache key
+        :param value: value to be cached
+        :param owner: owner of the entry, used by `invalidate`
+        :param generation: `generation()` taken before value was read; the
+            value is not stored if owner or key was invalidated since
+        :return: whether the value was stored
+        """
+        with self._lock:
+            if generation is not None and (
+                generation < self._forgotten
+                or self._invalidated.get(("owner", owner), 0) > generation
+                or self._invalidated.get(("key", key), 0) > generation
+            ):
+                self.stale_puts += 1
+                return False
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (owner, value, time.monotonic() + self.ttl)
+            self._owners.setdefault(owner, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    def invalidate(self, owners=(), keys=()):
+        """
+        Drop every entry of the given owners and the given keys
+        :param owners: owners whose entries should be dropped
+        :param keys: individual keys to be dropped
+        """
+        with self._lock:
+            for owner in owners:
+                self._bump(("owner", owner))
+                for key in list(self._owners.get(owner, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+            for key in keys:
+                self._bump(("key", key))
+                if key in self._entries:
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._owners.clear()
+            self._generation += 1
+            self._forgotten = self._generation
+            self._invalidated.clear()
+
+    def stats(self):
+        """
+        Counters of the cache
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
+
+    def _bump(self, name):
+        # record an invalidation; past maxsize the oldest records are
+        # forgotten and puts from before them are refused outright
+        self._generation += 1
+        self._invalidated.pop(name, None)
+        self._invalidated[name] = self._generation
+        while len(self._invalidated) > self.maxsize:
+            _, generation = self._invalidated.popitem(last=False)
+            self._forgotten = generation
+
+    def _drop(self, key):
+        owner, _, _ = self._entries.pop(key)
+        keys = self._owners.get(owner)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._owners[owner]
@@ -0,0 +1,212 @@
+import asyncio
+import base64
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+
+from helpers import get_hashed
+from settings import PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_WORKERS
+
+SCHEME = "scrypt"
+SCRYPT_N = 2**14  # 16 MiB of memory per hash with r=8
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 64
+
+
+class CredentialServiceBusy(Exception):
+    """
+    Too many hashes are already waiting for the pool
+    """
+
+
+def hash_password(
+    password: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P
+):
+    """
+    Salted scrypt hash of a password, encoded as scrypt$n$r$p$salt$key
+    """
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, n, r, p)
+    return "$".join((SCHEME, str(n), str(r), str(p), _b64encode(salt), _b64encode(key)))
+
+
+def verify_password(password: str, stored: str):
+    """
+    Check a password against a stored scrypt or legacy SHA512 hash in
+    constant time
+    """
+    if not stored:
+        return False
+    if not stored.startswith(SCHEME + "$"):
+        # legacy unsalted SHA512 hex digest
+        return hmac.compare_digest(get_hashed(password), stored)
+    try:
+        _, n, r, p, salt, key = stored.split("$")
+        expected = base64.b64decode(key)
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def verify_legacy_password(password: str, stored: str, dummy: str):
+    """
+    Check a password against a legacy SHA512 hash after checking it against
+    a dummy scrypt hash, so an account not migrated yet takes as long to
+    check as a migrated one
+    """
+    verify_password(password, dummy)
+    return verify_password(password, stored)
+
+
+def needs_rehash(stored: str):
+    """
+    Whether a stored hash is legacy or uses weaker parameters than today's
+    """
+    return not stored.startswith(f"{SCHEME}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int):
+    return hashlib.scrypt(
+        password.encode(),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * r * n,
+        dklen=KEY_BYTES,
+    )
+
+
+def _b64encode(value: bytes):
+    return base64.b64encode(value).decode()
+
+
+class CredentialService:
+    """
+    Hashes and verifies passwords in a small process pool.
+    scrypt is deliberately slow and memory hungry; running it in worker
+    processes keeps the bot's handler threads and the GIL free for the
+    attendance flow, and the pool size caps the CPU a login burst can take.
+    At most `max_pending` hashes wait for the pool; past that new requests
+    fail fast with CredentialServiceBusy instead of queueing without bound.
+    Legacy SHA512 hashes are checked in the pool too, along with an scrypt
+    check, so the time taken doesn't tell which accounts are not migrated.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 64):
+        """
+        :param workers: worker processes
+        :param max_pending: hashes running or waiting at once
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+        # verified when the employee doesn't exist, so that takes as long
+        self._dummy_hash = None
+
+    def start(self):
+        """
+        Create the worker processes now rather than on the first login
+        """
+        with self._lock:
+            if self._pool is None:
+                methods = multiprocessing.get_all_start_methods()
+                # fork is unsafe with the bot's threads running
+                context = multiprocessing.get_context(
+                    "forkserver" if "forkserver" in methods else "spawn"
+                )
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+        if self._dummy_hash is None:
+            self._dummy_hash = self._submit(hash_password, "", timeout=None).result()
+        return self
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def hash(self, password: str, timeout: float = 30):
+        """
+        Hash a new password/OTP
+        :param timeout: seconds to wait for a free slot and for the result
+        """
+        return self._submit(hash_password, password, timeout=timeout).result(timeout)
+
+    def hash_many(self, passwords: list, timeout: float = 30):
+        """
+        Hash many new passwords/OTPs in parallel, e.g. for a bulk import.
+        At most one hash per worker is queued at a time, so logins arriving
+        meanwhile still find free slots.
+        :param timeout: seconds to wait for each slot and result
+        :return: hashes in the order of passwords
+        """
+        window = threading.BoundedSemaphore(self.workers)
+        futures = []
+        for password in passwords:
+            if not window.acquire(timeout=timeout):
+                raise CredentialServiceBusy("Password hashing is not progressing")
+            future = self._submit(hash_password, password, timeout=timeout)
+            future.add_done_callback(lambda _: window.release())
+            futures.append(future)
+        return [future.result(timeout) for future in futures]
+
+    def verify(self, password: str, stored: str, timeout: float = 30):
+        """
+        Check password against a stored hash; stored=None checks against a
+        dummy hash so unknown employees take as long as known ones
+        """
+        self.start()
+        future = self._submit(*self._check(password, stored), timeout=timeout)
+        return future.result(timeout) and stored is not None
+
+    async def start_async(self):
+        """
+        `start` off the event loop; it waits for the worker processes and
+        the dummy hash
+        """
+        if self._pool is None or self._dummy_hash is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.start)
+        return self
+
+    async def hash_async(self, password: str):
+        await self.start_async()
+        return await asyncio.wrap_future(
+            self._submit(hash_password, password, timeout=0)
+        )
+
+    async def verify_async(self, password: str, stored: str):
+        await self.start_async()
+        future = self._submit(*self._check(password, stored), timeout=0)
+        return await asyncio.wrap_future(future) and stored is not None
+
+    def _check(self, password: str, stored: str):
+        # function and arguments checking a password in the pool
+        if stored and not stored.startswith(SCHEME + "$"):
+            return verify_legacy_password, password, stored, self._dummy_hash
+        return verify_password, password, stored or self._dummy_hash
+
+    def _submit(self, function, *args, timeout):
+        if self._pool is None:
+            self.start()
+        # timeout=0 never blocks, for the event loop
+        if not self._slots.acquire(timeout != 0, timeout if timeout else None):
+            raise CredentialServiceBusy("Too many password checks in progress")
+        try:
+            future = self._pool.submit(function, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+credential_service = CredentialService(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
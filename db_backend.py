@@ -1,10 +1,104 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager
+import os
 
-from settings import DB_LOCATION
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
 
-engine = create_engine("sqlite:///" + DB_LOCATION)  # , echo=True, hide_parameters=False
-db_session = sessionmaker(bind=engine)()
+from metrics import instrument_engine
+from settings import DB_BUSY_TIMEOUT, DB_CACHE_SIZE_KB, DB_LOCATION
+
+engine = create_engine(
+    "sqlite:///" + DB_LOCATION,
+    connect_args={"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT / 1000},
+)  # , echo=True, hide_parameters=False
+
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """
+    WAL lets readers run alongside the single writer, busy_timeout makes
+    writers wait for the lock instead of failing with "database is locked"
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+instrument_engine(engine)
+
+# One session per thread; `db_session.remove()` at the end of every update
+# hands a fresh session to the next update processed by the same worker
+db_session = scoped_session(sessionmaker(bind=engine))
+
+
+@contextmanager
+def session_scope():
+    """
+    Unit of work for one update: commit on success, rollback on error and
+    always release the thread's session
+    """
+    try:
+        yield db_session
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.remove()
+
+
+def create_async_session_factory():
+    """
+    Session factory for the asyncio runtime, backed by its own aiosqlite
+    engine with the same pragmas; imported lazily as aiosqlite is only
+    needed in that mode
+    """
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        "sqlite+aiosqlite:///" + DB_LOCATION,
+        connect_args={"timeout": DB_BUSY_TIMEOUT / 1000},
+    )
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragma)
+    instrument_engine(async_engine.sync_engine, "async")
+    return async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+# lock files of acquire_instance_lock, open for the life of the process
+_instance_locks = []
+
+
+def acquire_instance_lock(path: str = DB_LOCATION + ".lock"):
+    """
+    Make this the only bot process serving the database. Live location
+    sessions, pending attendance pairs, the outbound rate limiter and the
+    identity cache are kept in process memory, so one database is served by
+    exactly one process; scale it with handler threads or the webhook
+    dispatchers, not with more processes. The lock is released by the
+    operating system when the process exits
+    :param path: lock file, next to the database by default
+    :return: True when acquired, False when another process holds it
+    """
+    lock_file = open(path, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _instance_locks.append(lock_file)
+    return True
 
 
 def debug_query(query):
@@ -0,0 +1,217 @@
+from collections import defaultdict
+import math
+import threading
+
+from sqlalchemy.orm import Session
+
+from db_backend import engine
+from models import Office, UserOffice
+from timezones import get_calendar
+
+EARTH_RADIUS = 6371000  # meters
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+CELL_DEGREES = 0.01  # ~1.1 km grid buckets
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance in meters between two points
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+class _Site:
+    __slots__ = ("id", "lat", "lng", "radius", "cos_lat", "d_lat", "d_lng")
+
+    def __init__(self, office):
+        self.id = office.id
+        self.lat = office.latitude
+        self.lng = office.longitude
+        self.radius = office.radius_meters
+        self.cos_lat = max(math.cos(math.radians(self.lat)), 1e-6)
+        # half size of the bounding box in degrees
+        self.d_lat = self.radius / METERS_PER_DEGREE
+        self.d_lng = self.d_lat / self.cos_lat
+
+
+class GeofenceIndex:
+    """
+    In-memory spatial index of office geofences.
+    Offices are bucketed into a fixed lat/lng grid, so a lookup only looks at
+    the few offices around the point whatever the number of offices. The
+    candidates go through a bounding box and an equirectangular distance
+    check before the exact haversine. It also knows the timezone every user
+    takes their attendance days in: the one of their first assigned office
+    that has a timezone, settings.TIMEZONE otherwise.
+    """
+
+    def __init__(self, offices, assignments=(), cell_degrees: float = CELL_DEGREES):
+        """
+        :param offices: offices with id, latitude, longitude & radius_meters
+        :param assignments: (user ID, office ID) pairs of allowed offices
+        :param cell_degrees: size of a grid bucket in degrees
+        """
+        self.cell_degrees = cell_degrees
+        self._cells = defaultdict(list)  # {(row, col): [_Site, ...]}
+        self._allowed = defaultdict(set)  # {user_id: {office_id, ...}}
+        self._zones = {}  # {user_id: IANA timezone name}
+        self.size = 0
+        office_zones = {}
+        for office in offices:
+            office_zones[office.id] = office.timezone
+            site = _Site(office)
+            self.size += 1
+            for row in range(
+                self._bucket(site.lat - site.d_lat),
+                self._bucket(site.lat + site.d_lat) + 1,
+            ):
+                for col in range(
+                    self._bucket(site.lng - site.d_lng),
+                    self._bucket(site.lng + site.d_lng) + 1,
+                ):
+                    self._cells[(row, col)].append(site)
+        for user_id, office_id in assignments:
+            self._allowed[user_id].add(office_id)
+        for user_id, office_ids in self._allowed.items():
+            for office_id in sorted(office_ids):
+                if office_zones.get(office_id):
+                    self._zones[user_id] = office_zones[office_id]
+                    break
+
+    def _bucket(self, degrees: float):
+        return math.floor(degrees / self.cell_degrees)
+
+    def match(self, lat: float, lng: float, user_id: int = None):
+        """
+        Get the nearest office whose geofence contains the point
+        :param lat: latitude of the point
+        :param lng: longitude of the point
+        :param user_id: restrict to the offices allowed for this user
+        :return: office ID or None
+        """
+        allowed = self._allowed.get(user_id)
+        best, best_distance = None, None
+        for site in self._cells.get((self._bucket(lat), self._bucket(lng)), ()):
+            if allowed and site.id not in allowed:
+                continue
+            if abs(lat - site.lat) > site.d_lat or abs(lng - site.lng) > site.d_lng:
+                continue
+            # cheap equirectangular distance; haversine only when close to the fence
+            approx = METERS_PER_DEGREE * math.hypot(
+                lat - site.lat, (lng - site.lng) * site.cos_lat
+            )
+            if approx > site.radius * 1.01:
+                continue
+            distance = haversine(lat, lng, site.lat, site.lng)
+            if distance <= site.radius and (best is None or distance < best_distance):
+                best, best_distance = site.id, distance
+        return best
+
+    def zone_of(self, user_id: int):
+        """
+        Get the timezone name of a user, None for settings.TIMEZONE
+        :param user_id: user ID of user
+        """
+        return self._zones.get(user_id)
+
+    def zoned_users(self):
+        """
+        Get the IDs of the users counted in an office timezone, in order
+        """
+        return sorted(self._zones)
+
+    def match_many(self, lats, lngs, user_ids=None):
+        """
+        Vectorized `match` for many points at once
+        :param lats: latitudes of the points
+        :param lngs: longitudes of the points
+        :param user_ids: user ID of every point, to restrict to allowed offices
+        :return: NumPy array of office IDs, -1 where no office contains the point
+        """
+        import numpy as np
+
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        result = np.full(lats.shape, -1, dtype=np.int64)
+        best = np.full(lats.shape, np.inf)
+        if not lats.size:
+            return result
+
+        rows = np.floor(lats / self.cell_degrees).astype(np.int64)
+        cols = np.floor(lngs / self.cell_degrees).astype(np.int64)
+        cells, inverse = np.unique(
+            np.stack([rows, cols], axis=1), axis=0, return_inverse=True
+        )
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        groups = np.split(order, np.cumsum(np.bincount(inverse))[:-1])
+
+        lat_rad, lng_rad = np.radians(lats), np.radians(lngs)
+        users = None if user_ids is None else np.asarray(user_ids)
+        for (row, col), points in zip(cells, groups):
+            for site in self._cells.get((int(row), int(col)), ()):
+                site_lat, site_lng = math.radians(site.lat), math.radians(site.lng)
+                a = (
+                    np.sin((lat_rad[points] - site_lat) / 2) ** 2
+                    + np.cos(lat_rad[points])
+                    * math.cos(site_lat)
+                    * np.sin((lng_rad[points] - site_lng) / 2) ** 2
+                )
+                distance = 2 * EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+                inside = (distance <= site.radius) & (distance < best[points])
+                if users is not None:
+                    inside &= np.fromiter(
+                        (
+                            not self._allowed.get(user_id)
+                            or site.id in self._allowed[user_id]
+                            for user_id in users[points]
+                        ),
+                        dtype=bool,
+                        count=len(points),
+                    )
+                result[points[inside]] = site.id
+                best[points[inside]] = distance[inside]
+        return result
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def load_index():
+    """
+    (Re)build the office index from the database; call after offices or
+    their assignments change
+    """
+    global _index
+    # own session; this may run in the middle of a handler's unit of work
+    with Session(engine) as session:
+        index = GeofenceIndex(
+            Office.get_active(session=session), UserOffice.get_all(session=session)
+        )
+    with _index_lock:
+        _index = index
+    return index
+
+
+def get_index():
+    return _index if _index is not None else load_index()
+
+
+def is_within_office(lat, lng, user_id: int = None):
+    """
+    Returns True if the point is inside an office the user may attend
+    """
+    return get_index().match(lat, lng, user_id) is not None
+
+
+def user_calendar(user_id: int):
+    """
+    DayCalendar of the timezone a user's attendance days are counted in
+    """
+    return get_calendar(get_index().zone_of(user_id))
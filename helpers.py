@@ -1,6 +1,7 @@
-from datetime import datetime
+from datetime import datetime, timezone
 import hashlib
-import pytz
+
+from timezones import get_zone
 
 
 # Takes an object and return its hash ( SHA512 )
@@ -17,25 +18,22 @@ def get_hashed(message: str):
 # Change UTC datetime to IST datetime
 def to_IST(timestamp: datetime):
     """
-    Convert UTC datetime to IST datetime
+    Convert UTC datetime to local datetime of settings.TIMEZONE (IST by
+    default); employees of offices in other timezones use their DayCalendar
     :param timestamp: UTC timestamp
     :return: IST timestamp
     """
-    local_tz = pytz.timezone("Asia/Kolkata")
-    local_dt = timestamp.replace(tzinfo=pytz.utc).astimezone(local_tz)
-    return local_tz.normalize(local_dt)
+    return timestamp.replace(tzinfo=timezone.utc).astimezone(get_zone())
 
 
 # Change IST datetime to UTC datetime
 def to_UTC(timestamp: datetime):
     """
-    Convert IST datetime to UTC datetime
+    Convert local datetime of settings.TIMEZONE (IST by default) to UTC datetime
     :param timestamp: IST timestamp
     :return: UTC timestamp
     """
-    local_tz = pytz.timezone("Asia/Kolkata")
-    utc_dt = local_tz.localize(timestamp, is_dst=None).astimezone(pytz.utc)
-    return pytz.utc.normalize(utc_dt)
+    return timestamp.replace(tzinfo=get_zone()).astimezone(timezone.utc)
 
 
 # Get timestamp from epoch
@@ -0,0 +1,135 @@
+from collections import deque
+import heapq
+import threading
+import time
+
+
+class LiveSample:
+    __slots__ = ("latitude", "longitude", "timestamp", "in_fence")
+
+    def __init__(self, latitude: float, longitude: float, timestamp, in_fence: bool):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timestamp = timestamp
+        self.in_fence = in_fence
+
+
+class LiveSession:
+    __slots__ = ("message_id", "expires_at", "samples", "in_fence", "confirmed")
+
+    def __init__(self, message_id: int, expires_at: float, buffer_size: int):
+        self.message_id = message_id
+        self.expires_at = expires_at
+        self.samples = deque(maxlen=buffer_size)  # ring buffer of recent samples
+        self.in_fence = 0
+        self.confirmed = False
+
+
+class LiveLocationTracker:
+    """
+    Follows the live location a user shares for attendance.
+    The first location message opens a session for its `live_period`; every
+    edited_message Telegram sends afterwards adds a sample to a fixed size
+    ring buffer. Attendance is confirmed once `required_updates` samples were
+    inside the geofence. Memory is bounded by `max_sessions` x `buffer_size`
+    samples whatever the number of users sharing all day.
+    Sessions are kept in process memory: the edits of a live location have
+    to reach the process that saw its first message, which is why the bot
+    serves a database from one process only (see `acquire_instance_lock`).
+    """
+
+    def __init__(
+        self, required_updates: int, buffer_size: int = 8, max_sessions: int = 10000
+    ):
+        """
+        :param required_updates: in-fence samples needed to confirm attendance
+        :param buffer_size: samples kept per session
+        :param max_sessions: sessions kept at once; the oldest expiring are dropped first
+        """
+        self.required_updates = required_updates
+        self.buffer_size = buffer_size
+        self.max_sessions = max_sessions
+        self._sessions = {}  # {user_id: LiveSession}
+        self._expiry = []  # heap of (expires_at, user_id)
+        self._lock = threading.Lock()
+
+    def start(
+        self, user_id: int, message_id: int, live_period: int, sample: LiveSample
+    ):
+        """
+        Open a session for a new live location message, replacing any older one
+        :param user_id: user ID of user
+        :param message_id: ID of the live location message
+        :param live_period: seconds Telegram will keep sending updates
+        :param sample: first sample
+        :return: True when this sample already confirms the attendance
+        """
+        with self._lock:
+            self._expire()
+            session = LiveSession(
+                message_id, time.monotonic() + live_period, self.buffer_size
+            )
+            self._sessions[user_id] = session
+            heapq.heappush(self._expiry, (session.expires_at, user_id))
+            while len(self._sessions) > self.max_sessions:
+                self._drop_oldest()
+            return self._add(session, sample)
+
+    def update(self, user_id: int, message_id: int, sample: LiveSample):
+        """
+        Add a sample from an edited live location message
+        :param user_id: user ID of user
+        :param message_id: ID of the edited live location message
+        :param sample: new sample
+        :return: None without an open session for the message, else True once
+            when the attendance gets confirmed and False otherwise
+        """
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(user_id)
+            if session is None or session.message_id != message_id:
+                return None
+            return self._add(session, sample)
+
+    def stop(self, user_id: int):
+        """
+        Close the session of user, e.g. when they stop sharing
+        """
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def get(self, user_id: int):
+        with self._lock:
+            return self._sessions.get(user_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _add(self, session: LiveSession, sample: LiveSample):
+        session.samples.append(sample)
+        if sample.in_fence:
+            session.in_fence += 1
+        if session.confirmed or session.in_fence < self.required_updates:
+            return False
+        session.confirmed = True
+        return True
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, user_id = heapq.heappop(self._expiry)
+            session = self._sessions.get(user_id)
+            if session is not None and session.expires_at == expires_at:
+                del self._sessions[user_id]
+        # entries of replaced sessions linger in the heap; rebuild when it grows
+        if len(self._expiry) > 2 * self.max_sessions:
+            self._expiry = [(s.expires_at, u) for u, s in self._sessions.items()]
+            heapq.heapify(self._expiry)
+
+    def _drop_oldest(self):
+        while self._expiry:
+            expires_at, user_id = heapq.heappop(self._expiry)
+            session = self._sessions.get(user_id)
+            if session is not None and session.expires_at == expires_at:
+                del self._sessions[user_id]
+                return
@@ -0,0 +1,198 @@
+import atexit
+from contextvars import ContextVar
+import copy
+from datetime import datetime, timezone
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import random
+import sys
+import threading
+import time
+
+ROOT_LOGGER = "attendance"
+
+# (handler name, perf_counter at its start) of the update being handled
+current_handler = ContextVar("current_handler", default=None)
+
+
+def get_logger(category: str):
+    """
+    Logger of a category like "attendance", "security" or "hr"
+    """
+    return logging.getLogger(f"{ROOT_LOGGER}.{category}")
+
+
+def fields(message=None, user=None, **extra):
+    """
+    Structured fields of a log record, for the `extra` argument
+    :param message: Telegram message being handled
+    :param user: user sending the message
+    :param extra: any other field, e.g. branch
+    """
+    if message is not None:
+        extra["chat_id"] = message.chat.id
+    if user is not None:
+        extra["user_id"] = user.id
+    return extra
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line
+    """
+
+    def format(self, record: logging.LogRecord):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "category": record.name.removeprefix(ROOT_LOGGER + "."),
+            "event": record.getMessage(),
+        }
+        # handler, duration_ms, user_id, chat_id, branch...
+        for key in getattr(record, "_extra_keys", ()):
+            entry[key] = getattr(record, key)
+        if record.exc_text:
+            entry["error"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Adds the running handler and its elapsed time, then applies sampling and
+    per-category rate limits so that a flood of one event (e.g. repeated
+    geofence rejections) can't crowd out the rest. Limits are looked up as
+    "category.branch" first, then "category".
+    """
+
+    def __init__(self, rate_limits: dict = None, sample_rates: dict = None):
+        """
+        :param rate_limits: {key: (records per second, burst)}
+        :param sample_rates: {key: fraction of records kept}
+        """
+        super().__init__()
+        self.rate_limits = rate_limits or {}
+        self.sample_rates = sample_rates or {}
+        self._buckets = {}  # {key: (tokens, refilled_at)}
+        self._suppressed = {}  # {key: records dropped since the last one kept}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord):
+        running = current_handler.get()
+        if running is not None:
+            record.handler = running[0]
+            record.duration_ms = round((time.perf_counter() - running[1]) * 1000, 3)
+        record._extra_keys = tuple(
+            key for key in record.__dict__ if key not in _RECORD_ATTRIBUTES
+        )
+
+        category = record.name.removeprefix(ROOT_LOGGER + ".")
+        branch = getattr(record, "branch", None)
+        keys = (f"{category}.{branch}", category) if branch else (category,)
+        rate = next((self.sample_rates[k] for k in keys if k in self.sample_rates), 1)
+        limit = next((self.rate_limits[k] for k in keys if k in self.rate_limits), None)
+        if record.levelno >= logging.ERROR or (rate >= 1 and limit is None):
+            return True
+
+        key = keys[0]
+        with self._lock:
+            if rate < 1 and random.random() >= rate:
+                return False
+            if limit is not None:
+                per_second, burst = limit
+                now = time.monotonic()
+                tokens, refilled_at = self._buckets.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - refilled_at) * per_second)
+                if tokens < 1:
+                    self._buckets[key] = (tokens, now)
+                    self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                    return False
+                self._buckets[key] = (tokens - 1, now)
+            suppressed = self._suppressed.pop(key, 0)
+        if rate < 1:
+            record.sampled = rate
+        if suppressed:
+            record.suppressed = suppressed
+        record._extra_keys += tuple(
+            key for key in ("sampled", "suppressed") if hasattr(record, key)
+        )
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread; never blocks the caller, records
+    are dropped (and counted) when the queue is full
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord):
+        # keep the record structured; only resolve what can't cross threads
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message"}
+_listener = None
+_lock = threading.Lock()
+
+
+def setup_logging(
+    level: str = "INFO",
+    queue_size: int = 10000,
+    rate_limits: dict = None,
+    sample_rates: dict = None,
+    stream=None,
+):
+    """
+    Route the "attendance" loggers through a queue to a writer thread
+    emitting JSON lines; safe to call more than once
+    :param level: minimum level logged
+    :param queue_size: records waiting for the writer before dropping
+    :param rate_limits: see ContextFilter
+    :param sample_rates: see ContextFilter
+    :param stream: output, stdout by default
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter())
+        handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        handler.addFilter(ContextFilter(rate_limits, sample_rates))
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.setLevel(level)
+        logger.addHandler(handler)
+        logger.propagate = False
+        _listener = QueueListener(handler.queue, output)
+        _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Write out everything queued and stop the writer thread
+    """
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        logger = logging.getLogger(ROOT_LOGGER)
+        for handler in list(logger.handlers):
+            if isinstance(handler, DroppingQueueHandler):
+                logger.removeHandler(handler)
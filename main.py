@@ -1,84 +1,346 @@
 from datetime import datetime, timedelta
 import os
-import pdfkit
+import tempfile
+from zoneinfo import ZoneInfoNotFoundError
 import telebot
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from db_backend import db_session
-from helpers import UTC_from_epoch, get_hashed, time_difference, to_IST, to_UTC
-from models import Attendance, User
-from settings import BOT_TOKEN, SELFIE_LOCATION_DELAY
-import math
-# from settings import OFFICE_LAT, OFFICE_LNG, OFFICE_RADIUS_METERS
-from settings import OFFICE_LAT, OFFICE_LNG, OFFICE_RADIUS_METERS, MIN_LIVE_LOCATION_DURATION
-REQUIRED_LIVE_UPDATES = 2
-
-# store temporary live samples
-live_location_samples = {}  # {user_id: count}
-
-bot = telebot.TeleBot(BOT_TOKEN)
-
-def is_within_office(lat, lng):
+from telebot.handler_backends import BaseMiddleware
+from attendance_state import UNKNOWN, PendingPairTracker, next_transition
+from db_backend import acquire_instance_lock, db_session, session_scope
+from geofence import is_within_office, load_index, user_calendar
+from credentials import CredentialServiceBusy, credential_service
+from helpers import UTC_from_epoch, time_difference, to_UTC
+from live_location import LiveLocationTracker, LiveSample
+from log import fields, get_logger, setup_logging
+from metrics import ATTENDANCE_OUTCOMES, Gauge, MetricsServer, track_handler
+from migrations import is_schema_current
+from models import Attendance, Office, Selfie, StalePendingPair, User, UserOffice
+from outbound import OutboundScheduler
+from report_jobs import FORMATS, ReportJobs, ReportQueueFull
+from reports import build_monthly_report, build_monthly_report_pdf, build_selfie_review
+from reports import report_data_version
+from selfie_store import SelfieFetcher, SelfieStore, TelegramFileSource
+from timezones import get_zone
+from user_import import ImportFileError, error_report, import_users, read_employee_ids
+from verification import SelfieVerifier
+from settings import BOT_TOKEN, MIN_LIVE_LOCATION_DURATION, SELFIE_LOCATION_DELAY
+from settings import (
+    LIVE_LOCATION_BUFFER_SIZE,
+    LIVE_LOCATION_MAX_SESSIONS,
+    REQUIRED_LIVE_UPDATES,
+)
+from settings import (
+    BULK_UPDATE_MAX_IDS,
+    BULK_UPDATE_MISSING_SHOWN,
+    LOG_LEVEL,
+    LOG_QUEUE_SIZE,
+    LOG_RATE_LIMITS,
+    LOG_SAMPLE_RATES,
+    METRICS_HOST,
+    METRICS_PORT,
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_PER_CHAT_INTERVAL,
+    OUTBOUND_WORKERS,
+    REPORT_CACHE_DIR,
+    REPORT_MAX_PENDING,
+    REPORT_PROGRESS_AFTER,
+    REPORT_WORKERS,
+    SELFIE_FETCH_MAX_PENDING,
+    SELFIE_FETCH_WORKERS,
+    SELFIE_MATCH_MAX_DISTANCE,
+    SELFIE_REFERENCE_CACHE_SIZE,
+    SELFIE_STORE_DIR,
+    SELFIE_THUMBNAIL_QUALITY,
+    SELFIE_THUMBNAIL_SIZE,
+    SELFIE_THUMBNAIL_WORKERS,
+    SELFIE_VERIFY_MAX_PENDING,
+    SELFIE_VERIFY_WORKERS,
+    USER_IMPORT_MAX_BYTES,
+    USER_IMPORT_MAX_ROWS,
+    WEBHOOK_DISPATCHERS,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WRITE_BEHIND_MAX_BATCH,
+    WRITE_BEHIND_MAX_DELAY,
+    WRITE_BEHIND_TIMEOUT,
+)
+from webhook import WebhookServer
+from write_behind import WriteBehindQueue
+
+# Log lines are written by a background thread, never by the handlers
+setup_logging(LOG_LEVEL, LOG_QUEUE_SIZE, LOG_RATE_LIMITS, LOG_SAMPLE_RATES)
+bot_log = get_logger("bot")
+auth_log = get_logger("auth")
+hr_log = get_logger("hr")
+attendance_log = get_logger("attendance")
+security_log = get_logger("security")
+
+# In webhook mode the receiver's dispatcher threads run the handlers, so the
+# bounded queue is what holds back updates; a threaded bot would hand them on
+# to its own unbounded pool
+bot = telebot.TeleBot(BOT_TOKEN, use_class_middlewares=True, threaded=not WEBHOOK_URL)
+
+
+class SessionMiddleware(BaseMiddleware):
     """
-    Returns True if user is inside the allowed office radius.
-    Uses Haversine formula to calculate distance.
+    Give every update its own database session; handlers run on TeleBot's
+    worker threads or the webhook dispatchers, so the session must never
+    outlive the update
     """
-    R = 6371000  # Earth radius in meters
-
-    lat1 = math.radians(lat)
-    lon1 = math.radians(lng)
-    lat2 = math.radians(OFFICE_LAT)
-    lon2 = math.radians(OFFICE_LNG)
-
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-
-    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-    distance = R * c
-
-    return distance <= OFFICE_RADIUS_METERS
-
-# Create a new attendance record
-def new_attendance(
-    user_id: int,
-    selfie: list = None,
-    selfie_time: datetime = None,
-    location: dict = None,
-    location_time: datetime = None,
-):
-    if selfie_time or location_time:
-        if selfie_time:
-            attendance = Attendance(
-                user_id=user_id, selfie=selfie, selfie_time=selfie_time
-            )
-        else:
-            attendance = Attendance(
-                user_id=user_id, location=location, location_time=location_time
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ["message", "edited_message"]
+
+    def pre_process(self, message, data):
+        pass
+
+    def post_process(self, message, data, exception):
+        if exception:
+            db_session.rollback()
+        db_session.remove()
+
+
+bot.setup_middleware(SessionMiddleware())
+
+# Replies are queued and sent within Telegram's rate limits
+outbox = OutboundScheduler(
+    bot,
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    per_chat_interval=OUTBOUND_PER_CHAT_INTERVAL,
+    workers=OUTBOUND_WORKERS,
+)
+
+# Live location sessions waiting for enough in-fence updates
+live_tracker = LiveLocationTracker(
+    REQUIRED_LIVE_UPDATES,
+    buffer_size=LIVE_LOCATION_BUFFER_SIZE,
+    max_sessions=LIVE_LOCATION_MAX_SESSIONS,
+)
+
+# Half-complete selfie/location pairs, so the second half needs no read query
+pending_pairs = PendingPairTracker()
+
+# Attendance rows are written by one thread in group commits
+attendance_writer = WriteBehindQueue(WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_MAX_DELAY)
+
+# Selfies are downloaded to local disk once their attendance is committed,
+# then compared with the employee's enrolled reference
+selfie_store = SelfieStore(
+    SELFIE_STORE_DIR, SELFIE_THUMBNAIL_SIZE, SELFIE_THUMBNAIL_QUALITY
+)
+selfie_verifier = SelfieVerifier(
+    selfie_store,
+    workers=SELFIE_VERIFY_WORKERS,
+    max_pending=SELFIE_VERIFY_MAX_PENDING,
+    max_distance=SELFIE_MATCH_MAX_DISTANCE,
+    cache_size=SELFIE_REFERENCE_CACHE_SIZE,
+)
+selfie_fetcher = SelfieFetcher(
+    selfie_store,
+    TelegramFileSource(bot),
+    workers=SELFIE_FETCH_WORKERS,
+    thumbnail_workers=SELFIE_THUMBNAIL_WORKERS,
+    max_pending=SELFIE_FETCH_MAX_PENDING,
+    on_stored=selfie_verifier.verify,
+)
+
+# Files HR sends (reference photos, employee lists) are needed by the handler
+# that received them, so they are downloaded there rather than queued
+# behind the selfies of the fetcher
+file_downloader = TelegramFileSource(bot)
+
+# Reports are built off the handler threads and cached by data version
+report_jobs = ReportJobs(
+    outbox,
+    {"xlsx": build_monthly_report, "pdf": build_monthly_report_pdf},
+    REPORT_CACHE_DIR,
+    workers=REPORT_WORKERS,
+    max_pending=REPORT_MAX_PENDING,
+    progress_after=REPORT_PROGRESS_AFTER,
+)
+
+# Queue depths tell whether updates wait on Telegram, SQLite or threads
+Gauge(
+    "outbound_queued_messages",
+    "Replies waiting for the Telegram rate limits",
+    function=lambda: outbox.stats()["queued"],
+)
+Gauge(
+    "write_behind_queued_operations",
+    "Attendance writes waiting for the next group commit",
+    function=lambda: attendance_writer.pending(),
+)
+Gauge(
+    "report_jobs_pending",
+    "Reports being built or waiting for a worker",
+    function=lambda: report_jobs.pending(),
+)
+Gauge(
+    "pending_attendance_pairs",
+    "Attendance records waiting for their selfie or location",
+    function=lambda: len(pending_pairs),
+)
+Gauge(
+    "live_location_sessions",
+    "Live locations being followed",
+    function=lambda: len(live_tracker),
+)
+
+
+# Create a new attendance record with one half (selfie or location)
+def new_attendance(user_id: int, transition, value, calendar):
+    # the pending record the transition was decided on, checked by the insert
+    pending_id = transition.pair.attendance_id if transition.outcome == "delay_expired" else None
+
+    def insert(session):
+        return Attendance.start_pair(
+            user_id,
+            transition.kind,
+            value,
+            transition.timestamp,
+            pending_id=pending_id,
+            calendar=calendar,
+            session=session,
+        )
+
+    return write_attendance(insert, transition.kind, value)
+
+
+# Complete a pending attendance record with the other half (selfie or location)
+def complete_attendance(user_id: int, transition, value, calendar):
+    def update(session):
+        Attendance.complete_pair(
+            transition.pair.attendance_id,
+            user_id,
+            transition.kind,
+            value,
+            transition.timestamp,
+            transition.pair.timestamp,
+            calendar=calendar,
+            session=session,
+        )
+
+    return write_attendance(update, transition.kind, value)
+
+
+# Add a selfie or a location to today's attendance
+def record_attendance(message, known_user, kind: str, value, curr_time: datetime):
+    calendar = user_calendar(known_user.id)
+    # the tracker is only a hint: the writes check it against the database,
+    # and on a mismatch the decision is taken again from the database
+    pair = pending_pairs.get(known_user.id)
+    from_database = pair is UNKNOWN
+    while True:
+        if pair is UNKNOWN:
+            pair = pending_pairs.load(
+                known_user.id,
+                Attendance.get_last_attendance_record(
+                    known_user.id, curr_time, calendar=calendar
+                ),
             )
+        transition = next_transition(pair, kind, curr_time, calendar, SELFIE_LOCATION_DELAY)
+        if transition.outcome == "already_received" and not from_database:
+            # nothing is written to check the hint with; read the record
+            pair, from_database = UNKNOWN, True
+            continue
+        future = None
+        try:
+            if transition.outcome == "merged":
+                future = complete_attendance(known_user.id, transition, value, calendar)
+            elif transition.outcome != "already_received":
+                future = new_attendance(known_user.id, transition, value, calendar)
+            # wait until the row is durable before replying
+            attendance_id = future.result(timeout=WRITE_BEHIND_TIMEOUT) if future else None
+        except TimeoutError:
+            # still queued or committing: it may well succeed, so don't ask
+            # for a retry; the outcome is sent once the write finishes
+            pending_pairs.invalidate(known_user.id)
+            db_session.rollback()
+            attendance_log.warning(f"{kind.title()} still being saved", extra=fields(message, known_user, branch=transition.outcome))
+            outbox.reply_to(message, f"Your {kind} is still being saved; you will be notified once it is done.")
+            future.add_done_callback(lambda done: attendance_written(message, known_user, transition, done))
+            return
+        except Exception as e:
+            # the write may still be committed; read the database next time
+            pending_pairs.invalidate(known_user.id)
+            db_session.rollback()
+            if isinstance(e, StalePendingPair) and not from_database:
+                attendance_log.info("Pending pair was stale", extra=fields(message, known_user, branch=transition.outcome))
+                pair, from_database = UNKNOWN, True
+                continue
+            attendance_log.exception(f"Failed to save {kind} record", extra=fields(message, known_user, branch=transition.outcome))
+            outbox.reply_to(message, "Error saving attendance. Please try again.")
+            return
+        break
+    attendance_saved(message, known_user, transition, attendance_id)
 
-        db_session.add(attendance)
-        db_session.commit()
-    else:
-        # AssertionError("Either selfie or location required")
-        raise AssertionError("Either selfie or location required")
+
+# Track and answer an attendance write once it is committed
+def attendance_saved(message, known_user, transition, attendance_id):
+    kind = transition.kind
+    pending_pairs.apply(known_user.id, transition, attendance_id)
+    if transition.outcome != "already_received":
+        attendance_log.info(f"{kind.title()} recorded", extra=fields(message, known_user, branch=transition.outcome, time=transition.timestamp))
+    ATTENDANCE_OUTCOMES.inc(kind=kind, outcome=transition.outcome)
+    reply, *others = transition.replies()
+    outbox.reply_to(message, reply, parse_mode="HTML")
+    for text in others:
+        outbox.send_message(message.chat.id, text, parse_mode="HTML")
+
+
+# Answer a write that outlived WRITE_BEHIND_TIMEOUT; runs on the writer thread,
+# so it must not wait for another write
+def attendance_written(message, known_user, transition, future):
+    error = future.exception()
+    if error is None:
+        attendance_saved(message, known_user, transition, future.result())
+        return
+    pending_pairs.invalidate(known_user.id)
+    attendance_log.error(f"Failed to save {transition.kind} record", exc_info=error, extra=fields(message, known_user, branch=transition.outcome))
+    outbox.send_message(
+        message.chat.id,
+        f"Your {transition.kind} could not be saved. Please send it again.",
+    )
+
+
+# Queue an attendance write for the writer thread; the future resolves once
+# it is committed
+def write_attendance(operation, kind: str, value):
+    # read before the writer's session takes the selfie over
+    selfie_ids = (value.file_unique_id, value.file_id) if kind == "selfie" else None
+    # end this thread's read transaction first; if every pooled connection
+    # were held by a waiting handler the writer could never get one
+    db_session.commit()
+    future = attendance_writer.submit(operation)
+
+    def fetch_selfie(done):
+        # download the selfie once its row is committed
+        if done.exception() is None:
+            selfie_fetcher.submit(*selfie_ids)
+
+    if selfie_ids:
+        future.add_done_callback(fetch_selfie)
+    return future
 
 
 # When user starts a flow; welcome them
 @bot.message_handler(commands=["start", "hello"])
 @bot.message_handler(func=lambda msg: msg.text in ["start", "hello"])
+@track_handler
 def welcome_user(message):
     chat_id = message.chat.id
     known_user = User.get_by_chat_id(chat_id)
     if known_user:
-        bot.reply_to(
+        outbox.reply_to(
             message,
             f"Hi, *{known_user.fullname}*; Welcome back",
             parse_mode="MarkdownV2",
         )
     else:
-        bot.reply_to(
+        outbox.reply_to(
             message,
             "Please use command /login to interact further; example\n/login\nemployee ID\npassword \n\n"
             "or /help for other commands",
@@ -89,16 +351,24 @@ def welcome_user(message):
 # Show help options to users
 @bot.message_handler(commands=["help"])
 @bot.message_handler(func=lambda msg: msg.text in ["help"])
+@track_handler
 def help_msg(message):
-    bot.reply_to(
+    outbox.reply_to(
         message,
         "/login \\- to login a user with employee ID and OTP followed by command\n"
         "/logout \\- to logout a user\n"
         "/create \\- HR can create a new user with their employee ID, name, role, OTP followed by command\n"
-        "/download \\- user can download their monthly attendance by providing the month & year followed by command\n"
+        "/download \\- user can download their monthly attendance by providing the month & year, optionally followed by pdf, after the command\n"
         "/rstpwd \\- HR can reset user password by providing employee ID & OTP followed by command\n"
         "/deactive \\- HR can deactivate an user by providing employee ID followed by command\n"
-        "/reactive \\- HR can reactive an user by providing employee ID followed by command",
+        "/reactive \\- HR can reactive an user by providing employee ID followed by command\n"
+        "/office \\- HR can add or update an office by providing name, latitude, longitude, radius in meters & optionally its timezone followed by command\n"
+        "/assign \\- HR can restrict an employee to offices by providing employee ID & comma separated office names followed by command\n"
+        "/selfies \\- HR can review the selfies of a day by providing the date as DD\\-MM\\-YYYY followed by command; today by default\n"
+        "/import \\- HR can create many users by sending a CSV or XLSX file with columns employee ID, full name, role & OTP with the command as caption\n"
+        "/bulkdeactive, /bulkreactive \\- HR can deactivate or reactivate many users by providing employee IDs one per line, or by sending a CSV or XLSX file of them with the command as caption\n"
+        "/bulkrstpwd \\- HR can reset many users to the same OTP by providing the OTP then employee IDs one per line, or a file of them\n"
+        "/enroll \\- HR can enroll the reference photo of an employee by sending it with the command & employee ID as caption",
         parse_mode="MarkdownV2",
     )
 
@@ -107,16 +377,17 @@ def help_msg(message):
 #Logout Function - Keep user state active
 @bot.message_handler(commands=["logout"])
 @bot.message_handler(func=lambda msg: msg.text in ["logout"])
+@track_handler
 def logout_user(message):
     chat_id = message.chat.id
     known_user = User.get_by_chat_id(chat_id)
 
     if known_user is None:
-        bot.reply_to(message, "You are not currently logged in. Please log in first using /login.")
+        outbox.reply_to(message, "You are not currently logged in. Please log in first using /login.")
         return
 
     if not known_user.is_active:
-        bot.reply_to(message, "Your account has been deactivated. Please contact HR for assistance.")
+        outbox.reply_to(message, "Your account has been deactivated. Please contact HR for assistance.")
         return
 
     # Update user status
@@ -124,31 +395,33 @@ def logout_user(message):
     known_user.last_chat_id = None    # Clear last chat ID
     db_session.add(known_user)
     db_session.commit()
+    User.invalidate_cache(known_user, chat_id)
 
-    bot.reply_to(message, "You have been successfully logged out. You can log in again using the /login command.")
+    outbox.reply_to(message, "You have been successfully logged out. You can log in again using the /login command.")
 
     # Optional logging for tracking
-    print(f"User {known_user.employee_id} has logged out successfully.")
+    auth_log.info("User logged out", extra=fields(message, known_user))
 
  #Login a user with employeeID & password
 @bot.message_handler(commands=["login"])
+@track_handler
 def login_user(message):
     chat_id = message.chat.id
     try:
         _, emp_id, pwd = list(map(lambda x: x.strip(), message.text.split("\n")))
-        print(f"Attempting login for Employee ID: {emp_id}")  # Debugging output
+        auth_log.info("Login attempt", extra=fields(message, employee_id=emp_id))
         
         # Validate credentials
         known_user = User.is_valid_credential(emp_id, pwd)
         if known_user is None:
-            bot.reply_to(message, "Invalid credentials; login failed. Please check your Employee ID and password.")
-            print(f"Login failed for Employee ID: {emp_id}")  # Debugging output
+            outbox.reply_to(message, "Invalid credentials; login failed. Please check your Employee ID and password.")
+            auth_log.info("Login failed", extra=fields(message, employee_id=emp_id, branch="invalid_credentials"))
             return
         
         logged_in_user = User.get_by_emp_id(emp_id)
         if logged_in_user is None:
-            bot.reply_to(message, "User not found; please ensure you are registered.")
-            print(f"User not found for Employee ID: {emp_id}")  # Debugging output
+            outbox.reply_to(message, "User not found; please ensure you are registered.")
+            auth_log.info("User not found", extra=fields(message, employee_id=emp_id, branch="unknown_user"))
             return
         
         # Set user session details
@@ -156,16 +429,21 @@ def login_user(message):
         logged_in_user.is_logged_in = True  # Set the user state to logged in
         db_session.add(logged_in_user)
         db_session.commit()
-        
-        bot.reply_to(message, f"Hello *{known_user.fullname}*", parse_mode="MarkdownV2")
+        User.invalidate_cache(logged_in_user, chat_id)
+
+        outbox.reply_to(message, f"Hello *{known_user.fullname}*", parse_mode="MarkdownV2")
+    except CredentialServiceBusy:
+        outbox.reply_to(message, "Too many logins right now; please try again in a minute.")
+        auth_log.warning("Login refused, credential service busy", extra=fields(message, branch="busy"))
     except ValueError:
-        bot.reply_to(message, "Please use command /login to interact further; example\n/login\nemployee ID\npassword", parse_mode="MarkdownV2")
+        outbox.reply_to(message, "Please use command /login to interact further; example\n/login\nemployee ID\npassword", parse_mode="MarkdownV2")
     except Exception as e:
-        bot.reply_to(message, f"An error occurred during login: {str(e)}")
-        print(f"Exception during login: {str(e)}")  # Debugging output
+        outbox.reply_to(message, f"An error occurred during login: {str(e)}")
+        auth_log.exception("Login failed with an error", extra=fields(message))
 # Create a new user with their employeeID, name, role & OTP
 @bot.message_handler(commands=["create"])
 @bot.message_handler(func=lambda msg: msg.text in ["create"])
+@track_handler
 def create_user(message):
     chat_id = message.chat.id
     known_user = User.get_by_chat_id(chat_id)
@@ -180,30 +458,99 @@ def create_user(message):
                 elif role.upper() == "HR":
                     role = "HR"
                 else:
-                    bot.reply_to(message, "Please provide Employee/HR as role")
-                pwd = get_hashed(pwd)
+                    outbox.reply_to(message, "Please provide Employee/HR as role")
+                pwd = credential_service.hash(pwd)
                 new_user = User(
                     employee_id=emp_id, fullname=full_name, role=role, temp_pwd=pwd
                 )
                 db_session.add(new_user)
                 db_session.commit()
-                bot.reply_to(message, "User has been added ", parse_mode="MarkdownV2")
+                outbox.reply_to(message, "User has been added ", parse_mode="MarkdownV2")
             except ValueError:
-                bot.reply_to(
+                outbox.reply_to(
                     message,
                     "Please use command /create to create user; "
                     "example\n/create\nemployee ID\nfull name\nrole\nOTP",
                     parse_mode="MarkdownV2",
                 )
         else:
-            bot.reply_to(message, "Sorry!! you can't use this command")
+            outbox.reply_to(message, "Sorry!! you can't use this command")
+    else:
+        outbox.reply_to(message, "You are not yet logged in")
+
+
+# Create many users from a CSV/XLSX document; HR sends it captioned /import
+@bot.message_handler(
+    content_types=["document"],
+    func=lambda msg: (msg.caption or "").strip().startswith("/import"),
+)
+@track_handler
+def import_user_list(message):
+    chat_id = message.chat.id
+    known_user = User.get_by_chat_id(chat_id)
+    if known_user:
+        if known_user.role == "HR":
+            document = message.document
+            extension = os.path.splitext(document.file_name or "")[1].lower()
+            if extension not in (".csv", ".xlsx"):
+                outbox.reply_to(message, "Please upload a .csv or .xlsx file")
+                return
+            if document.file_size and document.file_size > USER_IMPORT_MAX_BYTES:
+                outbox.reply_to(message, f"Please upload a file smaller than {USER_IMPORT_MAX_BYTES // (1024 * 1024)} MB")
+                return
+
+            try:
+                content = file_downloader.fetch(document.file_id)
+            except Exception:
+                outbox.reply_to(message, "Could not download the file. Please send it again.")
+                hr_log.exception("User import download failed", extra=fields(message, known_user))
+                return
+            fd, path = tempfile.mkstemp(suffix=extension)
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(content)
+                # commits by itself, after hashing the OTPs outside any transaction
+                created, errors = import_users(path, credential_service, USER_IMPORT_MAX_ROWS)
+            except ImportFileError as e:
+                db_session.rollback()
+                outbox.reply_to(message, str(e))
+                return
+            except CredentialServiceBusy:
+                db_session.rollback()
+                outbox.reply_to(message, "Too many logins right now; please try the import again in a minute.")
+                hr_log.warning("User import refused, credential service busy", extra=fields(message, known_user, branch="busy"))
+                return
+            except Exception:
+                db_session.rollback()
+                outbox.reply_to(message, "Error importing users. Please try again.")
+                hr_log.exception("User import failed", extra=fields(message, known_user))
+                return
+            finally:
+                os.remove(path)
+
+            if errors:
+                outbox.send_document(
+                    chat_id,
+                    error_report(errors),
+                    caption=f"No users were added; {len(errors)} rows need fixing",
+                    reply_to_message_id=message.message_id,
+                    visible_file_name="import_errors.csv",
+                )
+                hr_log.info("User import rejected", extra=fields(message, known_user, errors=len(errors), branch="invalid_rows"))
+            else:
+                outbox.reply_to(message, f"{created} users have been added")
+                hr_log.info("Users imported", extra=fields(message, known_user, created=created))
+        else:
+            outbox.reply_to(message, "Sorry!! you can't use this command")
+            security_log.warning("Non-HR user tried to import users", extra=fields(message, known_user, branch="not_hr"))
     else:
-        bot.reply_to(message, "You are not yet logged in")
+        outbox.reply_to(message, "You are not yet logged in")
 
 
 # Reset a password with employeeID & OTP
 @bot.message_handler(commands=["rstpwd"])
 @bot.message_handler(func=lambda msg: msg.text in ["rstpwd"])
+@track_handler
 def reset_password(message):
     chat_id = message.chat.id
     known_user = User.get_by_chat_id(chat_id)
@@ -213,38 +560,40 @@ def reset_password(message):
                 _, emp_id, pwd = list(
                     map(lambda x: x.strip(), message.text.split("\n"))
                 )
-                pwd = get_hashed(pwd)
+                pwd = credential_service.hash(pwd)
                 user = User.get_by_emp_id(emp_id)
                 if user:
                     user.temp_pwd = pwd
                     user.is_pwd_expired = False
                     db_session.add(user)
                     db_session.commit()
-                    bot.reply_to(
+                    User.invalidate_cache(user)
+                    outbox.reply_to(
                         message, "New OTP has been updated", parse_mode="MarkdownV2"
                     )
                 else:
-                    bot.reply_to(
+                    outbox.reply_to(
                         message,
                         "Employee doesn't exist or deactivated",
                         parse_mode="MarkdownV2",
                     )
             except ValueError:
-                bot.reply_to(
+                outbox.reply_to(
                     message,
                     "Please use command /rstpwd to create user; "
                     "example\n/rstpwd\nemployee ID\nOTP",
                     parse_mode="MarkdownV2",
                 )
         else:
-            bot.reply_to(message, "Sorry!! you can't use this command")
+            outbox.reply_to(message, "Sorry!! you can't use this command")
     else:
-        bot.reply_to(message, "You are not yet logged in")
+        outbox.reply_to(message, "You are not yet logged in")
 
 
 # Deactivate user by their employee ID
 @bot.message_handler(commands=["deactive"])
 @bot.message_handler(func=lambda msg: msg.text in ["deactive"])
+@track_handler
 def deactivate_user(message):
     chat_id = message.chat.id
     known_user = User.get_by_chat_id(chat_id)
@@ -252,60 +601,62 @@ def deactivate_user(message):
         if known_user.role == "HR":
             try:
                 _, emp_id = list(map(lambda x: x.strip(), message.text.split("\n")))
-                print(f"[DEACTIVATE] HR {known_user.employee_id} requested deactivation for: {emp_id}")
+                hr_log.info("Deactivation requested", extra=fields(message, known_user, employee_id=emp_id))
                 user = User.get_by_emp_id(emp_id)
-                print(f"[DEACTIVATE] User found: {user}")
+                hr_log.debug("Deactivation target looked up", extra=fields(message, known_user, employee_id=emp_id, found=user is not None))
                 if user:
                     if not user.is_active:
-                        bot.reply_to(
+                        outbox.reply_to(
                             message,
                             "User is already deactivated.",
                             parse_mode="MarkdownV2",
                         )
-                        print(f"[DEACTIVATE] User {emp_id} already deactivated.")
+                        hr_log.info("User already deactivated", extra=fields(message, known_user, employee_id=emp_id, branch="already_deactivated"))
                         return
                     user.is_active = False
                     db_session.add(user)
                     try:
                         db_session.commit()
-                        bot.reply_to(
+                        User.invalidate_cache(user)
+                        outbox.reply_to(
                             message, "User has been deactivated", parse_mode="MarkdownV2"
                         )
-                        print(f"[DEACTIVATE] User {emp_id} deactivated successfully.")
+                        hr_log.info("User deactivated", extra=fields(message, known_user, employee_id=emp_id, branch="deactivated"))
                     except Exception as db_exc:
                         db_session.rollback()
-                        bot.reply_to(
+                        outbox.reply_to(
                             message,
                             f"Database error during deactivation: {db_exc}",
                             parse_mode="MarkdownV2",
                         )
-                        print(f"[DEACTIVATE] DB error: {db_exc}")
+                        hr_log.exception("Deactivation failed", extra=fields(message, known_user, employee_id=emp_id, branch="db_error"))
                 else:
-                    bot.reply_to(
+                    outbox.reply_to(
                         message,
                         "Employee doesn't exist or is already deactivated",
                         parse_mode="MarkdownV2",
                     )
-                    print(f"[DEACTIVATE] No user found for {emp_id}.")
+                    hr_log.info("No user to deactivate", extra=fields(message, known_user, employee_id=emp_id, branch="unknown_user"))
             except ValueError:
-                bot.reply_to(
+                outbox.reply_to(
                     message,
                     "Please use command /deactive to create user; "
                     "example\n/deactive\nemployee ID",
                     parse_mode="MarkdownV2",
                 )
-                print("[DEACTIVATE] ValueError: Incorrect command format.")
+                hr_log.info("Malformed /deactive command", extra=fields(message, known_user, branch="bad_format"))
         else:
-            bot.reply_to(message, "Sorry!! you can't use this command")
-            print(f"[DEACTIVATE] Non-HR user {known_user.employee_id} tried to deactivate.")
+            outbox.reply_to(message, "Sorry!! you can't use this command")
+            security_log.warning("Non-HR user tried to deactivate", extra=fields(message, known_user, branch="not_hr"))
     else:
-        bot.reply_to(message, "You are not yet logged in")
-        print("[DEACTIVATE] Command issued by non-logged-in user.")
+        outbox.reply_to(message, "You are not yet logged in")
+        security_log.info("Deactivation from a chat not logged in", extra=fields(message, branch="not_logged_in"))
 
 
 # Reactivate user with their employeeID
 @bot.message_handler(commands=["reactive"])
 @bot.message_handler(func=lambda msg: msg.text in ["reactive"])
+@track_handler
 def reactivate_user(message):
     chat_id = message.chat.id
     known_user = User.get_by_chat_id(chat_id)
@@ -318,38 +669,279 @@ def reactivate_user(message):
                     user.is_active = True
                     db_session.add(user)
                     db_session.commit()
-                    bot.reply_to(
+                    User.invalidate_cache(user)
+                    outbox.reply_to(
                         message, "User has been reactivated", parse_mode="MarkdownV2"
                     )
                 else:
-                    bot.reply_to(
+                    outbox.reply_to(
                         message,
                         "Employee doesn't exist or deactivated",
                         parse_mode="MarkdownV2",
                     )
             except ValueError:
-                bot.reply_to(
+                outbox.reply_to(
                     message,
                     "Please use command /deactive to create user; "
                     "example\n/deactive\nemployee ID",
                     parse_mode="MarkdownV2",
                 )
         else:
-            bot.reply_to(message, "Sorry!! you can't use this command")
+            outbox.reply_to(message, "Sorry!! you can't use this command")
+    else:
+        outbox.reply_to(message, "You are not yet logged in")
+
+
+# Deactivate, reactivate or reset many users at once by their employee IDs
+BULK_COMMANDS = ["bulkdeactive", "bulkreactive", "bulkrstpwd"]
+
+
+def _caption_command(message):
+    caption = (message.caption or "").strip()
+    return caption.split("\n", 1)[0].lstrip("/").split("@", 1)[0] if caption else None
+
+
+@bot.message_handler(commands=BULK_COMMANDS)
+@bot.message_handler(
+    content_types=["document"], func=lambda msg: _caption_command(msg) in BULK_COMMANDS
+)
+@track_handler
+def bulk_update_users(message):
+    chat_id = message.chat.id
+    known_user = User.get_by_chat_id(chat_id)
+    if known_user:
+        if known_user.role == "HR":
+            lines = list(map(lambda x: x.strip(), (message.text or message.caption).split("\n")))
+            command = lines.pop(0).lstrip("/").split("@", 1)[0]
+            if command == "bulkrstpwd":
+                if not lines or not lines[0]:
+                    outbox.reply_to(
+                        message,
+                        "Please use command /bulkrstpwd to reset many users; "
+                        "example\n/bulkrstpwd\nOTP\nemployee ID\nemployee ID",
+                    )
+                    return
+                otp = lines.pop(0)
+            employee_ids = [emp_id.strip() for line in lines for emp_id in line.split(",") if emp_id.strip()]
+            if message.document:
+                extension = os.path.splitext(message.document.file_name or "")[1].lower()
+                if extension not in (".csv", ".xlsx"):
+                    outbox.reply_to(message, "Please upload a .csv or .xlsx file")
+                    return
+                if message.document.file_size and message.document.file_size > USER_IMPORT_MAX_BYTES:
+                    outbox.reply_to(message, f"Please upload a file smaller than {USER_IMPORT_MAX_BYTES // (1024 * 1024)} MB")
+                    return
+                try:
+                    content = file_downloader.fetch(message.document.file_id)
+                except Exception:
+                    outbox.reply_to(message, "Could not download the file. Please send it again.")
+                    hr_log.exception("Bulk update download failed", extra=fields(message, known_user, command=command))
+                    return
+                fd, path = tempfile.mkstemp(suffix=extension)
+                try:
+                    with os.fdopen(fd, "wb") as file:
+                        file.write(content)
+                    employee_ids += read_employee_ids(path, BULK_UPDATE_MAX_IDS)
+                except ImportFileError as e:
+                    outbox.reply_to(message, str(e))
+                    return
+                finally:
+                    os.remove(path)
+            if not employee_ids or len(employee_ids) > BULK_UPDATE_MAX_IDS:
+                outbox.reply_to(
+                    message,
+                    f"Please provide 1 to {BULK_UPDATE_MAX_IDS} employee IDs one per line "
+                    f"after /{command}, or send them as a CSV or XLSX file captioned /{command}",
+                )
+                return
+
+            try:
+                if command == "bulkdeactive":
+                    values, only_active, done = {"is_active": False}, False, "deactivated"
+                elif command == "bulkreactive":
+                    values, only_active, done = {"is_active": True}, False, "reactivated"
+                else:
+                    values = {"temp_pwd": credential_service.hash(otp), "is_pwd_expired": False}
+                    only_active, done = True, "given the new OTP"
+                matched, changed, missing, user_ids = User.bulk_update(employee_ids, values, only_active)
+                db_session.commit()
+            except Exception:
+                db_session.rollback()
+                outbox.reply_to(message, "Error updating users. Please try again.")
+                hr_log.exception("Bulk update failed", extra=fields(message, known_user, command=command))
+                return
+            User.invalidate_users(user_ids)
+
+            reply = (
+                f"{len(changed)} users {done}\n"
+                f"{len(matched) - len(changed)} already were\n"
+                f"{len(missing)} not found{' or deactivated' if only_active else ''}"
+            )
+            if missing:
+                shown = ", ".join(missing[:BULK_UPDATE_MISSING_SHOWN])
+                more = len(missing) - BULK_UPDATE_MISSING_SHOWN
+                reply += f": {shown}" + (f" and {more} more" if more > 0 else "")
+            outbox.reply_to(message, reply)
+            hr_log.info("Bulk update applied", extra=fields(message, known_user, command=command, matched=len(matched), changed=len(changed), missing=len(missing)))
+        else:
+            outbox.reply_to(message, "Sorry!! you can't use this command")
+            security_log.warning("Non-HR user tried a bulk update", extra=fields(message, known_user, branch="not_hr"))
+    else:
+        outbox.reply_to(message, "You are not yet logged in")
+
+
+# Add or update an office with its name, latitude, longitude, radius & optional timezone
+@bot.message_handler(commands=["office"])
+@track_handler
+def upsert_office(message):
+    chat_id = message.chat.id
+    known_user = User.get_by_chat_id(chat_id)
+    if known_user:
+        if known_user.role == "HR":
+            try:
+                _, name, lat, lng, radius, *zone_name = list(
+                    map(lambda x: x.strip(), message.text.split("\n"))
+                )
+                lat, lng, radius = float(lat), float(lng), float(radius)
+                if not (-90 <= lat <= 90 and -180 <= lng <= 180 and radius > 0):
+                    raise ValueError("Invalid coordinates")
+                if len(zone_name) > 1:
+                    raise ValueError("Too many lines")
+                zone_name = zone_name[0] if zone_name else None
+                if zone_name:
+                    try:
+                        get_zone(zone_name)
+                    except (ZoneInfoNotFoundError, ValueError):
+                        outbox.reply_to(message, f"Unknown timezone {zone_name}; use a name like Asia/Kolkata")
+                        return
+                office = Office.get_by_name(name) or Office(name=name)
+                office.latitude, office.longitude = lat, lng
+                office.radius_meters = radius
+                if zone_name is not None:
+                    office.timezone = zone_name
+                office.is_active = True
+                db_session.add(office)
+                db_session.commit()
+                load_index()
+                outbox.reply_to(message, f"Office {name} has been saved")
+            except ValueError:
+                outbox.reply_to(
+                    message,
+                    "Please use command /office to add an office; "
+                    "example\n/office\nname\nlatitude\nlongitude\nradius in meters\n"
+                    "timezone like Asia/Kolkata (optional)",
+                )
+        else:
+            outbox.reply_to(message, "Sorry!! you can't use this command")
+    else:
+        outbox.reply_to(message, "You are not yet logged in")
+
+
+# Restrict an employee to some offices; no office means every office
+@bot.message_handler(commands=["assign"])
+@track_handler
+def assign_offices(message):
+    chat_id = message.chat.id
+    known_user = User.get_by_chat_id(chat_id)
+    if known_user:
+        if known_user.role == "HR":
+            try:
+                _, emp_id, names = list(
+                    map(lambda x: x.strip(), message.text.split("\n"))
+                )
+                user = User.get_by_emp_id(emp_id)
+                if not user:
+                    outbox.reply_to(message, "Employee doesn't exist or deactivated")
+                    return
+                names = [name.strip() for name in names.split(",") if name.strip()]
+                offices = [Office.get_by_name(name) for name in names]
+                unknown = [name for name, office in zip(names, offices) if not office]
+                if unknown:
+                    outbox.reply_to(message, f"Unknown office: {', '.join(unknown)}")
+                    return
+                db_session.query(UserOffice).filter(
+                    UserOffice.user_id == user.id
+                ).delete()
+                for office in offices:
+                    db_session.add(UserOffice(user_id=user.id, office_id=office.id))
+                db_session.commit()
+                load_index()
+                outbox.reply_to(
+                    message,
+                    f"{emp_id} can mark attendance at: {', '.join(names) or 'every office'}",
+                )
+            except ValueError:
+                outbox.reply_to(
+                    message,
+                    "Please use command /assign to assign offices; "
+                    "example\n/assign\nemployee ID\noffice name, office name",
+                )
+        else:
+            outbox.reply_to(message, "Sorry!! you can't use this command")
+    else:
+        outbox.reply_to(message, "You are not yet logged in")
+
+
+# Enroll the reference photo of an employee; HR sends it captioned /enroll
+@bot.message_handler(
+    content_types=["photo"],
+    func=lambda msg: (msg.caption or "").strip().startswith("/enroll"),
+)
+@track_handler
+def enroll_reference(message):
+    chat_id = message.chat.id
+    known_user = User.get_by_chat_id(chat_id)
+    if known_user:
+        if known_user.role == "HR":
+            try:
+                _, emp_id = list(map(lambda x: x.strip(), message.caption.split("\n")))
+            except ValueError:
+                outbox.reply_to(
+                    message,
+                    "Please send the photo with caption /enroll to enroll it; "
+                    "example\n/enroll\nemployee ID",
+                )
+                return
+            user = User.get_by_emp_id(emp_id)
+            if user is None:
+                outbox.reply_to(message, "Employee doesn't exist or is deactivated")
+                return
+            largest = max(message.photo, key=lambda pic: pic.width * pic.height)
+            try:
+                photo = file_downloader.fetch(largest.file_id)
+            except Exception:
+                hr_log.exception("Reference photo download failed", extra=fields(message, known_user, employee_id=emp_id))
+                outbox.reply_to(message, "Could not download the photo. Please send it again.")
+                return
+            try:
+                sha256 = selfie_store.put(photo)
+                user.reference_sha256 = sha256
+                db_session.add(user)
+                db_session.commit()
+                User.invalidate_cache(user)
+                selfie_verifier.invalidate(user.id)
+            except Exception:
+                db_session.rollback()
+                hr_log.exception("Reference enrollment failed", extra=fields(message, known_user, employee_id=emp_id))
+                outbox.reply_to(message, "Error saving the reference photo. Please try again.")
+                return
+            outbox.reply_to(message, f"Reference photo of {emp_id} has been enrolled")
+            hr_log.info("Reference photo enrolled", extra=fields(message, known_user, employee_id=emp_id, sha256=sha256))
+        else:
+            outbox.reply_to(message, "Sorry!! you can't use this command")
+            security_log.warning("Non-HR user tried to enroll a reference", extra=fields(message, known_user, branch="not_hr"))
     else:
-        bot.reply_to(message, "You are not yet logged in")
+        outbox.reply_to(message, "You are not yet logged in")
 
 
 # When user send a picture (selfie)
 @bot.message_handler(content_types=["photo"])
+@track_handler
 def handle_attendance_selfie(message):
     chat_id = message.chat.id
     known_user = User.get_by_chat_id(chat_id)
     if known_user:
         curr_time = UTC_from_epoch(message.date)
-        last_attendance = Attendance.get_last_attendance_record(
-            known_user.id, curr_time
-        )
         pictures = []
         for pic in message.photo:
             pictures.append(
@@ -361,122 +953,27 @@ def handle_attendance_selfie(message):
                     "file_size": pic.file_size,
                 }
             )
+        selfie = Selfie.from_photos(pictures, known_user.id)
+        if Selfie.is_duplicate(selfie.file_unique_id):
+            # the same photo was already used, by this or another employee
+            ATTENDANCE_OUTCOMES.inc(kind="selfie", outcome="duplicate_selfie")
+            security_log.warning("Reused selfie rejected", extra=fields(message, known_user, branch="duplicate_selfie", file_unique_id=selfie.file_unique_id))
+            outbox.reply_to(
+                message,
+                "❌ This photo was already used for attendance.\nPlease take a new selfie.",
+            )
+            return
 
-        # Add facial recognition on message.photo[2] (best quality image) in future
-
-        if last_attendance:
-            # if a attendance is already present for today
-            if last_attendance.selfie_time and last_attendance.location_time:
-                # if the last record already have a selfie & location; create a new record
-                try:
-                    new_attendance(
-                        user_id=known_user.id, selfie=pictures, selfie_time=curr_time
-                    )
-                    print(f"[ATTENDANCE] New selfie record created for user {known_user.id} at {curr_time}")
-                    bot.reply_to(
-                        message,
-                        "Selfie has been added, Please share your location for attendance",
-                    )
-                except Exception as e:
-                    db_session.rollback()
-                    print(f"[ERROR] Failed to create selfie record: {e}")
-                    bot.reply_to(message, "Error saving attendance. Please try again.")
-
-            elif last_attendance.selfie_time:
-                # if already selfie is present
-                time_diff = (curr_time - last_attendance.selfie_time).total_seconds()
-                if time_diff > SELFIE_LOCATION_DELAY:
-                    # but the slack time is already passed
-                    try:
-                        new_attendance(
-                            user_id=known_user.id, selfie=pictures, selfie_time=curr_time
-                        )
-                        print(f"[ATTENDANCE] New selfie record created for user {known_user.id} after delay at {curr_time}")
-                        bot.reply_to(
-                            message,
-                            f"Oops.. You are unable to send location within <b>{SELFIE_LOCATION_DELAY / 60:.1f}</b> minutes",
-                            parse_mode="HTML",
-                        )
-                        bot.send_message(
-                            chat_id,
-                            f"We have added your selfie, Please share your location within <b>{SELFIE_LOCATION_DELAY / 60:.1f}</b> minutes for attendance",
-                            parse_mode="HTML",
-                        )
-                    except Exception as e:
-                        db_session.rollback()
-                        print(f"[ERROR] Failed to create selfie record after delay: {e}")
-                        bot.reply_to(message, "Error saving attendance. Please try again.")
-                else:
-                    # if still have some time left
-                    time_left = SELFIE_LOCATION_DELAY - time_diff
-                    bot.reply_to(
-                        message,
-                        "Selfie has been already received; "
-                        f"Please send your location in <b>{time_left/60:.1f}</b> minutes for attendance",
-                        parse_mode="HTML",
-                    )
-
-            elif last_attendance.location_time:
-                # if location is already exists
-                time_diff = (curr_time - last_attendance.location_time).total_seconds()
-                if time_diff > SELFIE_LOCATION_DELAY:
-                    # but slack time passed
-                    try:
-                        new_attendance(
-                            user_id=known_user.id, selfie=pictures, selfie_time=curr_time
-                        )
-                        print(f"[ATTENDANCE] New selfie record created for user {known_user.id} after location delay at {curr_time}")
-                        bot.reply_to(
-                            message,
-                            f"Oops.. You are unable to send selfie within <b>{SELFIE_LOCATION_DELAY / 60:.1f}</b> minutes",
-                            parse_mode="HTML",
-                        )
-                        bot.send_message(
-                            chat_id,
-                            "We have added your selfie, Please share your location within "
-                            f"<b>{SELFIE_LOCATION_DELAY / 60:.1f}</b> minutes for attendance",
-                            parse_mode="HTML",
-                        )
-                    except Exception as e:
-                        db_session.rollback()
-                        print(f"[ERROR] Failed to create selfie record after location delay: {e}")
-                        bot.reply_to(message, "Error saving attendance. Please try again.")
-                else:
-                    # selfie sent within the slack time
-                    last_attendance.selfie = pictures
-                    last_attendance.selfie_time = curr_time
-                    db_session.add(last_attendance)
-                    try:
-                        db_session.commit()
-                        print(f"[ATTENDANCE] Updated selfie for user {known_user.id} at {curr_time}")
-                        bot.reply_to(message, "Your attendance has been added 👍")
-                    except Exception as e:
-                        db_session.rollback()
-                        print(f"[ERROR] Failed to update selfie record: {e}")
-                        bot.reply_to(message, "Error updating attendance. Please try again.")
-
-        else:
-            # if there are no record create a new record
-            try:
-                new_attendance(
-                    user_id=known_user.id, selfie=pictures, selfie_time=curr_time
-                )
-                print(f"[ATTENDANCE] First selfie record created for user {known_user.id} at {curr_time}")
-                bot.reply_to(
-                    message,
-                    "Selfie has been added, Please share your location for attendance",
-                )
-            except Exception as e:
-                db_session.rollback()
-                print(f"[ERROR] Failed to create first selfie record: {e}")
-                bot.reply_to(message, "Error saving attendance. Please try again.")
-
+        # the largest size is downloaded and compared with the employee's
+        # reference in the background once the record is committed
+        record_attendance(message, known_user, "selfie", selfie, curr_time)
     else:
-        bot.reply_to(message, "You are not yet logged in")
+        outbox.reply_to(message, "You are not yet logged in")
 
 
 # When user send location
 @bot.message_handler(content_types=["location"])
+@track_handler
 def handle_attendance_location(message):
     chat_id = message.chat.id
     known_user = User.get_by_chat_id(chat_id)
@@ -486,26 +983,25 @@ def handle_attendance_location(message):
 
         # ❌ Reject static/pinned location
         if live_period is None:
-            bot.reply_to(
+            outbox.reply_to(
                 message,
                 "❌ Static location not allowed.\nPlease share LIVE location for attendance."
             )
-            print(f"[SECURITY] Static location rejected for user {known_user.id}")
+            security_log.warning("Static location rejected", extra=fields(message, known_user, branch="static_location_reject"))
+            ATTENDANCE_OUTCOMES.inc(kind="location", outcome="static_location_reject")
             return
 
         # ❌ Reject if live duration too short
         if live_period < MIN_LIVE_LOCATION_DURATION:
-            bot.reply_to(
+            outbox.reply_to(
                 message,
                 f"❌ Live location too short.\nPlease share for at least {MIN_LIVE_LOCATION_DURATION} seconds."
             )
-            print(f"[SECURITY] Live duration too short ({live_period}s) for user {known_user.id}")
+            security_log.warning("Live location too short", extra=fields(message, known_user, branch="short_live_reject", live_period=live_period))
+            ATTENDANCE_OUTCOMES.inc(kind="location", outcome="short_live_reject")
             return
 
         curr_time = UTC_from_epoch(message.date)
-        last_attendance = Attendance.get_last_attendance_record(
-            known_user.id, curr_time
-        )
         location = {
             "longitude": message.location.longitude,
             "latitude": message.location.latitude,
@@ -514,149 +1010,207 @@ def handle_attendance_location(message):
         user_lat = message.location.latitude
         user_lng = message.location.longitude
 
-        if not is_within_office(user_lat, user_lng):
-            bot.reply_to(
+        if not is_within_office(user_lat, user_lng, known_user.id):
+            outbox.reply_to(
                 message,
                 "❌ You are outside the office premises.\nAttendance rejected."
             )
-            print(f"[SECURITY] Fake/remote location attempt by user {known_user.id}: {user_lat}, {user_lng}")
+            security_log.warning("Location outside every office", extra=fields(message, known_user, branch="geofence_reject", latitude=user_lat, longitude=user_lng))
+            ATTENDANCE_OUTCOMES.inc(kind="location", outcome="geofence_reject")
             return
 
-
-        if last_attendance:
-            # if a attendance is already present for today
-            if last_attendance.selfie_time and last_attendance.location_time:
-                # but both selfie and location has been added; create a new record
-                try:
-                    new_attendance(
-                        user_id=known_user.id, location=location, location_time=curr_time
-                    )
-                    print(f"[ATTENDANCE] New location record created for user {known_user.id} at {curr_time}")
-                    bot.reply_to(
-                        message,
-                        "Location has been added, Please share your selfie for attendance",
-                    )
-                except Exception as e:
-                    db_session.rollback()
-                    print(f"[ERROR] Failed to create location record: {e}")
-                    bot.reply_to(message, "Error saving attendance. Please try again.")
-            elif last_attendance.selfie_time:
-                # and selfie is already present
-                time_diff = (curr_time - last_attendance.selfie_time).total_seconds()
-                if time_diff > SELFIE_LOCATION_DELAY:
-                    # location is sent after slack time is over
-                    try:
-                        new_attendance(
-                            user_id=known_user.id,
-                            location=location,
-                            location_time=curr_time,
-                        )
-                        print(f"[ATTENDANCE] New location record created for user {known_user.id} after delay at {curr_time}")
-                        bot.reply_to(
-                            message,
-                            f"Oops.. You are unable to send location within <b>{SELFIE_LOCATION_DELAY / 60:.1f}</b> minutes",
-                            parse_mode="HTML",
-                        )
-                        bot.send_message(
-                            chat_id,
-                            "We have added your location, Please share your selfie within "
-                            f"<b>{SELFIE_LOCATION_DELAY / 60:.1f}</b> minutes for attendance",
-                            parse_mode="HTML",
-                        )
-                    except Exception as e:
-                        db_session.rollback()
-                        print(f"[ERROR] Failed to create location record after delay: {e}")
-                        bot.reply_to(message, "Error saving attendance. Please try again.")
-                else:
-                    # location sent within the slack time
-                    last_attendance.location = location
-                    last_attendance.location_time = curr_time
-                    db_session.add(last_attendance)
-                    try:
-                        db_session.commit()
-                        print(f"[ATTENDANCE] Updated location for user {known_user.id} at {curr_time}")
-                        bot.reply_to(message, "Your attendance has been added 👍")
-                    except Exception as e:
-                        db_session.rollback()
-                        print(f"[ERROR] Failed to update location record: {e}")
-                        bot.reply_to(message, "Error updating attendance. Please try again.")
-            elif last_attendance.location_time:
-                # and location is already present
-                time_diff = (curr_time - last_attendance.location_time).total_seconds()
-                if time_diff > SELFIE_LOCATION_DELAY:
-                    # if location is sent after slack time
-                    try:
-                        new_attendance(
-                            user_id=known_user.id,
-                            location=location,
-                            location_time=curr_time,
-                        )
-                        print(f"[ATTENDANCE] New location record created for user {known_user.id} after selfie delay at {curr_time}")
-                        bot.reply_to(
-                            message,
-                            f"Oops.. You are unable to send selfie within <b>{SELFIE_LOCATION_DELAY / 60:.1f}</b> minutes",
-                            parse_mode="HTML",
-                        )
-                        bot.send_message(
-                            chat_id,
-                            "We have added your location, Please share your selfie within "
-                            f"<b>{SELFIE_LOCATION_DELAY / 60:.1f}</b> minutes for attendance",
-                            parse_mode="HTML",
-                        )
-                    except Exception as e:
-                        db_session.rollback()
-                        print(f"[ERROR] Failed to create location record after selfie delay: {e}")
-                        bot.reply_to(message, "Error saving attendance. Please try again.")
-                else:
-                    # if still have some time left
-                    time_left = SELFIE_LOCATION_DELAY - time_diff
-                    bot.reply_to(
-                        message,
-                        "Location has been already received; "
-                        f"Please send your selfie in <b>{time_left / 60:.1f}</b> minutes for attendance",
-                        parse_mode="HTML",
-                    )
+        # 📡 wait for enough in-fence live updates before marking attendance
+        sample = LiveSample(user_lat, user_lng, curr_time, True)
+        if live_tracker.start(known_user.id, message.message_id, live_period, sample):
+            record_attendance(message, known_user, "location", location, curr_time)
         else:
-            # if there are no record create a new record
-            try:
-                new_attendance(
-                    user_id=known_user.id, location=location, location_time=curr_time
-                )
-                print(f"[ATTENDANCE] First location record created for user {known_user.id} at {curr_time}")
-                bot.reply_to(
-                    message,
-                    "Location has been added, Please share your selfie for attendance",
-                )
-            except Exception as e:
-                db_session.rollback()
-                print(f"[ERROR] Failed to create first location record: {e}")
-                bot.reply_to(message, "Error saving attendance. Please try again.")
+            ATTENDANCE_OUTCOMES.inc(kind="location", outcome="awaiting_live_updates")
+            outbox.reply_to(
+                message,
+                "📡 Live location received.\nKeep sharing it until your attendance is confirmed."
+            )
     else:
-        bot.reply_to(message, "You are not yet logged in")
+        outbox.reply_to(message, "You are not yet logged in")
+
 
+# When user's live location moves; Telegram edits the live location message
+@bot.edited_message_handler(content_types=["location"])
+@track_handler
+def handle_live_location_update(message):
+    known_user = User.get_by_chat_id(message.chat.id)
+    if known_user:
+        if getattr(message.location, "live_period", None) is None:
+            # user stopped sharing
+            live_tracker.stop(known_user.id)
+            return
 
-# Download attendance report
+        curr_time = UTC_from_epoch(message.edit_date or message.date)
+        user_lat = message.location.latitude
+        user_lng = message.location.longitude
+        in_fence = is_within_office(user_lat, user_lng, known_user.id)
+        sample = LiveSample(user_lat, user_lng, curr_time, in_fence)
+        if live_tracker.update(known_user.id, message.message_id, sample):
+            location = {"longitude": user_lng, "latitude": user_lat}
+            record_attendance(message, known_user, "location", location, curr_time)
+
+
+# Download monthly attendance report with month & year
+@bot.message_handler(commands=["download"])
 @bot.message_handler(func=lambda msg: msg.text.strip().lower() == "download")
+@track_handler
 def download_report(message):
-    bot.reply_to(
-        message,
-        "This feature is under development; Please contact your administrator for assistance",
-    )
+    chat_id = message.chat.id
+    known_user = User.get_by_chat_id(chat_id)
+    if known_user:
+        try:
+            lines = list(map(lambda x: x.strip(), message.text.split("\n")))
+            fmt = "xlsx"
+            if lines[-1].lower() in FORMATS:
+                fmt = lines.pop().lower()
+            if len(lines) == 1:
+                today = user_calendar(known_user.id).day_of(UTC_from_epoch(message.date))
+                month, year = today.month, today.year
+            else:
+                _, month, year = lines
+                month, year = int(month), int(year)
+            if not 1 <= month <= 12:
+                raise ValueError("Invalid month")
+        except ValueError:
+            outbox.reply_to(
+                message,
+                "Please use command /download to download your attendance; "
+                "example\n/download\nmonth\nyear\nxlsx or pdf (optional)",
+            )
+            return
+
+        # a cheap aggregate tells whether a cached report is still current
+        version = report_data_version(known_user.id, year, month)
+        try:
+            report_jobs.request(
+                chat_id,
+                message.message_id,
+                known_user.id,
+                year,
+                month,
+                fmt,
+                f"attendance_{known_user.employee_id}_{year}-{month:02d}.{fmt}",
+                version,
+            )
+        except ReportQueueFull:
+            outbox.reply_to(message, "Too many reports are being prepared; please try again in a minute.")
+            return
+    else:
+        outbox.reply_to(message, "You are not yet logged in")
+
+
+# Review the selfies of a day from the local selfie store
+@bot.message_handler(commands=["selfies"])
+@track_handler
+def review_selfies(message):
+    chat_id = message.chat.id
+    known_user = User.get_by_chat_id(chat_id)
+    if known_user:
+        if known_user.role == "HR":
+            # days of the reviewer's office timezone
+            calendar = user_calendar(known_user.id)
+            try:
+                lines = list(map(lambda x: x.strip(), message.text.split("\n")))
+                if len(lines) == 1:
+                    day = calendar.day_of(UTC_from_epoch(message.date))
+                else:
+                    _, day = lines
+                    day = datetime.strptime(day, "%d-%m-%Y").date()
+            except ValueError:
+                outbox.reply_to(
+                    message,
+                    "Please use command /selfies to review selfies; "
+                    "example\n/selfies\nDD-MM-YYYY",
+                )
+                return
+
+            path, selfies, missing = build_selfie_review(selfie_store, day, calendar)
+            if path is None:
+                outbox.reply_to(message, f"No selfies found for {day:%d-%m-%Y}")
+                return
+            try:
+                caption = f"{selfies} selfies on {day:%d-%m-%Y}"
+                if missing:
+                    caption += f"; {missing} not downloaded yet"
+                with open(path, "rb") as sheet:
+                    outbox.send_document(
+                        chat_id,
+                        sheet,
+                        caption=caption,
+                        reply_to_message_id=message.message_id,
+                        visible_file_name=f"selfies_{day:%Y-%m-%d}.jpg",
+                    ).result()
+                hr_log.info("Selfies reviewed", extra=fields(message, known_user, day=day, selfies=selfies, missing=missing))
+            finally:
+                os.remove(path)
+        else:
+            outbox.reply_to(message, "Sorry!! you can't use this command")
+            security_log.warning("Non-HR user tried to review selfies", extra=fields(message, known_user, branch="not_hr"))
+    else:
+        outbox.reply_to(message, "You are not yet logged in")
 
 
 # When user send any message except the commands, picture or location (Fallback State)
 @bot.message_handler(func=lambda msg: True)
+@track_handler
 def echo_all(message):
-    bot.reply_to(
+    outbox.reply_to(
         message,
         "Sorry I can't help you in this; Please checkout /help or contact your administrator",
     )
 
 
-print("[BOT] Telegram Attendance Bot is starting...")
-try:
-    bot.infinity_polling()
-except Exception as e:
-    print(f"[BOT] Telegram Attendance Bot stopped due to error: {e}")
-else:
-    print("[BOT] Telegram Attendance Bot stopped.")
\ No newline at end of file
+if __name__ == "__main__":
+    bot_log.info("Telegram Attendance Bot is starting")
+    if not is_schema_current():
+        bot_log.error("Database schema is not up to date; run `python manage.py init` first")
+        raise SystemExit(1)
+    if not acquire_instance_lock():
+        # live location sessions and pending pairs live in this process
+        bot_log.error("Another bot process is already serving this database; run only one")
+        raise SystemExit(1)
+    load_index()
+    with session_scope():
+        pending = pending_pairs.rebuild()
+    bot_log.info("Pending attendance pairs loaded", extra=fields(count=pending))
+    credential_service.start()
+    selfie_verifier.start()
+    selfie_fetcher.start()
+    report_jobs.start()
+    if METRICS_PORT:
+        MetricsServer(METRICS_HOST, METRICS_PORT).start()
+        bot_log.info(
+            "Serving metrics",
+            extra=fields(url=f"http://{METRICS_HOST}:{METRICS_PORT}/metrics"),
+        )
+    try:
+        if WEBHOOK_URL:
+            server = WebhookServer(
+                bot,
+                WEBHOOK_SECRET,
+                WEBHOOK_HOST,
+                WEBHOOK_PORT,
+                queue_size=WEBHOOK_QUEUE_SIZE,
+                dispatchers=WEBHOOK_DISPATCHERS,
+            )
+            Gauge(
+                "webhook_queued_updates",
+                "Updates received and waiting for a dispatcher",
+                function=server.updates.qsize,
+            )
+            server.register(WEBHOOK_URL)
+            bot_log.info(
+                "Receiving updates by webhook",
+                extra=fields(host=WEBHOOK_HOST, port=WEBHOOK_PORT),
+            )
+            server.serve_forever()
+        else:
+            bot.infinity_polling()
+    except Exception:
+        bot_log.exception("Telegram Attendance Bot stopped due to an error")
+    else:
+        bot_log.info("Telegram Attendance Bot stopped")
@@ -0,0 +1,670 @@
+"""
+Asyncio runtime of the attendance bot; a limited alternative to main.py
+
+Serves the core flows (login, logout, user management, selfie and live
+location attendance, XLSX /download) on AsyncTeleBot with one event loop
+and an aiosqlite backed SQLAlchemy session per update, so thousands of
+updates can be in flight while waiting on Telegram or the database.
+
+main.py is the complete bot. This runtime does not have /office, /assign,
+/import, the bulk commands, /enroll, /selfies or PDF reports, and it runs
+without main.py's webhook mode, outbound rate-aware scheduler,
+write-behind queue and background report jobs: replies go straight to
+Telegram and every /download builds its report again. Only run it when
+those are not needed.
+
+usage: python main_async.py
+"""
+
+import asyncio
+import os
+
+import telebot
+from telebot.async_telebot import AsyncTeleBot
+
+from attendance_state import UNKNOWN, PendingPairTracker, next_transition
+from db_backend import acquire_instance_lock, create_async_session_factory, session_scope
+from geofence import is_within_office, load_index, user_calendar
+from credentials import CredentialServiceBusy, credential_service, needs_rehash
+from helpers import UTC_from_epoch
+from live_location import LiveLocationTracker, LiveSample
+from log import fields, get_logger, setup_logging
+from metrics import ATTENDANCE_OUTCOMES, MetricsServer, track_handler
+from migrations import is_schema_current
+from models import Attendance, Selfie, StalePendingPair, User
+from reports import build_monthly_report
+from selfie_store import SelfieFetcher, SelfieStore, TelegramFileSource
+from verification import SelfieVerifier
+from settings import BOT_TOKEN, MIN_LIVE_LOCATION_DURATION, SELFIE_LOCATION_DELAY
+from settings import LOG_LEVEL, LOG_QUEUE_SIZE, LOG_RATE_LIMITS, LOG_SAMPLE_RATES
+from settings import METRICS_HOST, METRICS_PORT
+from settings import (
+    SELFIE_FETCH_MAX_PENDING,
+    SELFIE_FETCH_WORKERS,
+    SELFIE_MATCH_MAX_DISTANCE,
+    SELFIE_REFERENCE_CACHE_SIZE,
+    SELFIE_STORE_DIR,
+    SELFIE_THUMBNAIL_QUALITY,
+    SELFIE_THUMBNAIL_SIZE,
+    SELFIE_THUMBNAIL_WORKERS,
+    SELFIE_VERIFY_MAX_PENDING,
+    SELFIE_VERIFY_WORKERS,
+)
+from settings import (
+    LIVE_LOCATION_BUFFER_SIZE,
+    LIVE_LOCATION_MAX_SESSIONS,
+    REQUIRED_LIVE_UPDATES,
+)
+
+setup_logging(LOG_LEVEL, LOG_QUEUE_SIZE, LOG_RATE_LIMITS, LOG_SAMPLE_RATES)
+bot_log = get_logger("bot")
+attendance_log = get_logger("attendance")
+
+bot = AsyncTeleBot(BOT_TOKEN)
+Session = create_async_session_factory()
+pending_pairs = PendingPairTracker()
+live_tracker = LiveLocationTracker(
+    REQUIRED_LIVE_UPDATES,
+    buffer_size=LIVE_LOCATION_BUFFER_SIZE,
+    max_sessions=LIVE_LOCATION_MAX_SESSIONS,
+)
+selfie_store = SelfieStore(
+    SELFIE_STORE_DIR, SELFIE_THUMBNAIL_SIZE, SELFIE_THUMBNAIL_QUALITY
+)
+selfie_verifier = SelfieVerifier(
+    selfie_store,
+    workers=SELFIE_VERIFY_WORKERS,
+    max_pending=SELFIE_VERIFY_MAX_PENDING,
+    max_distance=SELFIE_MATCH_MAX_DISTANCE,
+    cache_size=SELFIE_REFERENCE_CACHE_SIZE,
+)
+# downloads run on the fetcher's threads, so they use the synchronous client
+selfie_fetcher = SelfieFetcher(
+    selfie_store,
+    TelegramFileSource(telebot.TeleBot(BOT_TOKEN)),
+    workers=SELFIE_FETCH_WORKERS,
+    thumbnail_workers=SELFIE_THUMBNAIL_WORKERS,
+    max_pending=SELFIE_FETCH_MAX_PENDING,
+    on_stored=selfie_verifier.verify,
+)
+
+
+async def run_query(session, method, *args, **kwargs):
+    """
+    Run a synchronous model query on the async session
+    :param session: async session of the update
+    :param method: model classmethod accepting a `session` keyword
+    """
+    return await session.run_sync(
+        lambda sync_session: method(*args, session=sync_session, **kwargs)
+    )
+
+
+def parse_lines(message):
+    return list(map(lambda x: x.strip(), message.text.split("\n")))
+
+
+# When user starts a flow; welcome them
+@bot.message_handler(commands=["start", "hello"])
+@bot.message_handler(func=lambda msg: msg.text in ["start", "hello"])
+@track_handler
+async def welcome_user(message):
+    async with Session() as session:
+        known_user = await run_query(session, User.get_by_chat_id, message.chat.id)
+    if known_user:
+        await bot.reply_to(
+            message,
+            f"Hi, *{known_user.fullname}*; Welcome back",
+            parse_mode="MarkdownV2",
+        )
+    else:
+        await bot.reply_to(
+            message,
+            "Please use command /login to interact further; example\n/login\nemployee ID\npassword \n\n"
+            "or /help for other commands",
+            parse_mode="MarkdownV2",
+        )
+
+
+# Show help options to users
+@bot.message_handler(commands=["help"])
+@bot.message_handler(func=lambda msg: msg.text in ["help"])
+@track_handler
+async def help_msg(message):
+    await bot.reply_to(
+        message,
+        "/login \\- to login a user with employee ID and OTP followed by command\n"
+        "/logout \\- to logout a user\n"
+        "/create \\- HR can create a new user with their employee ID, name, role, OTP followed by command\n"
+        "/download \\- user can download their monthly attendance by providing the month & year followed by command\n"
+        "/rstpwd \\- HR can reset user password by providing employee ID & OTP followed by command\n"
+        "/deactive \\- HR can deactivate an user by providing employee ID followed by command\n"
+        "/reactive \\- HR can reactive an user by providing employee ID followed by command",
+        parse_mode="MarkdownV2",
+    )
+
+
+# Logout a user; keep their account active
+@bot.message_handler(commands=["logout"])
+@bot.message_handler(func=lambda msg: msg.text in ["logout"])
+@track_handler
+async def logout_user(message):
+    chat_id = message.chat.id
+    async with Session() as session:
+        known_user = await run_query(session, User.get_by_chat_id, chat_id)
+        if known_user is None:
+            await bot.reply_to(
+                message,
+                "You are not currently logged in. Please log in first using /login.",
+            )
+            return
+
+        known_user.is_logged_in = False
+        known_user.last_chat_id = None
+        await session.commit()
+        User.invalidate_cache(known_user, chat_id)
+
+    await bot.reply_to(
+        message,
+        "You have been successfully logged out. You can log in again using the /login command.",
+    )
+
+
+# Login a user with employeeID & password
+@bot.message_handler(commands=["login"])
+@track_handler
+async def login_user(message):
+    chat_id = message.chat.id
+    try:
+        _, emp_id, pwd = parse_lines(message)
+    except ValueError:
+        await bot.reply_to(
+            message,
+            "Please use command /login to interact further; example\n/login\nemployee ID\npassword",
+            parse_mode="MarkdownV2",
+        )
+        return
+
+    async with Session() as session:
+        known_user = await run_query(session, User.get_for_login, emp_id)
+        try:
+            valid = await credential_service.verify_async(
+                pwd, known_user.temp_pwd if known_user else None
+            )
+            if valid and needs_rehash(known_user.temp_pwd):
+                known_user.temp_pwd = await credential_service.hash_async(pwd)
+        except CredentialServiceBusy:
+            await bot.reply_to(
+                message, "Too many logins right now; please try again in a minute."
+            )
+            return
+        if not valid:
+            await bot.reply_to(
+                message,
+                "Invalid credentials; login failed. Please check your Employee ID and password.",
+            )
+            return
+
+        known_user.last_chat_id = str(chat_id)
+        known_user.is_logged_in = True
+        await session.commit()
+        User.invalidate_cache(known_user, chat_id)
+
+    await bot.reply_to(
+        message, f"Hello *{known_user.fullname}*", parse_mode="MarkdownV2"
+    )
+
+
+async def get_hr_user(message, session):
+    """
+    Get the logged-in HR sending the message, replying to anyone else
+    :param message: received message
+    :param session: async session of the update
+    """
+    known_user = await run_query(session, User.get_by_chat_id, message.chat.id)
+    if not known_user:
+        await bot.reply_to(message, "You are not yet logged in")
+    elif known_user.role != "HR":
+        await bot.reply_to(message, "Sorry!! you can't use this command")
+    else:
+        return known_user
+
+
+# Create a new user with their employeeID, name, role & OTP
+@bot.message_handler(commands=["create"])
+@bot.message_handler(func=lambda msg: msg.text in ["create"])
+@track_handler
+async def create_user(message):
+    async with Session() as session:
+        if not await get_hr_user(message, session):
+            return
+        try:
+            _, emp_id, full_name, role, pwd = parse_lines(message)
+        except ValueError:
+            await bot.reply_to(
+                message,
+                "Please use command /create to create user; "
+                "example\n/create\nemployee ID\nfull name\nrole\nOTP",
+                parse_mode="MarkdownV2",
+            )
+            return
+        if role.title() == "Employee":
+            role = "Employee"
+        elif role.upper() == "HR":
+            role = "HR"
+        else:
+            await bot.reply_to(message, "Please provide Employee/HR as role")
+            return
+        session.add(
+            User(
+                employee_id=emp_id,
+                fullname=full_name,
+                role=role,
+                temp_pwd=await credential_service.hash_async(pwd),
+            )
+        )
+        await session.commit()
+    await bot.reply_to(message, "User has been added ", parse_mode="MarkdownV2")
+
+
+# Reset a password with employeeID & OTP
+@bot.message_handler(commands=["rstpwd"])
+@bot.message_handler(func=lambda msg: msg.text in ["rstpwd"])
+@track_handler
+async def reset_password(message):
+    async with Session() as session:
+        if not await get_hr_user(message, session):
+            return
+        try:
+            _, emp_id, pwd = parse_lines(message)
+        except ValueError:
+            await bot.reply_to(
+                message,
+                "Please use command /rstpwd to create user; "
+                "example\n/rstpwd\nemployee ID\nOTP",
+                parse_mode="MarkdownV2",
+            )
+            return
+        user = await run_query(session, User.get_by_emp_id, emp_id)
+        if not user:
+            await bot.reply_to(
+                message,
+                "Employee doesn't exist or deactivated",
+                parse_mode="MarkdownV2",
+            )
+            return
+        user.temp_pwd = await credential_service.hash_async(pwd)
+        user.is_pwd_expired = False
+        await session.commit()
+        User.invalidate_cache(user)
+    await bot.reply_to(message, "New OTP has been updated", parse_mode="MarkdownV2")
+
+
+async def set_user_active(message, is_active: bool):
+    """
+    Deactivate/Reactivate the employee ID given in message
+    :param message: received message
+    :param is_active: new state of the user
+    """
+    command = "/deactive" if not is_active else "/reactive"
+    async with Session() as session:
+        if not await get_hr_user(message, session):
+            return
+        try:
+            _, emp_id = parse_lines(message)
+        except ValueError:
+            await bot.reply_to(
+                message,
+                f"Please use command {command} to create user; "
+                f"example\n{command}\nemployee ID",
+                parse_mode="MarkdownV2",
+            )
+            return
+        user = await run_query(session, User.get_by_emp_id, emp_id, only_active=False)
+        if not user or (not is_active and not user.is_active):
+            await bot.reply_to(
+                message,
+                (
+                    "Employee doesn't exist or deactivated"
+                    if is_active
+                    else "Employee doesn't exist or is already deactivated"
+                ),
+                parse_mode="MarkdownV2",
+            )
+            return
+        user.is_active = is_active
+        await session.commit()
+        User.invalidate_cache(user)
+    await bot.reply_to(
+        message,
+        "User has been reactivated" if is_active else "User has been deactivated",
+        parse_mode="MarkdownV2",
+    )
+
+
+# Deactivate user by their employee ID
+@bot.message_handler(commands=["deactive"])
+@bot.message_handler(func=lambda msg: msg.text in ["deactive"])
+@track_handler
+async def deactivate_user(message):
+    await set_user_active(message, False)
+
+
+# Reactivate user with their employeeID
+@bot.message_handler(commands=["reactive"])
+@bot.message_handler(func=lambda msg: msg.text in ["reactive"])
+@track_handler
+async def reactivate_user(message):
+    await set_user_active(message, True)
+
+
+async def record_attendance(message, session, known_user, kind: str, value):
+    """
+    Add the selfie or the location to today's attendance, pairing it with the
+    other half when that arrived within SELFIE_LOCATION_DELAY
+    :param message: received message
+    :param session: async session of the update
+    :param known_user: user sending the message
+    :param kind: "selfie" or "location"
+    :param value: Selfie or location to be stored
+    """
+    curr_time = UTC_from_epoch(message.edit_date or message.date)
+    calendar = user_calendar(known_user.id)
+    # the tracker is only a hint: the writes check it against the database,
+    # and on a mismatch the decision is taken again from the database
+    pair = pending_pairs.get(known_user.id)
+    from_database = pair is UNKNOWN
+    while True:
+        if pair is UNKNOWN:
+            last_attendance = await run_query(
+                session,
+                Attendance.get_last_attendance_record,
+                known_user.id,
+                curr_time,
+                calendar=calendar,
+            )
+            pair = pending_pairs.load(known_user.id, last_attendance)
+        transition = next_transition(pair, kind, curr_time, calendar, SELFIE_LOCATION_DELAY)
+        if transition.outcome == "already_received" and not from_database:
+            # nothing is written to check the hint with; read the record
+            pair, from_database = UNKNOWN, True
+            continue
+
+        attendance_id = None
+        try:
+            if transition.outcome == "merged":
+                await run_query(
+                    session,
+                    Attendance.complete_pair,
+                    pair.attendance_id,
+                    known_user.id,
+                    kind,
+                    value,
+                    curr_time,
+                    pair.timestamp,
+                    calendar=calendar,
+                )
+                await session.commit()
+            elif transition.outcome != "already_received":
+                attendance_id = await run_query(
+                    session,
+                    Attendance.start_pair,
+                    known_user.id,
+                    kind,
+                    value,
+                    curr_time,
+                    pending_id=pair.attendance_id if transition.outcome == "delay_expired" else None,
+                    calendar=calendar,
+                )
+                await session.commit()
+        except StalePendingPair:
+            pending_pairs.invalidate(known_user.id)
+            await session.rollback()
+            if from_database:
+                raise
+            pair, from_database = UNKNOWN, True
+            continue
+        except Exception:
+            # the write may still be committed; read the database next time
+            pending_pairs.invalidate(known_user.id)
+            raise
+        break
+    pending_pairs.apply(known_user.id, transition, attendance_id)
+    ATTENDANCE_OUTCOMES.inc(kind=kind, outcome=transition.outcome)
+    reply, *others = transition.replies()
+    await bot.reply_to(message, reply, parse_mode="HTML")
+    for text in others:
+        await bot.send_message(message.chat.id, text, parse_mode="HTML")
+
+
+# When user send a picture (selfie)
+@bot.message_handler(content_types=["photo"])
+@track_handler
+async def handle_attendance_selfie(message):
+    async with Session() as session:
+        known_user = await run_query(session, User.get_by_chat_id, message.chat.id)
+        if not known_user:
+            await bot.reply_to(message, "You are not yet logged in")
+            return
+        pictures = [
+            {
+                "file_id": pic.file_id,
+                "file_unique_id": pic.file_unique_id,
+                "width": pic.width,
+                "height": pic.height,
+                "file_size": pic.file_size,
+            }
+            for pic in message.photo
+        ]
+        selfie = Selfie.from_photos(pictures, known_user.id)
+        if await run_query(session, Selfie.is_duplicate, selfie.file_unique_id):
+            # the same photo was already used, by this or another employee
+            ATTENDANCE_OUTCOMES.inc(kind="selfie", outcome="duplicate_selfie")
+            await bot.reply_to(
+                message,
+                "❌ This photo was already used for attendance.\nPlease take a new selfie.",
+            )
+            return
+        try:
+            await record_attendance(message, session, known_user, "selfie", selfie)
+            if selfie.attendance_id is not None:
+                # stored and committed; keep a local copy
+                selfie_fetcher.submit(selfie.file_unique_id, selfie.file_id)
+        except Exception:
+            await session.rollback()
+            attendance_log.exception(
+                "Failed to save selfie", extra=fields(message, known_user)
+            )
+            await bot.reply_to(message, "Error saving attendance. Please try again.")
+
+
+# When user send location
+@bot.message_handler(content_types=["location"])
+@track_handler
+async def handle_attendance_location(message):
+    async with Session() as session:
+        known_user = await run_query(session, User.get_by_chat_id, message.chat.id)
+        if not known_user:
+            await bot.reply_to(message, "You are not yet logged in")
+            return
+
+        live_period = getattr(message.location, "live_period", None)
+        if live_period is None:
+            ATTENDANCE_OUTCOMES.inc(kind="location", outcome="static_location_reject")
+            await bot.reply_to(
+                message,
+                "❌ Static location not allowed.\nPlease share LIVE location for attendance.",
+            )
+            return
+        if live_period < MIN_LIVE_LOCATION_DURATION:
+            ATTENDANCE_OUTCOMES.inc(kind="location", outcome="short_live_reject")
+            await bot.reply_to(
+                message,
+                f"❌ Live location too short.\nPlease share for at least {MIN_LIVE_LOCATION_DURATION} seconds.",
+            )
+            return
+        if not is_within_office(
+            message.location.latitude, message.location.longitude, known_user.id
+        ):
+            ATTENDANCE_OUTCOMES.inc(kind="location", outcome="geofence_reject")
+            await bot.reply_to(
+                message, "❌ You are outside the office premises.\nAttendance rejected."
+            )
+            return
+
+        sample = LiveSample(
+            message.location.latitude,
+            message.location.longitude,
+            UTC_from_epoch(message.date),
+            True,
+        )
+        if live_tracker.start(known_user.id, message.message_id, live_period, sample):
+            await record_location(message, session, known_user)
+        else:
+            ATTENDANCE_OUTCOMES.inc(kind="location", outcome="awaiting_live_updates")
+            await bot.reply_to(
+                message,
+                "📡 Live location received.\nKeep sharing it until your attendance is confirmed.",
+            )
+
+
+# When user's live location moves; Telegram edits the live location message
+@bot.edited_message_handler(content_types=["location"])
+@track_handler
+async def handle_live_location_update(message):
+    async with Session() as session:
+        known_user = await run_query(session, User.get_by_chat_id, message.chat.id)
+        if not known_user:
+            return
+        if getattr(message.location, "live_period", None) is None:
+            # user stopped sharing
+            live_tracker.stop(known_user.id)
+            return
+
+        lat, lng = message.location.latitude, message.location.longitude
+        sample = LiveSample(
+            lat,
+            lng,
+            UTC_from_epoch(message.edit_date or message.date),
+            is_within_office(lat, lng, known_user.id),
+        )
+        if live_tracker.update(known_user.id, message.message_id, sample):
+            await record_location(message, session, known_user)
+
+
+async def record_location(message, session, known_user):
+    """
+    Add a confirmed live location to today's attendance
+    """
+    location = {
+        "longitude": message.location.longitude,
+        "latitude": message.location.latitude,
+    }
+    try:
+        await record_attendance(message, session, known_user, "location", location)
+    except Exception:
+        await session.rollback()
+        attendance_log.exception(
+            "Failed to save location", extra=fields(message, known_user)
+        )
+        await bot.reply_to(message, "Error saving attendance. Please try again.")
+
+
+def build_report_in_thread(user_id: int, year: int, month: int):
+    """
+    Build a monthly report on a worker thread with its own scoped session
+    :param user_id: user ID of the user the handler found
+    """
+    with session_scope():
+        return build_monthly_report(user_id, year, month)
+
+
+# Download monthly attendance report with month & year
+@bot.message_handler(commands=["download"])
+@bot.message_handler(func=lambda msg: msg.text.strip().lower() == "download")
+@track_handler
+async def download_report(message):
+    async with Session() as session:
+        known_user = await run_query(session, User.get_by_chat_id, message.chat.id)
+    if not known_user:
+        await bot.reply_to(message, "You are not yet logged in")
+        return
+    try:
+        lines = parse_lines(message)
+        if len(lines) == 1:
+            today = user_calendar(known_user.id).day_of(UTC_from_epoch(message.date))
+            month, year = today.month, today.year
+        else:
+            _, month, year = lines
+            month, year = int(month), int(year)
+        if not 1 <= month <= 12:
+            raise ValueError("Invalid month")
+    except ValueError:
+        await bot.reply_to(
+            message,
+            "Please use command /download to download your attendance; "
+            "example\n/download\nmonth\nyear",
+        )
+        return
+
+    path, records = await asyncio.to_thread(
+        build_report_in_thread, known_user.id, year, month
+    )
+    try:
+        if not records:
+            await bot.reply_to(message, f"No attendance found for {month:02d}-{year}")
+            return
+        with open(path, "rb") as report:
+            await bot.send_document(
+                message.chat.id,
+                report,
+                reply_to_message_id=message.message_id,
+                visible_file_name=f"attendance_{known_user.employee_id}_{year}-{month:02d}.xlsx",
+            )
+    finally:
+        os.remove(path)
+
+
+# When user send any message except the commands, picture or location (Fallback State)
+@bot.message_handler(func=lambda msg: True)
+@track_handler
+async def echo_all(message):
+    await bot.reply_to(
+        message,
+        "Sorry I can't help you in this; Please checkout /help or contact your administrator",
+    )
+
+
+if __name__ == "__main__":
+    bot_log.info("Telegram Attendance Bot (asyncio) is starting")
+    bot_log.warning(
+        "The asyncio runtime is limited: no office, import, bulk, enrollment or "
+        "selfie review commands, webhook, outbound scheduler, write-behind or "
+        "report jobs; run main.py for the complete bot"
+    )
+    if not is_schema_current():
+        bot_log.error("Database schema is not up to date; run `python manage.py init` first")
+        raise SystemExit(1)
+    if not acquire_instance_lock():
+        # live location sessions and pending pairs live in this process
+        bot_log.error("Another bot process is already serving this database; run only one")
+        raise SystemExit(1)
+    load_index()
+    with session_scope():
+        pending = pending_pairs.rebuild()
+    bot_log.info("Pending attendance pairs loaded", extra=fields(count=pending))
+    credential_service.start()
+    selfie_verifier.start()
+    selfie_fetcher.start()
+    if METRICS_PORT:
+        MetricsServer(METRICS_HOST, METRICS_PORT).start()
+        bot_log.info(
+            "Serving metrics",
+            extra=fields(url=f"http://{METRICS_HOST}:{METRICS_PORT}/metrics"),
+        )
+    try:
+        asyncio.run(bot.infinity_polling())
+    except Exception:
+        bot_log.exception("Telegram Attendance Bot stopped due to an error")
+    else:
+        bot_log.info("Telegram Attendance Bot stopped")
@@ -0,0 +1,156 @@
+"""
+Maintenance commands for the attendance database
+
+usage: python manage.py <command>
+"""
+
+import argparse
+import time
+
+from db_backend import session_scope
+from settings import MIGRATION_BATCH_SIZE, MIGRATION_PAUSE
+
+
+def init(args):
+    """
+    Create or update the database schema and bootstrap the Super HR
+    """
+    from migrations import init_db
+
+    with session_scope() as session:
+        init_db(session=session)
+    print("[INIT] database is ready")
+
+
+def migrate(args):
+    """
+    Apply pending schema migrations; safe to run while the bot is serving
+    and to run again after an interruption
+    """
+    from migrations import get_status, migrate
+
+    with session_scope() as session:
+        if args.status:
+            for migration, state in get_status(session=session):
+                if state is None:
+                    status = "pending"
+                elif state.applied_at is None:
+                    status = f"backfilling, at {state.position}"
+                else:
+                    status = f"applied {state.applied_at:%Y-%m-%d %H:%M}"
+                print(f"[MIGRATE] {migration.version} {migration.name}: {status}")
+            return
+
+        last_print = 0
+
+        def on_batch(migration, position):
+            nonlocal last_print
+            if time.monotonic() - last_print >= 1:
+                last_print = time.monotonic()
+                print(f"[MIGRATE] {migration.version} {migration.name}: at {position}")
+
+        applied = migrate(args.batch_size, args.pause, on_batch, session=session)
+    print(f"[MIGRATE] {len(applied)} migrations applied, the schema is up to date")
+
+
+def backfill_summary(args):
+    """
+    Rebuild daily_attendance_summary from the attendance table, e.g. after
+    an office got another timezone
+    """
+    from geofence import user_calendar
+    from models import DailyAttendanceSummary
+
+    with session_scope() as session:
+        position = batches = 0
+        while position is not None:
+            position = DailyAttendanceSummary.backfill(
+                position, args.batch_size, user_calendar, session=session
+            )
+            session.commit()
+            batches += 1
+            time.sleep(args.pause)
+    print(f"[BACKFILL] daily summaries rebuilt in {batches} batches")
+
+
+def fetch_selfies(args):
+    """
+    Download and verify selfies missing from the local selfie store
+    """
+    from selfie_store import DirectoryFileSource, SelfieFetcher, SelfieStore
+    from selfie_store import TelegramFileSource
+    from settings import (
+        BOT_TOKEN,
+        SELFIE_FETCH_WORKERS,
+        SELFIE_MATCH_MAX_DISTANCE,
+        SELFIE_STORE_DIR,
+        SELFIE_THUMBNAIL_QUALITY,
+        SELFIE_THUMBNAIL_SIZE,
+        SELFIE_THUMBNAIL_WORKERS,
+        SELFIE_VERIFY_WORKERS,
+    )
+    from verification import SelfieVerifier
+
+    if args.source_dir:
+        source = DirectoryFileSource(args.source_dir)
+    else:
+        import telebot
+
+        source = TelegramFileSource(telebot.TeleBot(BOT_TOKEN))
+    store = SelfieStore(
+        SELFIE_STORE_DIR, SELFIE_THUMBNAIL_SIZE, SELFIE_THUMBNAIL_QUALITY
+    )
+    verifier = SelfieVerifier(
+        store, SELFIE_VERIFY_WORKERS, max_distance=SELFIE_MATCH_MAX_DISTANCE
+    )
+    fetcher = SelfieFetcher(
+        store,
+        source,
+        SELFIE_FETCH_WORKERS,
+        SELFIE_THUMBNAIL_WORKERS,
+        on_stored=verifier.verify,
+    )
+    try:
+        downloaded, failed = fetcher.fetch_missing()
+    finally:
+        fetcher.stop()
+        verifier.stop()
+    print(f"[FETCH] {downloaded} selfies downloaded, {failed} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help=init.__doc__.strip()).set_defaults(func=init)
+    migrate_parser = commands.add_parser("migrate", help=migrate.__doc__.strip())
+    migrate_parser.add_argument(
+        "--status", action="store_true", help="list migrations and their state"
+    )
+    summary = commands.add_parser(
+        "backfill-summary", help=backfill_summary.__doc__.strip()
+    )
+    for command, function in ((migrate_parser, migrate), (summary, backfill_summary)):
+        command.add_argument(
+            "--batch-size",
+            type=int,
+            default=MIGRATION_BATCH_SIZE,
+            help="rows per transaction",
+        )
+        command.add_argument(
+            "--pause",
+            type=float,
+            default=MIGRATION_PAUSE,
+            help="seconds between transactions, for the bot to write",
+        )
+        command.set_defaults(func=function)
+    fetch = commands.add_parser("fetch-selfies", help=fetch_selfies.__doc__.strip())
+    fetch.add_argument(
+        "--source-dir", help="read files named by file_id here instead of Telegram"
+    )
+    fetch.set_defaults(func=fetch_selfies)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import inspect
+import threading
+import time
+
+from sqlalchemy import event
+
+from log import current_handler
+
+# seconds; covers a cached lookup up to a slow Telegram round trip
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}  # {label values: value}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}")
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _label_text(self, key: tuple, extra: str = ""):
+        pairs = [
+            f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key: tuple, value):
+        return [f"{self.name}{self._label_text(key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, e.g. of outcomes or errors
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down; with `function` it is read at scrape time
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, labels: tuple = (), function=None
+    ):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values (seconds) in cumulative buckets
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one slot per bucket plus +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def _samples(self, key: tuple, counts: list):
+        lines, total = [], 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            total += count
+            bucket = self._label_text(key, f'le="{_number(bound)}"')
+            lines.append(f"{self.name}_bucket{bucket} {total}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {_number(counts[-1])}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {total}")
+        return lines
+
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = []
+
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in list(REGISTRY):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Bot handlers
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Time spent in a bot handler", ("handler",)
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Exceptions escaping a bot handler", ("handler",)
+)
+ATTENDANCE_OUTCOMES = Counter(
+    "attendance_outcomes_total",
+    "Attendance messages by kind (selfie/location) and branch taken",
+    ("kind", "outcome"),
+)
+
+# Database
+DB_QUERIES = Counter(
+    "db_queries_total", "SQL statements executed", ("engine", "statement")
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "Time spent executing SQL statements", ("engine", "statement")
+)
+DB_ERRORS = Counter("db_errors_total", "SQL statements that raised", ("engine",))
+
+# Telegram Bot API
+TELEGRAM_SECONDS = Histogram(
+    "telegram_request_seconds", "Latency of Telegram Bot API calls", ("method",)
+)
+TELEGRAM_ERRORS = Counter(
+    "telegram_errors_total", "Failed Telegram Bot API calls", ("method", "code")
+)
+
+
+def track_handler(function):
+    """
+    Decorator recording latency and escaping exceptions of a bot handler,
+    sync or async, labelled with its function name; log records emitted
+    meanwhile carry the handler name and elapsed time
+    """
+    name = function.__name__
+
+    if inspect.iscoroutinefunction(function):
+
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            token = current_handler.set((name, start))
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name)
+                current_handler.reset(token)
+
+    else:
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            token = current_handler.set((name, start))
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name)
+                current_handler.reset(token)
+
+    return wrapper
+
+
+def instrument_engine(engine, name: str = "sync"):
+    """
+    Count and time every statement of a (sync) SQLAlchemy engine
+    :param engine: engine to listen on; pass `sync_engine` of an async engine
+    :param name: value of the engine label
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        DB_QUERIES.inc(engine=name, statement=verb)
+        DB_QUERY_SECONDS.observe(elapsed, engine=name, statement=verb)
+
+    @event.listens_for(engine, "handle_error")
+    def count_error(context):
+        DB_ERRORS.inc(engine=name)
+        starts = (
+            context.connection.info.get("query_start") if context.connection else None
+        )
+        if starts:
+            starts.pop()
+
+
+class MetricsServer:
+    """
+    Serves `render()` on GET /metrics for Prometheus to scrape
+    """
+
+    def __init__(self, host: str, port: int):
+        """
+        :param host: interface to listen on; keep it local
+        :param port: port to listen on
+        """
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(
+            target=self.httpd.serve_forever, name="metrics", daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
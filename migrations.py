@@ -0,0 +1,282 @@
+from datetime import datetime
+import time
+
+from sqlalchemy import inspect, text
+
+from credentials import hash_password
+from db_backend import db_session, engine
+from geofence import load_index, user_calendar
+from log import get_logger
+from models import (
+    Base,
+    DailyAttendanceSummary,
+    Office,
+    SchemaMigration,
+    Selfie,
+    User,
+)
+from settings import (
+    MIGRATION_BATCH_SIZE,
+    MIGRATION_PAUSE,
+    OFFICE_LAT,
+    OFFICE_LNG,
+    OFFICE_RADIUS_METERS,
+    SUPER_HR,
+)
+
+log = get_logger("migrations")
+
+
+class Migration:
+    """
+    One versioned change of the database. `schema` (DDL, safe to run again)
+    runs first, then `backfill` is called batch after batch, each batch in
+    its own short transaction, so the bot keeps serving in between
+    """
+
+    def __init__(self, version: int, name: str, schema=None, backfill=None):
+        """
+        :param version: position in MIGRATIONS, never reused
+        :param name: what the migration does
+        :param schema: function(engine) changing the schema
+        :param backfill: function(position, batch_size, session) migrating the
+            batch after `position` (0 at first) and returning where it
+            ended, or None when nothing is left; the runner commits it
+            together with the new position
+        """
+        self.version = version
+        self.name = name
+        self.schema = schema
+        self.backfill = backfill
+
+
+def _create_tables(bind):
+    # new tables come with their indexes; existing ones are left alone
+    Base.metadata.create_all(bind)
+
+
+def _add_columns(*names):
+    """
+    Schema step adding nullable "table.column" columns of the models which
+    an existing database lacks; ADD COLUMN only rewrites the schema, not rows
+    """
+
+    def schema(bind):
+        inspector = inspect(bind)
+        for name in names:
+            table_name, column_name = name.split(".")
+            column = Base.metadata.tables[table_name].c[column_name]
+            existing = {info["name"] for info in inspector.get_columns(table_name)}
+            if column.name not in existing:
+                column_type = column.type.compile(bind.dialect)
+                with bind.begin() as connection:
+                    connection.execute(
+                        text(
+                            f'ALTER TABLE "{table_name}" '
+                            f'ADD COLUMN "{column.name}" {column_type}'
+                        )
+                    )
+
+    return schema
+
+
+def _create_indexes(*names):
+    """
+    Schema step building indexes of the models which an existing database
+    lacks, one transaction each. sqlite can't build an index online: writers
+    wait for it up to DB_BUSY_TIMEOUT while the write-behind queue keeps
+    collecting check-ins, so keep these to one index per migration on big
+    tables
+    """
+
+    def schema(bind):
+        indexes = {
+            index.name: index
+            for table in Base.metadata.sorted_tables
+            for index in table.indexes
+        }
+        for name in names:
+            indexes[name].create(bind, checkfirst=True)
+
+    return schema
+
+
+def _migrate_selfies(position: int, batch_size: int, session):
+    return Selfie.migrate_from_json(position, batch_size, session=session)
+
+
+def _backfill_summary(position: int, batch_size: int, session):
+    return DailyAttendanceSummary.backfill(position, batch_size, session=session)
+
+
+def _backfill_office_summary(position: int, batch_size: int, session):
+    # only the batches holding users of an office timezone; migration 7
+    # counted everyone's days in TIMEZONE, offices had no timezone yet
+    following = [
+        user_id for user_id in load_index().zoned_users() if user_id > position
+    ]
+    if not following:
+        return None
+    return DailyAttendanceSummary.backfill(
+        following[0] - 1, batch_size, user_calendar, session=session
+    )
+
+
+# Every change of the schema goes here with the next version; the first
+# ones bring a database of any earlier release up to date
+MIGRATIONS = [
+    Migration(1, "create missing tables", schema=_create_tables),
+    Migration(
+        2,
+        "add selfie store and verification columns",
+        schema=_add_columns(
+            "selfie.sha256",
+            "user_account.reference_sha256",
+            "attendance.verification",
+            "attendance.verification_distance",
+            "attendance.verified_at",
+        ),
+    ),
+    Migration(
+        3,
+        "index attendance by user and selfie time",
+        schema=_create_indexes("ix_attendance_user_selfie_time"),
+    ),
+    Migration(
+        4,
+        "index attendance by user and location time",
+        schema=_create_indexes("ix_attendance_user_location_time"),
+    ),
+    Migration(
+        5,
+        "index users by chat and selfies by content",
+        schema=_create_indexes(
+            "ix_user_account_last_chat_id",
+            "ix_selfie_attendance_id",
+            "ix_selfie_sha256",
+        ),
+    ),
+    Migration(6, "move selfies out of attendance JSON", backfill=_migrate_selfies),
+    Migration(7, "build daily attendance summaries", backfill=_backfill_summary),
+    Migration(8, "add office timezones", schema=_add_columns("office.timezone")),
+    Migration(
+        9,
+        "count daily summaries in office timezones",
+        backfill=_backfill_office_summary,
+    ),
+]
+
+
+def get_status(session=None):
+    """
+    Get every migration with its recorded state
+    :param session: session to be used instead of the thread's session
+    :return: (migration, SchemaMigration row or None) in version order
+    """
+    session = db_session if session is None else session
+    if not inspect(engine).has_table(SchemaMigration.__tablename__):
+        return [(migration, None) for migration in MIGRATIONS]
+    rows = {row.version: row for row in session.query(SchemaMigration)}
+    return [(migration, rows.get(migration.version)) for migration in MIGRATIONS]
+
+
+def is_schema_current(session=None):
+    """
+    Whether the schema change of every migration is applied; backfills may
+    still be running, the bot serves alongside them
+    :param session: session to be used instead of the thread's session
+    """
+    return all(row is not None for _, row in get_status(session))
+
+
+def migrate(
+    batch_size: int = MIGRATION_BATCH_SIZE,
+    pause: float = MIGRATION_PAUSE,
+    on_batch=None,
+    session=None,
+):
+    """
+    Apply the pending migrations in order, resuming an interrupted backfill
+    at its last committed batch. Run while the bot is serving: every batch
+    is a short transaction followed by `pause` seconds without the lock
+    :param batch_size: rows per backfill transaction
+    :param pause: seconds between backfill transactions
+    :param on_batch: function(migration, position) called after each batch
+    :param session: session to be used instead of the thread's session
+    :return: versions completed by this run
+    """
+    session = db_session if session is None else session
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+    completed = []
+    for migration, state in get_status(session):
+        if state is not None and state.applied_at is not None:
+            continue
+        if state is None:
+            session.commit()  # DDL runs on its own connections
+            start = time.perf_counter()
+            if migration.schema is not None:
+                migration.schema(engine)
+            log.info(
+                "Schema migrated",
+                extra={
+                    "version": migration.version,
+                    "migration": migration.name,
+                    "ms": round((time.perf_counter() - start) * 1000, 3),
+                },
+            )
+            state = SchemaMigration(
+                version=migration.version,
+                name=migration.name,
+                position=0,
+                started_at=datetime.utcnow(),
+            )
+            session.add(state)
+            session.commit()
+
+        if migration.backfill is not None:
+            while True:
+                position = migration.backfill(state.position, batch_size, session)
+                if position is None:
+                    break
+                state.position = position
+                session.commit()
+                if on_batch is not None:
+                    on_batch(migration, position)
+                time.sleep(pause)
+        state.applied_at = datetime.utcnow()
+        session.commit()
+        completed.append(migration.version)
+        log.info(
+            "Migration applied",
+            extra={"version": migration.version, "migration": migration.name},
+        )
+    return completed
+
+
+def init_db(session=None):
+    """
+    Bring the schema up to date and bootstrap the Super HR and the default
+    office; run once per deployment and after upgrades (`manage.py init`),
+    never at import time
+    :param session: session to be used instead of the thread's session
+    """
+    session = db_session if session is None else session
+    migrate(pause=0, session=session)
+
+    # Create Super HR if not exists
+    if not User.get_by_emp_id(SUPER_HR["employee_id"], session=session):
+        super_hr = User(**dict(SUPER_HR, temp_pwd=hash_password(SUPER_HR["temp_pwd"])))
+        session.add(super_hr)
+        session.commit()
+
+    # Create the default office from settings if there is none
+    if not session.query(Office).first():
+        session.add(
+            Office(
+                name="Head Office",
+                latitude=OFFICE_LAT,
+                longitude=OFFICE_LNG,
+                radius_meters=OFFICE_RADIUS_METERS,
+            )
+        )
+        session.commit()
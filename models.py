@@ -1,20 +1,46 @@
-from datetime import datetime
+from collections import defaultdict
+from datetime import date, datetime
 from sqlalchemy import (
     Boolean,
     Column,
+    Date,
     ForeignKey,
+    Index,
     Integer,
     JSON,
     String,
     DateTime,
+    UniqueConstraint,
+    Float,
+    and_,
     func,
+    insert,
+    null,
     or_,
+    select,
+    text,
 )
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import DeclarativeBase, make_transient_to_detached, relationship
+from sqlalchemy.orm.util import identity_key
 
-from db_backend import db_session, engine
-from helpers import get_hashed
-from settings import SUPER_HR
+from cache import IdentityCache
+from credentials import credential_service, needs_rehash
+from db_backend import db_session
+from settings import IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL
+from timezones import get_calendar
+
+EMP_ID_LOOKUP_CHUNK_SIZE = 500  # employee IDs per IN (...), below sqlite's limit
+
+# chat ID / employee ID -> detached User snapshot
+user_cache = IdentityCache(IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)
+
+
+def _session(session):
+    """
+    Session passed by the caller (e.g. from `AsyncSession.run_sync`) or the
+    thread's scoped session
+    """
+    return db_session if session is None else session
 
 
 class Base(DeclarativeBase):
@@ -28,62 +54,242 @@ class User(Base):
     employee_id = Column(String(30), unique=True)
     fullname = Column(String(30))
     role = Column(String(10))
-    temp_pwd = Column(String(10))
-    last_chat_id = Column(String(10))
+    temp_pwd = Column(String(255))  # scrypt$n$r$p$salt$key or legacy SHA512
+    last_chat_id = Column(String(10), index=True)
     is_active = Column(Boolean, default=True)
     is_pwd_expired = Column(Boolean, default=False)
     is_logged_in = Column(Boolean, default=False)
+    # enrolled photo in the local selfie store, selfies are compared with it
+    reference_sha256 = Column(String(64))
 
     @classmethod
-    def get_by_user_id(cls, user_id: str, only_active: bool = True):
+    def get_by_user_id(cls, user_id: str, only_active: bool = True, session=None):
         """
         Get user record by their ID
         :param user_id: user ID of user
         :param only_active: whether to fetch only active user or not
+        :param session: session to be used instead of the thread's session
         """
-        query = db_session.query(cls).filter(cls.id == user_id)
+        query = _session(session).query(cls).filter(cls.id == user_id)
         if only_active:
             query = query.filter(cls.is_active.isnot(False))
         return query.first()
 
     @classmethod
-    def get_by_emp_id(cls, employee_id: str, only_active: bool = True):
+    def get_by_emp_id(cls, employee_id: str, only_active: bool = True, session=None):
         """
         Get user record by their employee ID
         :param employee_id: employee ID of user
         :param only_active: whether to fetch only active user or not
+        :param session: session to be used instead of the thread's session
         """
-        query = db_session.query(cls).filter(cls.employee_id == employee_id)
+        key = ("emp", str(employee_id), only_active)
+        cached = cls._from_cache(key, session)
+        if cached is not None:
+            return cached
+        generation = user_cache.generation()
+        query = _session(session).query(cls).filter(cls.employee_id == employee_id)
         if only_active:
             query = query.filter(cls.is_active.isnot(False))
-        return query.first()
+        return cls._to_cache(key, query.first(), generation)
 
     @classmethod
-    def get_by_chat_id(cls, chat_id: str, only_active: bool = True):
+    def get_by_chat_id(cls, chat_id: str, only_active: bool = True, session=None):
         """
         Get user record by their chat ID
         :param chat_id: chat ID of user
         :param only_active: whether to fetch only active user or not
+        :param session: session to be used instead of the thread's session
         """
-        query = db_session.query(cls).filter(cls.last_chat_id == chat_id)
+        key = ("chat", str(chat_id), only_active)
+        cached = cls._from_cache(key, session)
+        if cached is not None:
+            return cached
+        generation = user_cache.generation()
+        query = _session(session).query(cls).filter(cls.last_chat_id == str(chat_id))
         if only_active:
             query = query.filter(cls.is_active.isnot(False))
+        return cls._to_cache(key, query.first(), generation)
+
+    @classmethod
+    def invalidate_cache(cls, user=None, chat_id=None):
+        """
+        Drop cached identities; must be called whenever a user record changes
+        :param user: user whose cached entries should be dropped
+        :param chat_id: chat ID whose cached entries should be dropped
+        """
+        owners = [user.id] if user is not None else []
+        keys = []
+        if chat_id is not None:
+            keys = [("chat", str(chat_id), True), ("chat", str(chat_id), False)]
+        user_cache.invalidate(owners=owners, keys=keys)
+
+    @classmethod
+    def _from_cache(cls, key, session=None):
+        """
+        Attach the cached snapshot of key to the current session without a query
+        """
+        snapshot = user_cache.get(key)
+        if snapshot is None:
+            return None
+        session = _session(session)
+        loaded = session.identity_map.get(identity_key(cls, snapshot.id))
+        if loaded is not None:
+            return loaded
+        return session.merge(snapshot, load=False)
+
+    @classmethod
+    def _to_cache(cls, key, user, generation=None):
+        """
+        Store a detached copy of user, so it never shares state with a session;
+        skipped when the user was invalidated after `generation` was taken
+        """
+        if user is not None:
+            snapshot = cls(
+                **{
+                    attr.key: getattr(user, attr.key)
+                    for attr in cls.__mapper__.column_attrs
+                }
+            )
+            make_transient_to_detached(snapshot)
+            user_cache.put(key, snapshot, owner=user.id, generation=generation)
+        return user
+
+    @classmethod
+    def get_existing_emp_ids(cls, employee_ids: list, session=None):
+        """
+        Get which of these employee IDs are taken, active or not
+        :param employee_ids: employee IDs to look for
+        :param session: session to be used instead of the thread's session
+        """
+        session = _session(session)
+        existing = set()
+        for start in range(0, len(employee_ids), EMP_ID_LOOKUP_CHUNK_SIZE):
+            chunk = employee_ids[start : start + EMP_ID_LOOKUP_CHUNK_SIZE]
+            existing.update(
+                employee_id
+                for (employee_id,) in session.query(cls.employee_id).filter(
+                    cls.employee_id.in_(chunk)
+                )
+            )
+        return existing
+
+    @classmethod
+    def bulk_update(
+        cls, employee_ids: list, values: dict, only_active: bool = False, session=None
+    ):
+        """
+        Apply the same values to many users with one UPDATE ... WHERE
+        employee_id IN (...) per chunk; the caller commits and then drops
+        the changed users from the cache with `invalidate_users`
+        :param employee_ids: employee IDs of users
+        :param values: {column: value} to be set
+        :param only_active: leave deactivated users alone, as if missing
+        :param session: session to be used instead of the thread's session
+        :return: matched and changed employee IDs, missing ones and the user
+            IDs of changed users
+        """
+        session = _session(session)
+        employee_ids = list(dict.fromkeys(employee_ids))
+        differs = or_(
+            *(
+                getattr(cls, column).is_distinct_from(value)
+                for column, value in values.items()
+            )
+        )
+        matched, changed, user_ids = set(), [], []
+        for start in range(0, len(employee_ids), EMP_ID_LOOKUP_CHUNK_SIZE):
+            chunk = employee_ids[start : start + EMP_ID_LOOKUP_CHUNK_SIZE]
+            criteria = [cls.employee_id.in_(chunk)]
+            if only_active:
+                criteria.append(cls.is_active.isnot(False))
+            rows = session.query(cls.id, cls.employee_id, differs.label("differs"))
+            for user_id, employee_id, differs_now in rows.filter(*criteria):
+                matched.add(employee_id)
+                if differs_now:
+                    changed.append(employee_id)
+                    user_ids.append(user_id)
+            session.query(cls).filter(*criteria, differs).update(
+                {getattr(cls, column): value for column, value in values.items()},
+                synchronize_session=False,
+            )
+        missing = [
+            employee_id for employee_id in employee_ids if employee_id not in matched
+        ]
+        return sorted(matched), changed, missing, user_ids
+
+    @classmethod
+    def invalidate_users(cls, user_ids: list):
+        """
+        Drop the cached identities of many users in one pass
+        :param user_ids: user IDs whose cached entries should be dropped
+        """
+        user_cache.invalidate(owners=user_ids)
+
+    @classmethod
+    def bulk_create(cls, users: list, session=None):
+        """
+        Insert many users with one executemany; the caller commits
+        :param users: dicts with employee_id, fullname, role & hashed temp_pwd
+        :param session: session to be used instead of the thread's session
+        """
+        _session(session).execute(
+            insert(cls),
+            [
+                dict(is_active=True, is_pwd_expired=False, is_logged_in=False, **user)
+                for user in users
+            ],
+        )
+
+    @classmethod
+    def get_for_login(cls, employee_id: str, session=None):
+        """
+        Get the user allowed to login with this employee ID, whatever the OTP
+        :param employee_id: employee ID of user
+        :param session: session to be used instead of the thread's session
+        """
+        query = (
+            _session(session)
+            .query(cls)
+            .filter(
+                cls.employee_id == employee_id,
+                cls.is_active.isnot(False),
+                cls.is_pwd_expired.isnot(True),
+            )
+        )
         return query.first()
 
     @classmethod
-    def is_valid_credential(cls, employee_id: str, temp_pwd: str):
+    def is_valid_credential(cls, employee_id: str, temp_pwd: str, session=None):
         """
-        Get user with their correct credential
+        Get user with their correct credential. The OTP is verified in the
+        credential service's process pool; a legacy hash is upgraded on the
+        user, so commit the session to keep it
         :param employee_id: employee ID of user
         :param temp_pwd: OTP provided to user
+        :param session: session to be used instead of the thread's session
         """
-        query = db_session.query(cls).filter(
-            cls.employee_id == employee_id,
-            cls.temp_pwd == get_hashed(temp_pwd),
-            cls.is_active.isnot(False),
-            cls.is_pwd_expired.isnot(True),
+        user = cls.get_for_login(employee_id, session=session)
+        if not credential_service.verify(temp_pwd, user.temp_pwd if user else None):
+            return None
+        if needs_rehash(user.temp_pwd):
+            user.temp_pwd = credential_service.hash(temp_pwd)
+        return user
+
+
+class StalePendingPair(Exception):
+    """
+    The record a selfie/location was paired with is no longer the user's
+    pending one, e.g. another process paired or replaced it first
+    """
+
+    def __init__(self, user_id: int, expected: int, actual: int):
+        super().__init__(
+            f"pending attendance of user {user_id} is {actual}, not {expected}"
         )
-        return query.first()
+        self.user_id = user_id
+        self.expected = expected
+        self.actual = actual
 
 
 class Attendance(Base):
@@ -91,58 +297,689 @@ class Attendance(Base):
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("user_account.id"))
-    selfie = Column(JSON, unique=True)
+    # photo sizes as JSON; superseded by the selfie table, see migrations.py
+    legacy_selfie = Column("selfie", JSON)
+    selfie = relationship("Selfie", uselist=False, back_populates="attendance")
     selfie_time = Column(DateTime(timezone=True))
     location = Column(JSON)
     location_time = Column(DateTime(timezone=True))
+    # selfie compared with the enrolled reference photo as a whole scene,
+    # advisory only; see verification.py
+    verification = Column(String(16))
+    verification_distance = Column(Integer)
+    verified_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_attendance_user_selfie_time", "user_id", "selfie_time"),
+        Index("ix_attendance_user_location_time", "user_id", "location_time"),
+    )
 
     @classmethod
-    def get_last_attendance_record(cls, user_id: int, timestamp: datetime):
+    def get_last_attendance_record(
+        cls, user_id: int, timestamp: datetime, calendar=None, session=None
+    ):
         """
-        Get the last attendance record of a date
+        Get the last attendance record of the local day of a timestamp
         :param user_id: user ID of user
         :param timestamp: UTC timestamp
+        :param calendar: DayCalendar of the user's timezone, TIMEZONE's if None
+        :param session: session to be used instead of the thread's session
         """
-        # For sqlite
         return (
-            db_session.query(cls)
+            cls._of_day(_session(session).query(cls), user_id, timestamp, calendar)
+            .order_by(cls.id.desc())
+            .first()
+        )
+
+    @classmethod
+    def _of_day(cls, query, user_id: int, timestamp: datetime, calendar=None):
+        # Half-open [day_start, day_end) UTC range of the local day on the raw
+        # columns so that sqlite can answer each branch from the
+        # (user_id, *_time) indexes
+        calendar = calendar or get_calendar()
+        day_start, day_end = calendar.day_bounds_of(timestamp)
+        return query.filter(
+            cls.user_id == user_id,
+            or_(
+                and_(cls.selfie_time >= day_start, cls.selfie_time < day_end),
+                and_(cls.location_time >= day_start, cls.location_time < day_end),
+            ),
+        )
+
+    @classmethod
+    def get_newest_records(cls, since: datetime, session=None):
+        """
+        Get the newest record of every user with a half sent since a time
+        :param since: UTC timestamp
+        :param session: session to be used instead of the thread's session
+        :return: rows with id, user_id, selfie_time & location_time
+        """
+        session = _session(session)
+
+        def newest(column):
+            # a seek into the user's (user_id, *_time) index
+            return (
+                session.query(func.max(cls.id))
+                .filter(cls.user_id == User.id, column >= since)
+                .scalar_subquery()
+            )
+
+        newest_ids = session.query(
+            newest(cls.selfie_time), newest(cls.location_time)
+        ).select_from(User)
+        ids = sorted(
+            max(selfie_id or 0, location_id or 0)
+            for selfie_id, location_id in newest_ids
+            if selfie_id or location_id
+        )
+        records = []
+        for start in range(0, len(ids), EMP_ID_LOOKUP_CHUNK_SIZE):
+            chunk = ids[start : start + EMP_ID_LOOKUP_CHUNK_SIZE]
+            records += session.query(
+                cls.id, cls.user_id, cls.selfie_time, cls.location_time
+            ).filter(cls.id.in_(chunk))
+        return records
+
+    @classmethod
+    def start_pair(
+        cls,
+        user_id: int,
+        kind: str,
+        value,
+        timestamp: datetime,
+        pending_id: int = None,
+        calendar=None,
+        session=None,
+    ):
+        """
+        Add a record holding one half of a selfie/location pair, provided the
+        day's pending record is still the one the caller decided on
+        :param user_id: user ID of user
+        :param kind: "selfie" or "location"
+        :param value: Selfie or location dict
+        :param timestamp: UTC time it was sent
+        :param pending_id: ID of the day's record missing a half, None if none
+        :param calendar: DayCalendar of the user's timezone, TIMEZONE's if None
+        :param session: session to be used instead of the thread's session
+        :return: ID of the new record
+        :raises StalePendingPair: when the day's pending record is another one
+        """
+        session = _session(session)
+        attendance = cls(user_id=user_id, **{f"{kind}_time": timestamp})
+        if kind == "location":
+            attendance.location = value
+        session.add(attendance)
+        # the insert takes sqlite's write lock; every other writer's record
+        # of the day is visible to the check below
+        session.flush()
+        previous = (
+            cls._of_day(
+                session.query(cls.id, cls.selfie_time, cls.location_time),
+                user_id,
+                timestamp,
+                calendar,
+            )
+            .filter(cls.id < attendance.id)
+            .order_by(cls.id.desc())
+            .first()
+        )
+        if previous is not None and (previous.selfie_time is None) != (
+            previous.location_time is None
+        ):
+            pending = previous.id
+        else:
+            pending = None
+        if pending != pending_id:
+            raise StalePendingPair(user_id, pending_id, pending)
+        if kind == "selfie":
+            value.attendance_id = attendance.id
+            session.add(value)
+        return attendance.id
+
+    @classmethod
+    def complete_pair(
+        cls,
+        attendance_id: int,
+        user_id: int,
+        kind: str,
+        value,
+        timestamp: datetime,
+        other_time: datetime,
+        calendar=None,
+        session=None,
+    ):
+        """
+        Add the missing half to a record without loading it and count the
+        pair in the day's summary, in the same transaction; the update only
+        applies while the record is the user's newest and still misses it
+        :param attendance_id: ID of the record
+        :param user_id: user ID of user
+        :param kind: "selfie" or "location"
+        :param value: Selfie or location dict
+        :param timestamp: UTC time it was sent
+        :param other_time: UTC time of the half already in the record
+        :param calendar: DayCalendar of the user's timezone, TIMEZONE's if None
+        :param session: session to be used instead of the thread's session
+        :raises StalePendingPair: when the record is complete or superseded
+        """
+        session = _session(session)
+        other = "location" if kind == "selfie" else "selfie"
+        if kind == "selfie":
+            values = {cls.selfie_time: timestamp}
+            selfie_time, location_time = timestamp, other_time
+        else:
+            values = {cls.location: value, cls.location_time: timestamp}
+            selfie_time, location_time = other_time, timestamp
+        updated = (
+            session.query(cls)
             .filter(
+                cls.id == attendance_id,
                 cls.user_id == user_id,
-                or_(
-                    func.DATE(cls.selfie_time) == str(timestamp.date()),
-                    func.DATE(cls.selfie_time) == str(timestamp.date()),
-                ),
+                getattr(cls, f"{kind}_time").is_(None),
+                getattr(cls, f"{other}_time").isnot(None),
             )
-            .order_by(cls.id.desc())
+            .update(values, synchronize_session=False)
+        )
+        newer = (
+            cls._of_day(session.query(cls.id), user_id, other_time, calendar)
+            .filter(cls.id > attendance_id)
             .first()
         )
+        if not updated or newer is not None:
+            raise StalePendingPair(user_id, attendance_id, None)
+        if kind == "selfie":
+            value.attendance_id = attendance_id
+            session.add(value)
+        DailyAttendanceSummary.record_pair(
+            user_id, selfie_time, location_time, calendar=calendar, session=session
+        )
 
     @classmethod
     def get_attendance_records(
-        cls, start_time: datetime, end_time: datetime, user_id: str = None
+        cls,
+        start_time: datetime,
+        end_time: datetime,
+        user_id: str = None,
+        session=None,
     ):
         """
-        :param start_time:
-        :param end_time:
-        :param user_id:
+        Get completed attendance records within [start_time, end_time)
+        :param start_time: UTC timestamp (inclusive)
+        :param end_time: UTC timestamp (exclusive)
+        :param user_id: user ID of user
+        :param session: session to be used instead of the thread's session
         """
-        attendance_records = db_session.query(cls).filter(
-            func.DATETIME(cls.selfie_time) >= str(start_time),
-            func.DATETIME(cls.selfie_time) < str(end_time),
-            func.DATETIME(cls.location_time) >= str(start_time),
-            func.DATETIME(cls.location_time) < str(end_time),
+        attendance_records = (
+            _session(session)
+            .query(cls)
+            .filter(*cls._records_criteria(start_time, end_time, user_id))
         )
-        if user_id:
-            attendance_records = attendance_records.filter(cls.user_id == user_id)
         return attendance_records.order_by(cls.user_id, cls.id).all()
 
+    @classmethod
+    def record_verification(
+        cls,
+        attendance_id: int,
+        outcome: str,
+        distance: int,
+        verified_at: datetime,
+        session=None,
+    ):
+        """
+        Store the outcome of the selfie verification of a record
+        :param attendance_id: ID of the attendance record
+        :param outcome: match, mismatch, no_reference or error
+        :param distance: differing hash bits, None without a comparison
+        :param verified_at: UTC timestamp
+        :param session: session to be used instead of the thread's session
+        """
+        _session(session).query(cls).filter(cls.id == attendance_id).update(
+            {
+                cls.verification: outcome,
+                cls.verification_distance: distance,
+                cls.verified_at: verified_at,
+            },
+            synchronize_session=False,
+        )
+
+    @classmethod
+    def stream_attendance_records(
+        cls,
+        start_time: datetime,
+        end_time: datetime,
+        user_id: str = None,
+        batch_size: int = 500,
+        session=None,
+    ):
+        """
+        Same records as `get_attendance_records` as plain rows, fetched lazily
+        in batches, so memory doesn't grow with the number of records
+        :param start_time: UTC timestamp (inclusive)
+        :param end_time: UTC timestamp (exclusive)
+        :param user_id: user ID of user
+        :param batch_size: rows fetched from the cursor at once
+        :param session: session to be used instead of the thread's session
+        """
+        query = (
+            select(
+                cls.id,
+                cls.user_id,
+                cls.selfie_time,
+                cls.location,
+                cls.location_time,
+                cls.verification,
+            )
+            .where(*cls._records_criteria(start_time, end_time, user_id))
+            .order_by(cls.user_id, cls.id)
+            .execution_options(yield_per=batch_size)
+        )
+        yield from _session(session).execute(query)
+
+    @classmethod
+    def get_data_version(
+        cls, start_time: datetime, end_time: datetime, user_id: str = None, session=None
+    ):
+        """
+        Fingerprint of the records `stream_attendance_records` returns; it
+        changes whenever one of them is added, completed or verified
+        :param start_time: UTC timestamp (inclusive)
+        :param end_time: UTC timestamp (exclusive)
+        :param user_id: user ID of user
+        :param session: session to be used instead of the thread's session
+        """
+        row = (
+            _session(session)
+            .query(
+                func.count(cls.id),
+                func.max(cls.id),
+                func.count(cls.verification),
+                func.max(cls.verified_at),
+            )
+            .filter(*cls._records_criteria(start_time, end_time, user_id))
+            .one()
+        )
+        return "-".join(str(value) for value in row)
+
+    @classmethod
+    def _records_criteria(cls, start_time: datetime, end_time: datetime, user_id):
+        criteria = [
+            cls.selfie_time >= start_time,
+            cls.selfie_time < end_time,
+            cls.location_time >= start_time,
+            cls.location_time < end_time,
+        ]
+        if user_id:
+            criteria.append(cls.user_id == user_id)
+        return criteria
+
+
+class Selfie(Base):
+    """
+    Selfie of an attendance record, keyed by the file_unique_id of its
+    largest size; Telegram keeps that ID for the same photo whoever sends
+    it, so a reused photo is a primary key hit
+    """
+
+    __tablename__ = "selfie"
+
+    file_unique_id = Column(String(64), primary_key=True)
+    attendance_id = Column(Integer, ForeignKey("attendance.id"), index=True)
+    user_id = Column(Integer, ForeignKey("user_account.id"))
+    file_id = Column(String(255), nullable=False)  # largest size
+    width = Column(Integer)
+    height = Column(Integer)
+    file_size = Column(Integer)
+    thumb_file_id = Column(String(255))  # smallest size, for previews
+    # content address in the local selfie store, set once downloaded
+    sha256 = Column(String(64), index=True)
+
+    attendance = relationship("Attendance", back_populates="selfie")
+
+    @classmethod
+    def from_photos(cls, photos: list, user_id: int):
+        """
+        Build a selfie from the photo sizes of a message, keeping only the
+        largest and the smallest one
+        :param photos: dicts with file_id, file_unique_id, width, height & file_size
+        :param user_id: user ID of user
+        """
+        largest = max(photos, key=lambda photo: photo["width"] * photo["height"])
+        smallest = min(photos, key=lambda photo: photo["width"] * photo["height"])
+        return cls(
+            file_unique_id=largest["file_unique_id"],
+            user_id=user_id,
+            file_id=largest["file_id"],
+            width=largest["width"],
+            height=largest["height"],
+            file_size=largest.get("file_size"),
+            thumb_file_id=smallest["file_id"],
+        )
+
+    @classmethod
+    def is_duplicate(cls, file_unique_id: str, session=None):
+        """
+        Whether this photo was already used for any attendance
+        :param file_unique_id: file_unique_id of the largest photo size
+        :param session: session to be used instead of the thread's session
+        """
+        query = _session(session).query(cls.file_unique_id)
+        return query.filter(cls.file_unique_id == file_unique_id).first() is not None
+
+    @classmethod
+    def set_sha256(cls, file_unique_id: str, sha256: str, session=None):
+        """
+        Record where the downloaded photo is in the local selfie store
+        :param file_unique_id: file_unique_id of the selfie
+        :param sha256: hex digest of the photo
+        :param session: session to be used instead of the thread's session
+        """
+        _session(session).query(cls).filter(
+            cls.file_unique_id == file_unique_id
+        ).update({cls.sha256: sha256}, synchronize_session=False)
+
+    @classmethod
+    def get_not_downloaded(cls, limit: int = 1000, session=None):
+        """
+        Get (file_unique_id, file_id) of selfies missing from the local store
+        :param limit: maximum number of selfies
+        :param session: session to be used instead of the thread's session
+        """
+        return (
+            _session(session)
+            .query(cls.file_unique_id, cls.file_id)
+            .filter(cls.sha256.is_(None))
+            .limit(limit)
+            .all()
+        )
+
+    @classmethod
+    def get_for_day(cls, day: date, calendar=None, session=None):
+        """
+        Get the selfies of a local day with the employee and time of each
+        :param day: local date
+        :param calendar: DayCalendar of the timezone, TIMEZONE's if None
+        :param session: session to be used instead of the thread's session
+        :return: (selfie, employee ID, full name, UTC selfie time) ordered by time
+        """
+        start, end = (calendar or get_calendar()).bounds(day)
+        return (
+            _session(session)
+            .query(cls, User.employee_id, User.fullname, Attendance.selfie_time)
+            .join(Attendance, cls.attendance_id == Attendance.id)
+            .join(User, cls.user_id == User.id)
+            .filter(
+                Attendance.selfie_time >= start,
+                Attendance.selfie_time < end,
+            )
+            .order_by(Attendance.selfie_time)
+            .all()
+        )
+
+    @classmethod
+    def migrate_from_json(cls, after_id: int = 0, batch_size: int = 1000, session=None):
+        """
+        Move the photo sizes stored as JSON on the next attendance rows into
+        selfie rows with one executemany; a photo which already has a row
+        (reused, or migrated before) is skipped. The caller commits, so each
+        batch is one short transaction, see the migration runner
+        :param after_id: attendance ID the previous batch ended at
+        :param batch_size: attendance rows per batch
+        :param session: session to be used instead of the thread's session
+        :return: attendance ID this batch ended at, None when none are left
+        """
+        session = _session(session)
+        rows = (
+            session.query(Attendance.id, Attendance.user_id, Attendance.legacy_selfie)
+            .filter(Attendance.id > after_id, Attendance.legacy_selfie.isnot(None))
+            .order_by(Attendance.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return None
+        selfies = []
+        for attendance_id, user_id, photos in rows:
+            if photos:
+                selfie = cls.from_photos(photos, user_id)
+                selfies.append(
+                    {
+                        "file_unique_id": selfie.file_unique_id,
+                        "attendance_id": attendance_id,
+                        "user_id": user_id,
+                        "file_id": selfie.file_id,
+                        "width": selfie.width,
+                        "height": selfie.height,
+                        "file_size": selfie.file_size,
+                        "thumb_file_id": selfie.thumb_file_id,
+                    }
+                )
+        if selfies:
+            # the first attendance to use a photo keeps it
+            session.execute(insert(cls).prefix_with("OR IGNORE"), selfies)
+        session.query(Attendance).filter(
+            Attendance.id > after_id,
+            Attendance.id <= rows[-1].id,
+            Attendance.legacy_selfie.isnot(None),
+        ).update({Attendance.legacy_selfie: null()}, synchronize_session=False)
+        return rows[-1].id
+
+
+class DailyAttendanceSummary(Base):
+    """
+    One row per user and local day of their timezone, kept up to date
+    whenever an attendance record gets both its selfie and its location
+    """
+
+    __tablename__ = "daily_attendance_summary"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("user_account.id"), nullable=False)
+    date = Column(Date, nullable=False)  # local date
+    first_check_in = Column(DateTime(timezone=True))  # UTC
+    last_check_in = Column(DateTime(timezone=True))  # UTC
+    completed_pairs = Column(Integer, default=0, nullable=False)
+    total_span_seconds = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (UniqueConstraint("user_id", "date"),)
+
+    @classmethod
+    def record_pair(
+        cls,
+        user_id: int,
+        selfie_time: datetime,
+        location_time: datetime,
+        calendar=None,
+        session=None,
+    ):
+        """
+        Add a completed selfie/location pair to its day; call in the same
+        transaction that completes the attendance record
+        :param user_id: user ID of user
+        :param selfie_time: UTC timestamp of the selfie
+        :param location_time: UTC timestamp of the location
+        :param calendar: DayCalendar of the user's timezone, TIMEZONE's if None
+        :param session: session to be used instead of the thread's session
+        """
+        session = _session(session)
+        check_in = max(selfie_time, location_time)
+        day = (calendar or get_calendar()).day_of(check_in)
+        summary = (
+            session.query(cls).filter(cls.user_id == user_id, cls.date == day).first()
+        )
+        if summary is None:
+            summary = cls(
+                user_id=user_id,
+                date=day,
+                first_check_in=check_in,
+                last_check_in=check_in,
+                completed_pairs=0,
+            )
+            session.add(summary)
+        summary.first_check_in = min(summary.first_check_in, check_in)
+        summary.last_check_in = max(summary.last_check_in, check_in)
+        summary.completed_pairs += 1
+        summary.total_span_seconds = int(
+            (summary.last_check_in - summary.first_check_in).total_seconds()
+        )
+        return summary
+
+    @classmethod
+    def get_for_range(
+        cls, user_id: int, start_date: date, end_date: date, session=None
+    ):
+        """
+        Get the days of a user within [start_date, end_date)
+        :param user_id: user ID of user
+        :param start_date: first local date
+        :param end_date: local date after the last one
+        :param session: session to be used instead of the thread's session
+        """
+        return (
+            _session(session)
+            .query(cls)
+            .filter(cls.user_id == user_id, cls.date >= start_date, cls.date < end_date)
+            .order_by(cls.date)
+            .all()
+        )
+
+    @classmethod
+    def backfill(
+        cls,
+        after_user_id: int = 0,
+        batch_size: int = 5000,
+        calendar_of=None,
+        session=None,
+    ):
+        """
+        Rebuild the summaries of the next users from the attendance table:
+        users after `after_user_id` up to the one holding the
+        `batch_size`-th attendance row, so a batch stays around that many
+        rows. The caller commits; pairs completed meanwhile are either in
+        the rebuilt rows or added to them afterwards by `record_pair`
+        :param after_user_id: user ID the previous batch ended at
+        :param batch_size: attendance rows per batch
+        :param calendar_of: function(user ID) -> DayCalendar of the user's
+            timezone, TIMEZONE's for everyone if None
+        :param session: session to be used instead of the thread's session
+        :return: user ID this batch ended at, None after the last batch
+        """
+        session = _session(session)
+        # walks ix_attendance_user_selfie_time, no table scan
+        last_user_id = session.execute(
+            text("""
+                SELECT user_id FROM attendance WHERE user_id > :after
+                ORDER BY user_id LIMIT 1 OFFSET :offset
+                """),
+            {"after": after_user_id, "offset": batch_size},
+        ).scalar()
+        criteria = [cls.user_id > after_user_id]
+        if last_user_id is not None:
+            criteria.append(cls.user_id <= last_user_id)
+        session.query(cls).filter(*criteria).delete(synchronize_session=False)
+
+        # check-in of a pair is its later half
+        check_in = func.max(
+            Attendance.selfie_time, Attendance.location_time, type_=DateTime
+        )
+        rows = session.query(Attendance.user_id, check_in).filter(
+            Attendance.user_id > after_user_id,
+            Attendance.selfie_time.isnot(None),
+            Attendance.location_time.isnot(None),
+        )
+        if last_user_id is not None:
+            rows = rows.filter(Attendance.user_id <= last_user_id)
+        check_ins = defaultdict(list)
+        for user_id, timestamp in rows:
+            check_ins[user_id].append(timestamp)
+
+        summaries = []
+        for user_id, timestamps in check_ins.items():
+            calendar = calendar_of(user_id) if calendar_of else get_calendar()
+            days = {}  # {day: [first, last, pairs]}
+            for timestamp, day in zip(timestamps, calendar.days_of(timestamps)):
+                summary = days.get(day)
+                if summary is None:
+                    days[day] = [timestamp, timestamp, 1]
+                else:
+                    summary[0] = min(summary[0], timestamp)
+                    summary[1] = max(summary[1], timestamp)
+                    summary[2] += 1
+            summaries.extend(
+                {
+                    "user_id": user_id,
+                    "date": day,
+                    "first_check_in": first,
+                    "last_check_in": last,
+                    "completed_pairs": pairs,
+                    "total_span_seconds": int((last - first).total_seconds()),
+                }
+                for day, (first, last, pairs) in days.items()
+            )
+        if summaries:
+            session.execute(insert(cls), summaries)
+        return last_user_id
+
+
+class Office(Base):
+    __tablename__ = "office"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), unique=True)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    radius_meters = Column(Float, nullable=False)
+    is_active = Column(Boolean, default=True)
+    timezone = Column(String(64))  # IANA name, settings.TIMEZONE when not set
+
+    @classmethod
+    def get_by_name(cls, name: str, session=None):
+        """
+        Get office by its name
+        :param name: name of office
+        :param session: session to be used instead of the thread's session
+        """
+        return _session(session).query(cls).filter(cls.name == name).first()
+
+    @classmethod
+    def get_active(cls, session=None):
+        """
+        Get all active offices
+        :param session: session to be used instead of the thread's session
+        """
+        return _session(session).query(cls).filter(cls.is_active.isnot(False)).all()
+
+
+class UserOffice(Base):
+    """
+    Offices an employee may mark attendance at; employees without any row
+    may use every office
+    """
+
+    __tablename__ = "user_office"
+
+    user_id = Column(Integer, ForeignKey("user_account.id"), primary_key=True)
+    office_id = Column(Integer, ForeignKey("office.id"), primary_key=True)
+
+    @classmethod
+    def get_all(cls, session=None):
+        """
+        Get every (user ID, office ID) assignment
+        :param session: session to be used instead of the thread's session
+        """
+        return _session(session).query(cls.user_id, cls.office_id).all()
+
+
+class SchemaMigration(Base):
+    """
+    Migrations applied to this database, see migrations.py. A row is added
+    once the schema change of a migration is done; `position` is how far
+    its backfill got, so an interrupted run resumes there
+    """
 
-# Create/Update models
-Base.metadata.create_all(engine)
+    __tablename__ = "schema_migration"
 
-# Create Super HR if not exists
-if not User.get_by_emp_id(SUPER_HR["employee_id"]):
-    SUPER_HR["temp_pwd"] = get_hashed(SUPER_HR["temp_pwd"])
-    super_hr = User(**SUPER_HR)
-    db_session.add(super_hr)
-    db_session.commit()
+    version = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    position = Column(Integer)  # key the last committed batch ended at
+    started_at = Column(DateTime(timezone=True))
+    applied_at = Column(DateTime(timezone=True))  # null while backfilling
@@ -0,0 +1,251 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import heapq
+import itertools
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+from log import get_logger
+from metrics import TELEGRAM_ERRORS, TELEGRAM_SECONDS
+
+MAX_MESSAGE_LENGTH = 4096
+log = get_logger("outbound")
+
+
+class _Outgoing:
+    __slots__ = ("method", "chat_id", "kwargs", "futures", "attempts")
+
+    def __init__(self, method: str, chat_id, kwargs: dict):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.futures = [Future()]
+        self.attempts = 0
+
+    def merge(self, other: "_Outgoing"):
+        """
+        Append the text of other to this message when both can be sent as one
+        """
+        if self.method != "send_message" or other.method != "send_message":
+            return False
+        mine, theirs = dict(self.kwargs), dict(other.kwargs)
+        text = mine.pop("text") + "\n\n" + theirs.pop("text")
+        if theirs.get("reply_to_message_id") is None:
+            theirs.pop("reply_to_message_id", None)
+            mine.pop("reply_to_message_id", None)
+        if mine != theirs or len(text) > MAX_MESSAGE_LENGTH:
+            return False
+        self.kwargs["text"] = text
+        self.futures.extend(other.futures)
+        return True
+
+
+class OutboundScheduler:
+    """
+    Rate aware queue for everything the bot sends.
+    Handlers enqueue and return immediately; a scheduler thread hands
+    messages to a small pool of sender threads while respecting a global
+    token bucket (Telegram allows ~30 msg/s per bot) and a minimum interval
+    per chat (~1 msg/s). Back-to-back messages to one chat that are still
+    queued are merged into one message, and a 429 response delays the chat
+    by its `retry_after` before the message is sent again.
+    """
+
+    def __init__(
+        self,
+        bot,
+        global_rate: float = 30,
+        per_chat_interval: float = 1.0,
+        merge_window: float = 0.02,
+        workers: int = 8,
+        max_attempts: int = 5,
+    ):
+        """
+        :param bot: TeleBot instance used to send
+        :param global_rate: messages per second over all chats
+        :param per_chat_interval: minimum seconds between two messages to one chat
+        :param merge_window: seconds a new message waits for others to merge with
+        :param workers: number of threads sending concurrently
+        :param max_attempts: attempts of a message before giving up on 429s
+        """
+        self.bot = bot
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.merge_window = merge_window
+        self.max_attempts = max_attempts
+        self._tokens = global_rate
+        self._refilled_at = time.monotonic()
+        self._pending = {}  # {chat_id: deque of _Outgoing}
+        self._ready = []  # heap of (ready_at, seq, chat_id)
+        self._ready_at = {}  # {chat_id: earliest time the chat may be sent to}
+        self._in_flight = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="outbound")
+        self._thread = None
+        self.sent = 0
+        self.merged = 0
+        self.throttled = 0
+        self.failed = 0
+
+    def reply_to(self, message, text: str, **kwargs):
+        """
+        Queue a reply to message, like `TeleBot.reply_to`
+        """
+        return self.send_message(
+            message.chat.id, text, reply_to_message_id=message.message_id, **kwargs
+        )
+
+    def send_message(self, chat_id, text: str, **kwargs):
+        """
+        Queue a text message, like `TeleBot.send_message`
+        :return: future of the sent message
+        """
+        return self._enqueue(
+            _Outgoing("send_message", chat_id, dict(text=text, **kwargs))
+        )
+
+    def send_document(self, chat_id, document, **kwargs):
+        """
+        Queue a document, like `TeleBot.send_document`; keep the file open
+        until the returned future is done
+        :return: future of the sent message
+        """
+        return self._enqueue(
+            _Outgoing("send_document", chat_id, dict(document=document, **kwargs))
+        )
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": sum(len(messages) for messages in self._pending.values()),
+                "sent": self.sent,
+                "merged": self.merged,
+                "throttled": self.throttled,
+                "failed": self.failed,
+            }
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="outbound-scheduler", daemon=True
+                )
+                self._thread.start()
+
+    def _enqueue(self, outgoing: _Outgoing):
+        self.start()
+        with self._cond:
+            messages = self._pending.setdefault(outgoing.chat_id, deque())
+            if messages and messages[-1].merge(outgoing):
+                self.merged += 1
+                return outgoing.futures[0]
+            messages.append(outgoing)
+            if len(messages) == 1 and outgoing.chat_id not in self._in_flight:
+                ready_at = max(
+                    self._ready_at.get(outgoing.chat_id, 0),
+                    time.monotonic() + self.merge_window,
+                )
+                self._schedule(outgoing.chat_id, ready_at)
+            return outgoing.futures[0]
+
+    def _schedule(self, chat_id, ready_at: float):
+        heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    self._tokens = min(
+                        self.global_rate,
+                        self._tokens + (now - self._refilled_at) * self.global_rate,
+                    )
+                    self._refilled_at = now
+                    if not self._ready:
+                        self._cond.wait()
+                        continue
+                    ready_at = self._ready[0][0]
+                    if ready_at > now:
+                        self._cond.wait(ready_at - now)
+                        continue
+                    if self._tokens < 1:
+                        self._cond.wait((1 - self._tokens) / self.global_rate)
+                        continue
+                    break
+                _, _, chat_id = heapq.heappop(self._ready)
+                messages = self._pending.get(chat_id)
+                if not messages or chat_id in self._in_flight:
+                    continue
+                outgoing = messages.popleft()
+                if not messages:
+                    del self._pending[chat_id]
+                self._in_flight.add(chat_id)
+                self._tokens -= 1
+            self._pool.submit(self._send, outgoing)
+
+    def _send(self, outgoing: _Outgoing):
+        retry_after = None
+        outgoing.attempts += 1
+        start = time.perf_counter()
+        try:
+            result = getattr(self.bot, outgoing.method)(
+                outgoing.chat_id, **outgoing.kwargs
+            )
+        except ApiTelegramException as e:
+            TELEGRAM_ERRORS.inc(method=outgoing.method, code=e.error_code)
+            if e.error_code == 429 and outgoing.attempts < self.max_attempts:
+                retry_after = (e.result_json.get("parameters") or {}).get(
+                    "retry_after", 1
+                )
+            else:
+                self._finish(outgoing, exception=e)
+        except Exception as e:
+            TELEGRAM_ERRORS.inc(method=outgoing.method, code=type(e).__name__)
+            self._finish(outgoing, exception=e)
+        else:
+            self._finish(outgoing, result=result)
+        finally:
+            TELEGRAM_SECONDS.observe(
+                time.perf_counter() - start, method=outgoing.method
+            )
+
+        with self._cond:
+            self._in_flight.discard(outgoing.chat_id)
+            delay = self.per_chat_interval
+            if retry_after is not None:
+                # put it back in front and wait as long as Telegram asked
+                self.throttled += 1
+                self._pending.setdefault(outgoing.chat_id, deque()).appendleft(outgoing)
+                delay = retry_after
+            ready_at = time.monotonic() + delay
+            self._ready_at[outgoing.chat_id] = ready_at
+            if outgoing.chat_id in self._pending:
+                self._schedule(outgoing.chat_id, ready_at)
+            elif len(self._ready_at) > 10000:
+                now = time.monotonic()
+                self._ready_at = {
+                    chat: at for chat, at in self._ready_at.items() if at > now
+                }
+
+    def _finish(self, outgoing: _Outgoing, result=None, exception=None):
+        with self._cond:
+            if exception is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+        if exception is not None:
+            log.error(
+                "Failed to send %s",
+                outgoing.method,
+                exc_info=exception,
+                extra={"chat_id": outgoing.chat_id, "attempts": outgoing.attempts},
+            )
+        for future in outgoing.futures:
+            if exception is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exception)
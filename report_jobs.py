@@ -0,0 +1,221 @@
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import hashlib
+import os
+import threading
+import time
+
+from db_backend import session_scope
+from log import get_logger
+
+log = get_logger("reports")
+
+FORMATS = ("xlsx", "pdf")
+
+
+class ReportQueueFull(Exception):
+    """
+    Too many reports are already waiting to be built
+    """
+
+
+class _Job:
+    __slots__ = ("path", "user_id", "year", "month", "fmt", "waiters", "queued_at")
+
+    def __init__(self, path, user_id, year, month, fmt):
+        self.path = path  # in the cache, also the key of the job
+        self.user_id = user_id
+        self.year = year
+        self.month = month
+        self.fmt = fmt
+        self.waiters = []  # (chat_id, reply_to_message_id, file name)
+        self.queued_at = time.monotonic()
+
+
+class ReportJobs:
+    """
+    Builds attendance reports on a small pool of worker threads so handlers
+    only enqueue and return. Finished reports are kept on disk under their
+    (user, month, format, data version), so asking again for a month whose
+    data hasn't changed (e.g. a closed month) sends the stored file at once.
+    Requests for a report that is already being built join that job.
+    """
+
+    def __init__(
+        self,
+        outbox,
+        builders: dict,
+        cache_dir: str,
+        workers: int = 2,
+        max_pending: int = 100,
+        progress_after: float = 3,
+    ):
+        """
+        :param outbox: OutboundScheduler sending progress and the documents
+        :param builders: {format: function(user_id, year, month) -> (path, records)}
+        :param cache_dir: directory of finished reports
+        :param workers: reports built at once
+        :param max_pending: reports building or waiting before refusing more
+        :param progress_after: seconds in the queue after which the user is
+            told their report is now being built
+        """
+        self.outbox = outbox
+        self.builders = builders
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self.progress_after = progress_after
+        self._jobs = {}  # {cache path: _Job}
+        self._pool = None
+        self._lock = threading.Lock()
+        self.built = 0
+        self.cache_hits = 0
+
+    def start(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="report"
+                )
+        return self
+
+    def stop(self):
+        """
+        Finish the reports queued so far and stop the workers
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def pending(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def request(
+        self,
+        chat_id,
+        reply_to_message_id: int,
+        user_id: int,
+        year: int,
+        month: int,
+        fmt: str,
+        file_name: str,
+        version: str,
+    ):
+        """
+        Send a report to a chat, from the cache or once it is built; in the
+        latter case the chat is told right away that it is being prepared
+        :param version: data version of the report, see `report_data_version`
+        :return: "cached" when sent from disk, else the number of reports
+            queued ahead of this one
+        :raises ReportQueueFull: too many reports are waiting
+        """
+        self.start()
+        digest = hashlib.sha256(version.encode()).hexdigest()[:16]
+        path = os.path.join(
+            self.cache_dir, str(user_id), f"{year}-{month:02d}.{digest}.{fmt}"
+        )
+        waiter = (chat_id, reply_to_message_id, file_name)
+        if os.path.exists(path):
+            with self._lock:
+                self.cache_hits += 1
+            self._send(path, [waiter])
+            return "cached"
+
+        with self._lock:
+            job = self._jobs.get(path)
+            if job is None:
+                if len(self._jobs) >= self.max_pending:
+                    raise ReportQueueFull("Too many reports are being built")
+                job = self._jobs[path] = _Job(path, user_id, year, month, fmt)
+                self._pool.submit(self._build, job)
+            job.waiters.append(waiter)
+            ahead = len(self._jobs) - 1
+            # queued while holding the lock, so it goes out before the report
+            self.outbox.send_message(
+                chat_id,
+                f"⏳ Preparing your {month:02d}-{year} report"
+                + (f"; {ahead} ahead of it" if ahead else ""),
+                reply_to_message_id=reply_to_message_id,
+            )
+        return ahead
+
+    def _build(self, job: _Job):
+        if time.monotonic() - job.queued_at > self.progress_after:
+            with self._lock:
+                waiters = list(job.waiters)
+            for chat_id, reply_to, _ in waiters:
+                self.outbox.send_message(
+                    chat_id,
+                    f"Building your {job.month:02d}-{job.year} report...",
+                    reply_to_message_id=reply_to,
+                )
+        start = time.perf_counter()
+        records = 0
+        try:
+            with session_scope():
+                built, records = self.builders[job.fmt](
+                    job.user_id, job.year, job.month
+                )
+            if records:
+                os.makedirs(os.path.dirname(job.path), exist_ok=True)
+                os.replace(built, job.path)
+                self._drop_stale(job)
+            else:
+                os.remove(built)
+        except Exception:
+            log.exception(
+                "Report failed",
+                extra={"user_id": job.user_id, "year": job.year, "month": job.month},
+            )
+            records = None
+        finally:
+            # later requests see the file (or start a new job) from now on
+            with self._lock:
+                self._jobs.pop(job.path, None)
+                waiters = list(job.waiters)
+                self.built += 1
+
+        log.info(
+            "Report built",
+            extra={
+                "user_id": job.user_id,
+                "format": job.fmt,
+                "records": records,
+                "build_ms": round((time.perf_counter() - start) * 1000, 3),
+                "waiters": len(waiters),
+            },
+        )
+        if records:
+            self._send(job.path, waiters)
+        else:
+            text = (
+                "Error building the report. Please try again."
+                if records is None
+                else f"No attendance found for {job.month:02d}-{job.year}"
+            )
+            for chat_id, reply_to, _ in waiters:
+                self.outbox.send_message(chat_id, text, reply_to_message_id=reply_to)
+
+    def _send(self, path: str, waiters: list):
+        for chat_id, reply_to, file_name in waiters:
+            report = open(path, "rb")
+            future = self.outbox.send_document(
+                chat_id,
+                report,
+                reply_to_message_id=reply_to,
+                visible_file_name=file_name,
+            )
+            # the outbox reads the file when its turn comes
+            future.add_done_callback(lambda _, report=report: report.close())
+
+    def _drop_stale(self, job: _Job):
+        # reports of the same month built from older data
+        prefix = os.path.join(os.path.dirname(job.path), f"{job.year}-{job.month:02d}.")
+        for path in glob.glob(glob.escape(prefix) + f"*.{job.fmt}"):
+            if path != job.path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
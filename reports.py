@@ -0,0 +1,237 @@
+from datetime import date
+from html import escape
+from itertools import islice
+import os
+import tempfile
+
+from geofence import user_calendar
+from helpers import time_difference
+from models import Attendance, DailyAttendanceSummary, Selfie
+from timezones import get_calendar
+from verification import LABELS
+
+REPORT_COLUMNS = [
+    ("Date", 12),
+    ("Selfie time", 12),
+    ("Location time", 14),
+    ("Time taken", 12),
+    ("Latitude", 12),
+    ("Longitude", 12),
+    ("Scene vs reference", 18),
+]
+# bump whenever the report layout changes, so cached reports are rebuilt
+REPORT_LAYOUT_VERSION = 3
+REPORT_BATCH_SIZE = 500  # records fetched and converted to local time at once
+SELFIE_REVIEW_COLUMNS = 6  # thumbnails per row of the contact sheet
+SELFIE_REVIEW_LABEL_HEIGHT = 28  # pixels under each thumbnail
+SUMMARY_COLUMNS = [
+    ("Date", 12),
+    ("First check-in", 14),
+    ("Last check-in", 14),
+    ("Completed", 11),
+    ("Span", 8),
+]
+
+
+def build_monthly_report(user_id: int, year: int, month: int):
+    """
+    Write the attendance of a user for a month into a temporary XLSX file.
+    Rows are streamed from the database straight into a write-only workbook,
+    so memory stays flat whatever the number of records.
+    :param user_id: user ID of user
+    :param year: year of the report
+    :param month: month of the report (1-12)
+    :return: path of the XLSX file and number of records written; caller removes the file
+    """
+    # imported on first use, openpyxl alone adds ~150 ms to the bot's startup
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    summary_sheet = _create_sheet(workbook, "Summary", SUMMARY_COLUMNS)
+    sheet = _create_sheet(workbook, f"{year}-{month:02d}", REPORT_COLUMNS)
+    for row in _summary_rows(user_id, year, month):
+        summary_sheet.append(row)
+    records = 0
+    for row in _record_rows(user_id, year, month):
+        sheet.append(row)
+        records += 1
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    workbook.save(path)
+    return path, records
+
+
+def build_monthly_report_pdf(user_id: int, year: int, month: int):
+    """
+    Same report as `build_monthly_report` as a PDF, rendered from HTML by
+    pdfkit (wkhtmltopdf)
+    :param user_id: user ID of user
+    :param year: year of the report
+    :param month: month of the report (1-12)
+    :return: path of the PDF file and number of records written; caller removes the file
+    """
+    import pdfkit
+
+    rows = list(_record_rows(user_id, year, month))
+    html = (
+        "<html><head><meta charset='utf-8'><style>"
+        "body{font-family:sans-serif;font-size:11px}"
+        "table{border-collapse:collapse;margin-bottom:16px}"
+        "td,th{border:1px solid #999;padding:2px 6px}"
+        "</style></head><body>"
+        f"<h3>Attendance {month:02d}-{year}</h3>"
+        + _html_table(SUMMARY_COLUMNS, _summary_rows(user_id, year, month))
+        + _html_table(REPORT_COLUMNS, rows)
+        + "</body></html>"
+    )
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    pdfkit.from_string(html, path, options={"quiet": ""})
+    return path, len(rows)
+
+
+def report_data_version(user_id: int, year: int, month: int):
+    """
+    Fingerprint of the data of a monthly report; a report built for the
+    same fingerprint is still up to date
+    :param user_id: user ID of user
+    :param year: year of the report
+    :param month: month of the report (1-12)
+    """
+    calendar = user_calendar(user_id)
+    start_time, end_time = calendar.month_bounds(year, month)
+    version = Attendance.get_data_version(start_time, end_time, user_id)
+    # times are shown in the user's timezone, a new one needs a new report
+    return f"{REPORT_LAYOUT_VERSION}-{calendar.zone_name}-{version}"
+
+
+def _summary_rows(user_id: int, year: int, month: int):
+    # one precomputed row per day
+    calendar = user_calendar(user_id)
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    days = DailyAttendanceSummary.get_for_range(
+        user_id, date(year, month, 1), date(next_year, next_month, 1)
+    )
+    first_check_ins = calendar.to_local_many(day.first_check_in for day in days)
+    last_check_ins = calendar.to_local_many(day.last_check_in for day in days)
+    for day, first_check_in, last_check_in in zip(
+        days, first_check_ins, last_check_ins
+    ):
+        yield [
+            day.date.strftime("%d-%m-%Y"),
+            first_check_in.strftime("%H:%M:%S"),
+            last_check_in.strftime("%H:%M:%S"),
+            day.completed_pairs,
+            f"{day.total_span_seconds // 3600:02d}:{day.total_span_seconds % 3600 // 60:02d}",
+        ]
+
+
+def _record_rows(user_id: int, year: int, month: int):
+    calendar = user_calendar(user_id)
+    start_time, end_time = calendar.month_bounds(year, month)
+    records = Attendance.stream_attendance_records(
+        start_time, end_time, user_id, batch_size=REPORT_BATCH_SIZE
+    )
+    # local times of a whole batch are converted at once
+    while batch := list(islice(records, REPORT_BATCH_SIZE)):
+        selfie_times = calendar.to_local_many(record.selfie_time for record in batch)
+        location_times = calendar.to_local_many(
+            record.location_time for record in batch
+        )
+        for record, selfie_time, location_time in zip(
+            batch, selfie_times, location_times
+        ):
+            location = record.location or {}
+            yield [
+                selfie_time.strftime("%d-%m-%Y"),
+                selfie_time.strftime("%H:%M:%S"),
+                location_time.strftime("%H:%M:%S"),
+                time_difference(
+                    max(selfie_time, location_time),
+                    min(selfie_time, location_time),
+                    formatted=True,
+                ),
+                location.get("latitude"),
+                location.get("longitude"),
+                LABELS.get(record.verification),
+            ]
+
+
+def _html_table(columns: list, rows):
+    head = "".join(f"<th>{escape(title)}</th>" for title, _ in columns)
+    body = "".join(
+        "<tr>"
+        + "".join(
+            f"<td>{escape('' if value is None else str(value))}</td>" for value in row
+        )
+        + "</tr>"
+        for row in rows
+    )
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+def build_selfie_review(store, day: date, calendar=None):
+    """
+    Write the selfies of a day into a temporary JPEG contact sheet, each
+    thumbnail labelled with the employee ID and local time of the
+    calendar's timezone. Thumbnails are read from the local selfie store;
+    selfies not downloaded yet are shown as empty cells.
+    :param store: SelfieStore holding the thumbnails
+    :param day: local date
+    :param calendar: DayCalendar of the reviewer's timezone, TIMEZONE's if None
+    :return: path of the JPEG file (None when there are no selfies), number of
+        selfies and how many of them were missing; caller removes the file
+    """
+    from PIL import Image, ImageDraw
+
+    calendar = calendar or get_calendar()
+    selfies = Selfie.get_for_day(day, calendar)
+    if not selfies:
+        return None, 0, 0
+    local_times = calendar.to_local_many(selfie_time for *_, selfie_time in selfies)
+    size = store.thumbnail_size
+    cell_height = size + SELFIE_REVIEW_LABEL_HEIGHT
+    columns = min(SELFIE_REVIEW_COLUMNS, len(selfies))
+    rows = -(-len(selfies) // columns)
+    sheet = Image.new("RGB", (columns * size, rows * cell_height), "white")
+    draw = ImageDraw.Draw(sheet)
+    missing = 0
+    for index, ((selfie, employee_id, _, _), local_time) in enumerate(
+        zip(selfies, local_times)
+    ):
+        left = index % columns * size
+        top = index // columns * cell_height
+        if selfie.sha256 and store.has(selfie.sha256, thumbnail=True):
+            with Image.open(store.path(selfie.sha256, thumbnail=True)) as thumbnail:
+                # centre thumbnails that aren't square
+                sheet.paste(
+                    thumbnail,
+                    (
+                        left + (size - thumbnail.width) // 2,
+                        top + (size - thumbnail.height) // 2,
+                    ),
+                )
+        else:
+            missing += 1
+            draw.rectangle((left, top, left + size - 1, top + size - 1), "lightgray")
+        draw.text(
+            (left + 4, top + size + 6),
+            f"{employee_id} {local_time.strftime('%H:%M:%S')}",
+            fill="black",
+        )
+
+    fd, path = tempfile.mkstemp(suffix=".jpg")
+    os.close(fd)
+    sheet.save(path, "JPEG", quality=80)
+    return path, len(selfies), missing
+
+
+def _create_sheet(workbook, title: str, columns: list):
+    from openpyxl.utils import get_column_letter
+
+    sheet = workbook.create_sheet(title)
+    for index, (_, width) in enumerate(columns, start=1):
+        sheet.column_dimensions[get_column_letter(index)].width = width
+    sheet.append([title for title, _ in columns])
+    return sheet
@@ -0,0 +1,257 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+
+from db_backend import session_scope
+from log import get_logger
+
+log = get_logger("selfie_store")
+
+
+class TelegramFileSource:
+    """
+    Downloads files from the Bot API file endpoint
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def fetch(self, file_id: str):
+        file_info = self.bot.get_file(file_id)
+        return self.bot.download_file(file_info.file_path)
+
+
+class DirectoryFileSource:
+    """
+    Serves `<directory>/<file_id>` in place of Telegram, for tests and
+    benchmarks
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def fetch(self, file_id: str):
+        with open(os.path.join(self.directory, file_id), "rb") as file:
+            return file.read()
+
+
+class SelfieStore:
+    """
+    Content addressed store of selfie photos and their thumbnails on local
+    disk. A photo lives at `originals/ab/cd/<sha256>.jpg`, fanned out on the
+    first bytes of its digest so no directory grows too large, and
+    identical photos are stored once.
+    """
+
+    def __init__(self, root: str, thumbnail_size: int = 320, quality: int = 70):
+        """
+        :param root: directory of the store
+        :param thumbnail_size: longest side of thumbnails, in pixels
+        :param quality: JPEG quality of thumbnails
+        """
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+        self.quality = quality
+
+    def path(self, sha256: str, thumbnail: bool = False):
+        kind = "thumbnails" if thumbnail else "originals"
+        return os.path.join(self.root, kind, sha256[:2], sha256[2:4], sha256 + ".jpg")
+
+    def has(self, sha256: str, thumbnail: bool = False):
+        return os.path.exists(self.path(sha256, thumbnail))
+
+    def put(self, data: bytes):
+        """
+        Store a photo unless the same content is already there
+        :param data: photo as downloaded
+        :return: sha256 hex digest of the photo
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path(sha256)
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+        return sha256
+
+
+def make_thumbnail(source: str, target: str, size: int, quality: int):
+    """
+    Write a JPEG thumbnail of an image; runs in a worker process
+    :param source: path of the image
+    :param target: path of the thumbnail
+    :param size: longest side of the thumbnail, in pixels
+    :param quality: JPEG quality
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True)
+    _write_atomic(target, output.getvalue())
+
+
+def _write_atomic(path: str, data: bytes):
+    # readers never see a partial file, and racing writers of the same
+    # content simply replace each other
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class SelfieFetcher:
+    """
+    Downloads selfies into a SelfieStore in the background. Handlers submit
+    a selfie once its attendance row is committed and return at once; a few
+    threads download the largest size, store it and record its digest on
+    the selfie row, while Pillow makes the thumbnail in worker processes so
+    image decoding never holds the bot's GIL. At most `max_pending` selfies
+    wait; past that they are skipped and left for `fetch_missing`.
+    `on_stored(file_unique_id, sha256)` runs on the download thread after
+    each selfie is stored, e.g. to verify it.
+    """
+
+    def __init__(
+        self,
+        store: SelfieStore,
+        source,
+        workers: int = 2,
+        thumbnail_workers: int = 1,
+        max_pending: int = 1000,
+        on_stored=None,
+    ):
+        """
+        :param store: where photos are kept
+        :param source: object with fetch(file_id) -> bytes, e.g. TelegramFileSource
+        :param workers: concurrent downloads
+        :param thumbnail_workers: worker processes making thumbnails
+        :param max_pending: selfies downloading or waiting at once
+        :param on_stored: callable run after each selfie is stored
+        """
+        self.store = store
+        self.source = source
+        self.workers = workers
+        self.thumbnail_workers = thumbnail_workers
+        self.on_stored = on_stored
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._downloads = None
+        self._thumbnails = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._downloads is None:
+                methods = multiprocessing.get_all_start_methods()
+                # fork is unsafe with the bot's threads running
+                context = multiprocessing.get_context(
+                    "forkserver" if "forkserver" in methods else "spawn"
+                )
+                self._thumbnails = ProcessPoolExecutor(
+                    self.thumbnail_workers, mp_context=context
+                )
+                self._downloads = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="selfie-fetch"
+                )
+        return self
+
+    def stop(self):
+        """
+        Finish the downloads in progress and stop the workers
+        """
+        with self._lock:
+            downloads, self._downloads = self._downloads, None
+            thumbnails, self._thumbnails = self._thumbnails, None
+        if downloads is not None:
+            downloads.shutdown()
+            thumbnails.shutdown()
+
+    def submit(self, file_unique_id: str, file_id: str):
+        """
+        Download a selfie in the background; never blocks
+        :param file_unique_id: primary key of the selfie row
+        :param file_id: Telegram file ID of its largest size
+        :return: future of the photo's digest, None when too many are pending
+        """
+        self.start()
+        if not self._slots.acquire(False):
+            log.warning(
+                "Selfie download skipped, too many pending",
+                extra={"file_unique_id": file_unique_id},
+            )
+            return None
+        try:
+            future = self._downloads.submit(self.fetch, file_unique_id, file_id)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def fetch(self, file_unique_id: str, file_id: str):
+        """
+        Download, store and thumbnail one selfie, then record its digest
+        :return: sha256 hex digest of the photo
+        """
+        self.start()
+        try:
+            sha256 = self.store.put(self.source.fetch(file_id))
+            if not self.store.has(sha256, thumbnail=True):
+                self._thumbnails.submit(
+                    make_thumbnail,
+                    self.store.path(sha256),
+                    self.store.path(sha256, thumbnail=True),
+                    self.store.thumbnail_size,
+                    self.store.quality,
+                ).result()
+            from models import Selfie
+
+            with session_scope() as session:
+                Selfie.set_sha256(file_unique_id, sha256, session=session)
+            if self.on_stored is not None:
+                self.on_stored(file_unique_id, sha256)
+        except Exception:
+            log.exception(
+                "Selfie download failed", extra={"file_unique_id": file_unique_id}
+            )
+            raise
+        return sha256
+
+    def fetch_missing(self, batch_size: int = 100):
+        """
+        Download every selfie not yet in the store, e.g. after downtime
+        :param batch_size: selfies looked up and downloaded at a time
+        :return: number of selfies downloaded and failed
+        """
+        from models import Selfie
+
+        self.start()
+        downloaded = failed = 0
+        skipped = set()
+        while True:
+            with session_scope() as session:
+                rows = Selfie.get_not_downloaded(
+                    batch_size + len(skipped), session=session
+                )
+            rows = [row for row in rows if row.file_unique_id not in skipped]
+            if not rows:
+                return downloaded, failed
+            futures = [
+                (row.file_unique_id, self._downloads.submit(self.fetch, *row))
+                for row in rows
+            ]
+            for file_unique_id, future in futures:
+                if future.exception() is None:
+                    downloaded += 1
+                else:
+                    failed += 1
+                    skipped.add(file_unique_id)
@@ -5,13 +5,103 @@ load_dotenv()
 
 # Constants
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
-DB_LOCATION = os.path.join(os.getcwd(), "TA.db").replace("\\", "/")
+DB_LOCATION = os.environ.get(
+    "DB_LOCATION", os.path.join(os.getcwd(), "TA.db")
+).replace("\\", "/")
+
+DB_BUSY_TIMEOUT = 5000  # milliseconds a writer waits for the sqlite lock
+DB_CACHE_SIZE_KB = 64 * 1024
+
+# Schema migrations; backfills run in short transactions so the bot keeps writing
+MIGRATION_BATCH_SIZE = 5000  # rows per backfill transaction
+MIGRATION_PAUSE = 0.05  # seconds between backfill transactions
+
+IDENTITY_CACHE_SIZE = 4096  # cached chat ID / employee ID -> user entries
+IDENTITY_CACHE_TTL = 300  # seconds
+
+# Group commit of attendance writes
+WRITE_BEHIND_MAX_BATCH = 200  # rows per transaction
+WRITE_BEHIND_MAX_DELAY = 0.005  # seconds to wait for more rows
+WRITE_BEHIND_TIMEOUT = 30  # seconds a handler waits for its row to be committed
+
+# Outbound messages; Telegram allows ~30 msg/s per bot and ~1 msg/s per chat
+OUTBOUND_GLOBAL_RATE = 30  # messages per second
+OUTBOUND_PER_CHAT_INTERVAL = 1.0  # seconds between messages to one chat
+OUTBOUND_WORKERS = 8  # concurrent Telegram API calls
 
 MIN_LIVE_LOCATION_DURATION = 30  # seconds
+REQUIRED_LIVE_UPDATES = 2  # in-fence live location samples to confirm attendance
+LIVE_LOCATION_BUFFER_SIZE = 8  # samples kept per live location session
+LIVE_LOCATION_MAX_SESSIONS = 10000
 OFFICE_LAT = 26.879218       # replace with your office latitude
 OFFICE_LNG = 81.016495        # replace with your office longitude
 OFFICE_RADIUS_METERS = 50
 
+# Attendance days are local days of the employee's office timezone; offices
+# without one, and employees without an assigned office, use TIMEZONE
+TIMEZONE = os.environ.get("TIMEZONE", "Asia/Kolkata")
+CALENDAR_PAST_DAYS = 3 * 366  # local days whose UTC bounds are precomputed
+CALENDAR_FUTURE_DAYS = 2 * 366
+
+# Webhook mode; polling is used when WEBHOOK_URL is not set
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # public HTTPS URL routed to this process
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8443))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEBHOOK_QUEUE_SIZE = 1000  # updates waiting for dispatch before answering 503
+WEBHOOK_DISPATCHERS = 8  # threads running the handlers in webhook mode
+
+# Prometheus metrics; 0 disables the endpoint
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108))
+
+# Password/OTP hashing; scrypt runs in worker processes
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_MAX_PENDING = 64  # hashes running or waiting before refusing more
+
+# Bulk user import from a CSV/XLSX document
+USER_IMPORT_MAX_ROWS = 5000
+USER_IMPORT_MAX_BYTES = 5 * 1024 * 1024
+
+# Bulk deactivate/reactivate/reset by a list of employee IDs
+BULK_UPDATE_MAX_IDS = 5000
+BULK_UPDATE_MISSING_SHOWN = 50  # missing IDs listed in the reply
+
+# Reports are built by background workers and kept on disk
+REPORT_CACHE_DIR = os.environ.get(
+    "REPORT_CACHE_DIR", os.path.join(os.getcwd(), "reports")
+)
+REPORT_WORKERS = 2  # reports built at once
+REPORT_MAX_PENDING = 100  # reports building or waiting before refusing more
+REPORT_PROGRESS_AFTER = 3  # seconds queued before telling the user it's being built
+
+# Local copies of selfies, downloaded in the background
+SELFIE_STORE_DIR = os.environ.get(
+    "SELFIE_STORE_DIR", os.path.join(os.getcwd(), "selfies")
+)
+SELFIE_THUMBNAIL_SIZE = 320  # pixels, longest side
+SELFIE_THUMBNAIL_QUALITY = 70  # JPEG quality
+SELFIE_FETCH_WORKERS = 2  # concurrent downloads from Telegram
+SELFIE_THUMBNAIL_WORKERS = 1  # processes making thumbnails
+SELFIE_FETCH_MAX_PENDING = 1000  # downloads waiting before skipping new ones
+
+# Selfie comparison with the enrolled reference photo; advisory, see verification.LABELS
+SELFIE_VERIFY_WORKERS = 1  # processes hashing images
+SELFIE_VERIFY_MAX_PENDING = 32  # images hashed or waiting at once
+SELFIE_MATCH_MAX_DISTANCE = 10  # of 64 hash bits still counted as a similar scene
+SELFIE_REFERENCE_CACHE_SIZE = 4096  # employees whose reference is kept in memory
+
+# Logging; JSON lines on stdout written by a background thread
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = 10000  # records waiting for the writer before dropping
+# "category" or "category.branch": (records per second, burst)
+LOG_RATE_LIMITS = {
+    "security.geofence_reject": (0.5, 20),
+    "security": (5, 50),
+}
+# "category" or "category.branch": fraction of records kept
+LOG_SAMPLE_RATES = {}
+
 # Super HR/Admin details
 SUPER_HR = {
     "employee_id": os.environ.get("SUPER_HR_EMP_ID"),
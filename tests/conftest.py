@@ -0,0 +1,39 @@
+"""
+Shared setup of the tests: settings are read at import time, so the
+environment points at a throwaway database before any module is imported
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKDIR = tempfile.mkdtemp()
+os.environ["DB_LOCATION"] = os.path.join(WORKDIR, "TA.db")
+os.environ["SELFIE_STORE_DIR"] = os.path.join(WORKDIR, "selfies")
+os.environ["REPORT_CACHE_DIR"] = os.path.join(WORKDIR, "reports")
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("SUPER_HR_EMP_ID", "HR-0")
+os.environ.setdefault("SUPER_HR_NAME", "Super HR")
+os.environ.setdefault("SUPER_HR_PWD", "test")
+
+
+@pytest.fixture
+def session():
+    """
+    Thread's session on empty tables, dropped again after the test
+    """
+    from db_backend import db_session, engine
+    from models import Base
+
+    Base.metadata.create_all(engine)
+    try:
+        yield db_session
+    finally:
+        db_session.rollback()
+        db_session.remove()
+        Base.metadata.drop_all(engine)
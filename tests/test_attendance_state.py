@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from attendance_state import (
+    UNKNOWN,
+    PendingPair,
+    PendingPairTracker,
+    Transition,
+    next_transition,
+)
+from timezones import get_calendar
+
+DELAY = 300  # seconds between the two halves
+IST = get_calendar("Asia/Kolkata")  # local midnight is 18:30 UTC
+NOON = datetime(2024, 3, 5, 6, 30)  # UTC
+
+
+def test_without_pending_pair_starts_a_record():
+    transition = next_transition(None, "selfie", NOON, IST, DELAY)
+    assert transition.outcome == "new_record"
+    assert transition.pair is None
+
+
+def test_other_half_within_delay_is_merged():
+    pair = PendingPair(1, "selfie", NOON)
+    later = NOON + timedelta(seconds=DELAY)
+    transition = next_transition(pair, "location", later, IST, DELAY)
+    assert transition.outcome == "merged"
+    assert transition.pair is pair
+
+
+def test_same_half_within_delay_is_already_received():
+    pair = PendingPair(1, "location", NOON)
+    transition = next_transition(pair, "location", NOON + timedelta(seconds=60), IST, DELAY)
+    assert transition.outcome == "already_received"
+    assert "<b>4.0</b> minutes" in transition.replies()[0]
+
+
+@pytest.mark.parametrize("kind", ["selfie", "location"])
+def test_any_half_after_delay_expired_starts_a_record(kind):
+    pair = PendingPair(1, "selfie", NOON)
+    later = NOON + timedelta(seconds=DELAY + 1)
+    transition = next_transition(pair, kind, later, IST, DELAY)
+    assert transition.outcome == "delay_expired"
+    assert len(transition.replies()) == 2
+
+
+def test_pending_pair_of_previous_local_day_is_not_merged():
+    # two minutes apart but on both sides of midnight in Kolkata
+    pair = PendingPair(1, "selfie", datetime(2024, 3, 5, 18, 29))
+    transition = next_transition(pair, "location", datetime(2024, 3, 5, 18, 31), IST, DELAY)
+    assert transition.outcome == "new_record"
+
+
+def test_day_boundary_follows_the_calendar_timezone():
+    # the same two instants are one local day in UTC
+    pair = PendingPair(1, "selfie", datetime(2024, 3, 5, 18, 29))
+    calendar = get_calendar("UTC")
+    transition = next_transition(pair, "location", datetime(2024, 3, 5, 18, 31), calendar, DELAY)
+    assert transition.outcome == "merged"
+
+
+def test_tracker_is_unknown_until_rebuilt(session):
+    tracker = PendingPairTracker()
+    assert tracker.get(1) is UNKNOWN
+    assert tracker.rebuild() == 0
+    assert tracker.get(1) is None
+    assert tracker.stats() == {"pending": 0, "hits": 1, "misses": 1}
+
+
+def test_tracker_follows_applied_transitions(session):
+    tracker = PendingPairTracker()
+    tracker.rebuild()
+    tracker.apply(1, Transition("new_record", "selfie", NOON), attendance_id=7)
+    pair = tracker.get(1)
+    assert (pair.attendance_id, pair.kind, pair.timestamp) == (7, "selfie", NOON)
+
+    tracker.apply(1, Transition("already_received", "selfie", NOON, pair, DELAY))
+    assert tracker.get(1) is pair
+
+    tracker.apply(1, Transition("merged", "location", NOON, pair, DELAY))
+    assert tracker.get(1) is None
+    assert len(tracker) == 0
+
+
+def test_invalidated_user_is_read_again(session):
+    tracker = PendingPairTracker()
+    tracker.rebuild()
+    tracker.apply(1, Transition("new_record", "location", NOON), attendance_id=3)
+    tracker.apply(2, Transition("new_record", "selfie", NOON), attendance_id=4)
+
+    tracker.invalidate(1)
+    assert tracker.get(1) is UNKNOWN
+    assert tracker.get(2).attendance_id == 4
+
+    # what the database says replaces the lost entry
+    assert tracker.load(1, None) is None
+    assert tracker.get(1) is None
+    tracker.invalidate(2)
+    record = type("Record", (), {"id": 9, "selfie_time": NOON, "location_time": None})
+    assert tracker.load(2, record).attendance_id == 9
+    assert tracker.get(2).kind == "selfie"
+
+
+def test_rebuild_loads_only_incomplete_newest_records(session):
+    from models import Attendance, User
+
+    now = datetime.utcnow().replace(microsecond=0)
+    users = [User(employee_id=f"E{n}", fullname=f"E {n}", role="Employee") for n in range(3)]
+    session.add_all(users)
+    session.flush()
+    done, pending, old = users
+    session.add_all(
+        [
+            Attendance(user_id=done.id, selfie_time=now, location_time=now),
+            Attendance(user_id=pending.id, selfie_time=now, location_time=now),
+            Attendance(user_id=pending.id, location_time=now, location={"lat": 0}),
+            Attendance(user_id=old.id, selfie_time=now - timedelta(days=5)),
+        ]
+    )
+    session.commit()
+
+    tracker = PendingPairTracker()
+    assert tracker.rebuild() == 1
+    assert tracker.get(done.id) is None
+    assert tracker.get(pending.id).kind == "location"
+    assert tracker.get(old.id) is None
@@ -0,0 +1,121 @@
+import pytest
+from sqlalchemy import event
+
+import cache
+from cache import IdentityCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    identities = IdentityCache(maxsize=2, ttl=60)
+    identities.put("a", 1, owner=1)
+    identities.put("b", 2, owner=2)
+    assert identities.get("a") == 1  # "b" is now the least recently used
+    identities.put("c", 3, owner=3)
+
+    assert [identities.get(key) for key in "abc"] == [1, None, 3]
+    assert identities.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    identities = IdentityCache(maxsize=10, ttl=60)
+    identities.put("a", 1, owner=1)
+    clock.now += 60
+    assert identities.get("a") == 1
+    clock.now += 0.1
+    assert identities.get("a") is None
+    assert identities.stats()["size"] == 0
+
+
+def test_invalidation_drops_every_entry_of_an_owner(clock):
+    identities = IdentityCache(maxsize=10, ttl=60)
+    identities.put(("chat", "42"), "user 1", owner=1)
+    identities.put(("emp", "E1"), "user 1", owner=1)
+    identities.put(("emp", "E2"), "user 2", owner=2)
+
+    identities.invalidate(owners=[1])
+    assert identities.get(("chat", "42")) is None
+    assert identities.get(("emp", "E1")) is None
+    assert identities.get(("emp", "E2")) == "user 2"
+    identities.invalidate(keys=[("emp", "E2")])
+    assert identities.get(("emp", "E2")) is None
+    assert identities.stats()["invalidations"] == 3
+
+
+def test_value_read_before_an_invalidation_is_not_cached(clock):
+    identities = IdentityCache(maxsize=10, ttl=60)
+    before = identities.generation()
+    identities.invalidate(owners=[1])  # record changed while the query ran
+    assert identities.put("a", "stale", owner=1, generation=before) is False
+    assert identities.get("a") is None
+
+    # other owners, and reads after the invalidation, are cached
+    assert identities.put("b", "other", owner=2, generation=before)
+    assert identities.put("a", "fresh", owner=1, generation=identities.generation())
+    assert identities.get("a") == "fresh"
+    assert identities.stats()["stale_puts"] == 1
+
+
+def test_value_read_before_a_key_invalidation_is_not_cached(clock):
+    identities = IdentityCache(maxsize=10, ttl=60)
+    before = identities.generation()
+    identities.invalidate(keys=["a"])
+    assert not identities.put("a", "stale", owner=1, generation=before)
+    assert identities.put("b", "other", owner=1, generation=before)
+
+
+def test_reads_older_than_the_forgotten_invalidations_are_not_cached(clock):
+    identities = IdentityCache(maxsize=2, ttl=60)
+    before = identities.generation()
+    identities.invalidate(owners=[1, 2, 3])  # the record of owner 1 is dropped
+    assert not identities.put("a", "stale", owner=1, generation=before)
+    assert not identities.put("d", "unknown", owner=4, generation=before)
+    assert identities.put("d", "fresh", owner=4, generation=identities.generation())
+
+
+def test_lookup_racing_an_invalidation_leaves_no_stale_user(session):
+    from db_backend import engine
+    from models import User, user_cache
+
+    user_cache.clear()
+    user = User(employee_id="E1", fullname="Old", role="Employee", last_chat_id="42")
+    session.add(user)
+    session.commit()
+    user_id = user.id
+    session.remove()
+
+    raced = []
+
+    def rename_during_lookup(conn, cursor, statement, parameters, context, executemany):
+        # another handler commits a change and invalidates after this
+        # lookup read the old row but before it stores it in the cache
+        if not raced:
+            raced.append(statement)
+            User.invalidate_cache(chat_id="42")
+
+    event.listen(engine, "after_cursor_execute", rename_during_lookup)
+    try:
+        assert User.get_by_chat_id("42").fullname == "Old"
+    finally:
+        event.remove(engine, "after_cursor_execute", rename_during_lookup)
+    assert user_cache.get(("chat", "42", True)) is None
+
+    # without a concurrent change the lookup is cached
+    session.remove()
+    assert User.get_by_chat_id("42").id == user_id
+    assert user_cache.get(("chat", "42", True)).id == user_id
+    user_cache.clear()
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks")
+)
+
+from db_backend import set_sqlite_pragma  # noqa: E402
+from models import Base, user_cache  # noqa: E402
+from stress_concurrent_sessions import run  # noqa: E402
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    """
+    Scoped session on its own database file, like the bot's `db_session`
+    """
+    engine = create_engine(
+        "sqlite:///" + str(tmp_path / "TA.db"),
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+    event.listen(engine, "connect", set_sqlite_pragma)
+    Base.metadata.create_all(engine)
+    user_cache.clear()  # chat IDs of this database mean other users elsewhere
+    try:
+        yield scoped_session(sessionmaker(bind=engine))
+    finally:
+        user_cache.clear()
+        engine.dispose()
+
+
+def test_concurrent_units_of_work_lose_no_writes(sessions):
+    result = run(threads=8, updates=20, sessions=sessions)
+
+    assert result["errors"] == []
+    assert result["rows"] == result["expected_rows"] == 80
+    assert result["completed"] == result["expected_completed"] == 80
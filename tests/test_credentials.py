@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from credentials import CredentialService, hash_password, needs_rehash
+from helpers import get_hashed
+
+
+@pytest.fixture(scope="module")
+def service():
+    service = CredentialService(workers=1, max_pending=4).start()
+    yield service
+    service.stop()
+
+
+def test_scrypt_and_legacy_hashes_are_verified(service):
+    stored = service.hash("otp")
+    assert not needs_rehash(stored)
+    assert service.verify("otp", stored)
+    assert not service.verify("other", stored)
+    assert service.verify("otp", get_hashed("otp"))
+    assert not service.verify("other", get_hashed("otp"))
+    assert not service.verify("otp", None)
+
+
+def test_async_checks_start_the_pool_off_the_event_loop():
+    service = CredentialService(workers=1, max_pending=4)
+
+    async def login():
+        stored = await service.hash_async("otp")
+        return await service.verify_async("otp", stored), await service.verify_async(
+            "otp", get_hashed("otp")
+        )
+
+    try:
+        assert asyncio.run(login()) == (True, True)
+        assert service._dummy_hash is not None
+    finally:
+        service.stop()
+
+
+def test_legacy_hash_is_rehashed():
+    assert needs_rehash(get_hashed("otp"))
+    assert needs_rehash(hash_password("otp", n=2**10))
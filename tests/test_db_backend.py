@@ -0,0 +1,9 @@
+import os
+
+from db_backend import acquire_instance_lock
+
+
+def test_second_instance_lock_is_refused(tmp_path):
+    path = os.path.join(tmp_path, "TA.db.lock")
+    assert acquire_instance_lock(path)
+    assert not acquire_instance_lock(path)
@@ -0,0 +1,87 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from geofence import CELL_DEGREES, GeofenceIndex, haversine
+
+OFFICES = [
+    SimpleNamespace(id=1, latitude=12.9716, longitude=77.5946, radius_meters=200, timezone=None),
+    # overlaps office 1, so the nearest has to win
+    SimpleNamespace(id=2, latitude=12.9730, longitude=77.5946, radius_meters=300, timezone=None),
+    # across a grid cell boundary
+    SimpleNamespace(id=3, latitude=13.0, longitude=77.6, radius_meters=500, timezone=None),
+    SimpleNamespace(id=4, latitude=40.7128, longitude=-74.006, radius_meters=150, timezone="America/New_York"),
+]
+ASSIGNMENTS = [(10, 1), (11, 4), (11, 3)]
+
+
+def nearest(lat, lng, user_id=None):
+    # the definition: nearest allowed office whose circle holds the point
+    allowed = {office_id for user, office_id in ASSIGNMENTS if user == user_id}
+    best, best_distance = -1, None
+    for office in OFFICES:
+        if allowed and office.id not in allowed:
+            continue
+        distance = haversine(lat, lng, office.latitude, office.longitude)
+        if distance <= office.radius_meters and (best_distance is None or distance < best_distance):
+            best, best_distance = office.id, distance
+    return best
+
+
+@pytest.fixture(scope="module")
+def points():
+    generator = random.Random(7)
+    points = []
+    for office in OFFICES:
+        for _ in range(500):
+            # up to twice the radius away, so about a quarter are inside
+            spread = 2 * office.radius_meters / 111_000
+            points.append(
+                (
+                    office.latitude + generator.uniform(-spread, spread),
+                    office.longitude + generator.uniform(-spread, spread),
+                    generator.choice([None, 10, 11, 12]),
+                )
+            )
+    return points
+
+
+def test_match_many_agrees_with_haversine(points):
+    index = GeofenceIndex(OFFICES)
+    lats, lngs, _ = zip(*points)
+    expected = [nearest(lat, lng) for lat, lng, _ in points]
+    assert index.match_many(lats, lngs).tolist() == expected
+    assert {-1, 1, 2, 3, 4} <= set(expected)
+
+
+def test_match_many_respects_assignments(points):
+    index = GeofenceIndex(OFFICES, ASSIGNMENTS)
+    lats, lngs, users = zip(*points)
+    expected = [nearest(lat, lng, user) for lat, lng, user in points]
+    assert index.match_many(lats, lngs, users).tolist() == expected
+
+
+def test_match_agrees_with_match_many(points):
+    index = GeofenceIndex(OFFICES, ASSIGNMENTS)
+    for lat, lng, user in points:
+        assert (index.match(lat, lng, user) or -1) == nearest(lat, lng, user)
+
+
+def test_fence_spanning_grid_cells_is_found_from_each():
+    office = OFFICES[2]
+    index = GeofenceIndex([office], cell_degrees=CELL_DEGREES)
+    just_inside = 0.9 * office.radius_meters / 111_000
+    for d_lat, d_lng in [(just_inside, 0), (-just_inside, 0), (0, just_inside), (0, -just_inside)]:
+        assert index.match(office.latitude + d_lat, office.longitude + d_lng) == office.id
+
+
+def test_empty_input():
+    assert GeofenceIndex(OFFICES).match_many([], []).tolist() == []
+
+
+def test_zone_of_first_assigned_office_with_a_timezone():
+    index = GeofenceIndex(OFFICES, ASSIGNMENTS)
+    assert index.zone_of(11) == "America/New_York"
+    assert index.zone_of(10) is None
+    assert index.zoned_users() == [11]
@@ -0,0 +1,94 @@
+import pytest
+
+import live_location
+from live_location import LiveLocationTracker, LiveSample
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(live_location.time, "monotonic", clock)
+    return clock
+
+
+def sample(in_fence=True):
+    return LiveSample(12.97, 77.59, None, in_fence)
+
+
+def test_attendance_is_confirmed_once_after_required_updates(clock):
+    tracker = LiveLocationTracker(required_updates=3)
+    assert tracker.start(1, 10, 600, sample()) is False
+    assert tracker.update(1, 10, sample(in_fence=False)) is False
+    assert tracker.update(1, 10, sample()) is False
+    assert tracker.update(1, 10, sample()) is True
+    assert tracker.update(1, 10, sample()) is False
+    assert tracker.get(1).confirmed
+
+
+def test_first_sample_can_confirm(clock):
+    tracker = LiveLocationTracker(required_updates=1)
+    assert tracker.start(1, 10, 600, sample()) is True
+
+
+def test_updates_of_other_messages_are_ignored(clock):
+    tracker = LiveLocationTracker(required_updates=2)
+    tracker.start(1, 10, 600, sample())
+    assert tracker.update(1, 11, sample()) is None
+    assert tracker.update(2, 10, sample()) is None
+    # a new live location replaces the session
+    tracker.start(1, 11, 600, sample(in_fence=False))
+    assert tracker.update(1, 10, sample()) is None
+    assert tracker.update(1, 11, sample()) is False
+
+
+def test_samples_are_kept_in_a_ring_buffer(clock):
+    tracker = LiveLocationTracker(required_updates=100, buffer_size=3)
+    tracker.start(1, 10, 600, sample())
+    for _ in range(5):
+        tracker.update(1, 10, sample())
+    assert len(tracker.get(1).samples) == 3
+    assert tracker.get(1).in_fence == 6
+
+
+def test_session_expires_with_its_live_period(clock):
+    tracker = LiveLocationTracker(required_updates=2)
+    tracker.start(1, 10, 60, sample())
+    clock.now += 59
+    assert tracker.update(1, 10, sample(in_fence=False)) is False
+    clock.now += 1
+    assert tracker.update(1, 10, sample()) is None
+    assert tracker.get(1) is None
+    assert len(tracker) == 0
+
+
+def test_replaced_session_does_not_expire_with_the_old_one(clock):
+    tracker = LiveLocationTracker(required_updates=5)
+    tracker.start(1, 10, 60, sample())
+    tracker.start(1, 11, 600, sample())
+    clock.now += 120
+    assert tracker.update(1, 11, sample()) is False
+
+
+def test_max_sessions_drops_the_first_to_expire(clock):
+    tracker = LiveLocationTracker(required_updates=5, max_sessions=2)
+    tracker.start(1, 10, 300, sample())
+    tracker.start(2, 20, 100, sample())
+    tracker.start(3, 30, 200, sample())
+    assert len(tracker) == 2
+    assert tracker.get(2) is None
+    assert tracker.get(1) is not None and tracker.get(3) is not None
+
+
+def test_stopped_session_takes_no_updates(clock):
+    tracker = LiveLocationTracker(required_updates=2)
+    tracker.start(1, 10, 600, sample())
+    tracker.stop(1)
+    assert tracker.update(1, 10, sample()) is None
@@ -0,0 +1,176 @@
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+from sqlalchemy import insert
+
+from migrations import get_status, migrate
+from models import (
+    Attendance,
+    DailyAttendanceSummary,
+    Office,
+    SchemaMigration,
+    Selfie,
+    User,
+    UserOffice,
+)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def legacy_attendance(session, users: int, days: int):
+    # records of an old release: photo sizes as JSON on the attendance row
+    for n in range(users):
+        user = User(employee_id=f"E{n}")
+        session.add(user)
+        session.flush()
+        for day in range(days):
+            check_in = datetime(2024, 3, 1, 4) + timedelta(days=day)
+            photo = {"file_id": f"f{n}-{day}", "file_unique_id": f"u{n}-{day}", "width": 9, "height": 9}
+            session.add(
+                Attendance(
+                    user_id=user.id,
+                    legacy_selfie=[photo],
+                    selfie_time=check_in,
+                    location_time=check_in + timedelta(minutes=1),
+                )
+            )
+    session.commit()
+
+
+def test_interrupted_backfill_resumes_at_its_last_batch(session):
+    legacy_attendance(session, users=4, days=5)
+    positions = []
+
+    def stop_after_two_batches(migration, position):
+        positions.append((migration.version, position))
+        if migration.version == 6 and len(positions) == 2:
+            raise Interrupted
+
+    with pytest.raises(Interrupted):
+        migrate(batch_size=3, pause=0, on_batch=stop_after_two_batches, session=session)
+    state = session.get(SchemaMigration, 6)
+    assert state.position == 6 and state.applied_at is None
+    assert session.query(Selfie).count() == 6
+
+    resumed = []
+    completed = migrate(
+        batch_size=3, pause=0, on_batch=lambda m, p: resumed.append((m.version, p)), session=session
+    )
+    assert completed == [6, 7, 8, 9]
+    assert [p for v, p in resumed if v == 6] == [9, 12, 15, 18, 20]
+    assert all(row.applied_at is not None for _, row in get_status(session))
+    assert session.query(Selfie).count() == 20
+    assert session.query(Attendance).filter(Attendance.legacy_selfie.isnot(None)).count() == 0
+    summaries = session.query(DailyAttendanceSummary).all()
+    assert len(summaries) == 20
+    assert {summary.completed_pairs for summary in summaries} == {1}
+
+
+def test_summaries_are_counted_in_office_timezones(session):
+    local, remote = User(employee_id="E1"), User(employee_id="E2")
+    office = Office(
+        name="New York",
+        latitude=40.7,
+        longitude=-74.0,
+        radius_meters=200,
+        timezone="America/New_York",
+    )
+    session.add_all([local, remote, office])
+    session.flush()
+    session.add(UserOffice(user_id=remote.id, office_id=office.id))
+    # 5 March in Kolkata, still 4 March in New York
+    check_in = datetime(2024, 3, 5, 3, 0)
+    for user in (local, remote):
+        session.add(Attendance(user_id=user.id, selfie_time=check_in, location_time=check_in))
+    session.commit()
+
+    migrate(batch_size=1, pause=0, session=session)
+
+    days = dict(session.query(DailyAttendanceSummary.user_id, DailyAttendanceSummary.date))
+    assert days == {local.id: date(2024, 3, 5), remote.id: date(2024, 3, 4)}
+
+
+USERS, ROWS_PER_USER = 1_000, 300
+BATCH_SIZE = 20_000
+
+
+@pytest.fixture
+def large_legacy_database(session):
+    """
+    300,000 legacy attendance rows, two pairs a day per user; the evening
+    check-ins of some users fall on either side of midnight in Kolkata
+    """
+    session.execute(
+        insert(User.__table__),
+        [{"id": n, "employee_id": f"E{n}", "is_active": True} for n in range(1, USERS + 1)],
+    )
+    rows = []
+    for n in range(1, USERS + 1):
+        start = datetime(2024, 1, 1, 6, 20 + n % 20)
+        for pair in range(ROWS_PER_USER):
+            selfie_time = start + timedelta(hours=12 * pair)
+            photo = {"file_id": f"f{n}-{pair}", "file_unique_id": f"u{n}-{pair}", "width": 9, "height": 9}
+            rows.append(
+                {
+                    "user_id": n,
+                    "selfie": [photo],
+                    "selfie_time": selfie_time,
+                    "location_time": selfie_time + timedelta(minutes=1),
+                }
+            )
+    session.execute(insert(Attendance.__table__), rows)
+    session.commit()
+    return rows
+
+
+@pytest.mark.slow
+def test_large_backfill_resumes_and_matches_a_recount(session, large_legacy_database):
+    positions = {6: [], 7: []}
+
+    def stop_in_summaries(migration, position):
+        positions.setdefault(migration.version, []).append(position)
+        if migration.version == 7 and len(positions[7]) == 5:
+            raise Interrupted
+
+    with pytest.raises(Interrupted):
+        migrate(batch_size=BATCH_SIZE, pause=0, on_batch=stop_in_summaries, session=session)
+    # one batch per 20,000 attendance rows, then the empty call ending it
+    assert positions[6] == list(range(BATCH_SIZE, USERS * ROWS_PER_USER + 1, BATCH_SIZE))
+    # a batch ends at the user holding its 20,001st row: 67 users of 300 rows
+    per_batch = BATCH_SIZE // ROWS_PER_USER + 1
+    assert positions[7] == [per_batch * n for n in range(1, 6)]
+    state = session.get(SchemaMigration, 7)
+    assert state.position == 5 * per_batch and state.applied_at is None
+
+    resumed = []
+    completed = migrate(
+        batch_size=BATCH_SIZE, pause=0, on_batch=lambda m, p: resumed.append((m.version, p)), session=session
+    )
+    assert completed == [7, 8, 9]
+    # picks up after the fifth batch; the last one, past 933, returns None
+    assert [p for _, p in resumed] == list(range(6 * per_batch, USERS, per_batch))
+
+    assert session.query(Selfie).count() == USERS * ROWS_PER_USER
+    assert session.query(Attendance).filter(Attendance.legacy_selfie.isnot(None)).count() == 0
+
+    # recount the local days from scratch, outside the code under test
+    kolkata = ZoneInfo("Asia/Kolkata")
+    expected = Counter(
+        (row["user_id"], row["location_time"].replace(tzinfo=timezone.utc).astimezone(kolkata).date())
+        for row in large_legacy_database
+    )
+    counted = {
+        (user_id, day): pairs
+        for user_id, day, pairs in session.query(
+            DailyAttendanceSummary.user_id,
+            DailyAttendanceSummary.date,
+            DailyAttendanceSummary.completed_pairs,
+        )
+    }
+    assert counted == dict(expected)
+    assert sum(counted.values()) == USERS * ROWS_PER_USER
+    assert set(counted.values()) == {1, 2}
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import models
+from models import Attendance, DailyAttendanceSummary, Selfie, StalePendingPair, User
+from timezones import get_calendar
+
+IST = get_calendar("Asia/Kolkata")
+NOON = datetime(2024, 3, 5, 6, 30)  # UTC
+LOCATION = {"latitude": 12.97, "longitude": 77.59}
+
+
+@pytest.fixture
+def user(session):
+    user = User(employee_id="E1", fullname="E 1", role="Employee")
+    session.add(user)
+    session.commit()
+    return user
+
+
+def selfie(user, name="a"):
+    return Selfie(file_unique_id=name, user_id=user.id, file_id=f"file-{name}")
+
+
+def test_pair_is_completed_and_counted(session, user):
+    attendance_id = Attendance.start_pair(user.id, "selfie", selfie(user), NOON, calendar=IST)
+    later = NOON + timedelta(minutes=2)
+    Attendance.complete_pair(attendance_id, user.id, "location", LOCATION, later, NOON, calendar=IST)
+    session.commit()
+
+    record = session.get(Attendance, attendance_id)
+    assert (record.selfie_time, record.location_time) == (NOON, later)
+    assert record.selfie.file_id == "file-a"
+    summary = session.query(DailyAttendanceSummary).one()
+    assert summary.completed_pairs == 1
+
+
+def test_completing_a_paired_record_is_stale(session, user):
+    # another process merged the pending selfie first
+    attendance_id = Attendance.start_pair(user.id, "selfie", selfie(user), NOON, calendar=IST)
+    Attendance.complete_pair(attendance_id, user.id, "location", LOCATION, NOON, NOON, calendar=IST)
+    session.commit()
+
+    with pytest.raises(StalePendingPair):
+        Attendance.complete_pair(attendance_id, user.id, "location", LOCATION, NOON, NOON, calendar=IST)
+    session.rollback()
+    assert session.query(DailyAttendanceSummary).one().completed_pairs == 1
+
+
+def test_completing_a_superseded_record_is_stale(session, user):
+    # another process started a newer record after the delay expired
+    old_id = Attendance.start_pair(user.id, "location", LOCATION, NOON, calendar=IST)
+    later = NOON + timedelta(minutes=10)
+    Attendance.start_pair(user.id, "location", LOCATION, later, pending_id=old_id, calendar=IST)
+    session.commit()
+
+    with pytest.raises(StalePendingPair):
+        Attendance.complete_pair(old_id, user.id, "selfie", selfie(user), later, NOON, calendar=IST)
+    session.rollback()
+    assert session.query(Selfie).count() == 0
+
+
+def test_starting_a_record_over_an_unknown_pending_one_is_stale(session, user):
+    # another process stored the selfie; this one's hint says nothing is pending
+    pending_id = Attendance.start_pair(user.id, "selfie", selfie(user), NOON, calendar=IST)
+    session.commit()
+
+    with pytest.raises(StalePendingPair) as raised:
+        Attendance.start_pair(user.id, "location", LOCATION, NOON, calendar=IST)
+    assert raised.value.actual == pending_id
+    session.rollback()
+    assert session.query(Attendance).count() == 1
+
+
+def test_records_of_other_days_are_not_pending(session, user):
+    Attendance.start_pair(user.id, "selfie", selfie(user), NOON - timedelta(days=1), calendar=IST)
+    Attendance.start_pair(user.id, "location", LOCATION, NOON, calendar=IST)
+    session.commit()
+    assert session.query(Attendance).count() == 2
+
+
+@pytest.fixture
+def staff(session):
+    users = [
+        User(employee_id=f"S{n}", fullname=f"S {n}", role="Employee", is_active=n != 3)
+        for n in range(5)
+    ]
+    session.add_all(users)
+    session.commit()
+    return users
+
+
+def test_bulk_update_spans_chunks(session, staff, monkeypatch):
+    monkeypatch.setattr(models, "EMP_ID_LOOKUP_CHUNK_SIZE", 2)
+    ids = [user.employee_id for user in staff]
+
+    matched, changed, missing, user_ids = User.bulk_update(ids, {"role": "HR"})
+    session.commit()
+    assert matched == changed == ids and missing == []
+    assert sorted(user_ids) == sorted(user.id for user in staff)
+    assert {role for (role,) in session.query(User.role)} == {"HR"}
+
+
+def test_bulk_update_leaves_unchanged_rows_alone(session, staff):
+    # S3 is already deactivated; NULL differs from False like any value
+    staff[1].is_active = None
+    session.commit()
+    ids = ["S1", "S2", "S3", "S2"]
+
+    matched, changed, missing, user_ids = User.bulk_update(ids, {"is_active": False})
+    session.commit()
+    assert (matched, changed, missing) == (["S1", "S2", "S3"], ["S1", "S2"], [])
+    assert sorted(user_ids) == [staff[1].id, staff[2].id]
+    assert session.query(User).filter(User.is_active.is_(False)).count() == 3
+
+
+def test_bulk_update_reports_unknown_and_deactivated_ids(session, staff):
+    values = {"temp_pwd": "hash", "is_pwd_expired": False}
+    matched, changed, missing, user_ids = User.bulk_update(
+        ["S0", "NOPE", "S3"], values, only_active=True
+    )
+    session.commit()
+    assert (matched, changed, missing) == (["S0"], ["S0"], ["NOPE", "S3"])
+    assert user_ids == [staff[0].id]
+    assert session.get(User, staff[3].id).temp_pwd is None
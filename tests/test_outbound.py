@@ -0,0 +1,44 @@
+from outbound import MAX_MESSAGE_LENGTH, _Outgoing
+
+
+def message(text, method="send_message", **kwargs):
+    return _Outgoing(method, 1, dict(kwargs, chat_id=1, text=text))
+
+
+def test_messages_to_a_chat_are_merged():
+    first = message("Selfie has been added", parse_mode="HTML")
+    second = message("Please share your location", parse_mode="HTML")
+    assert first.merge(second)
+    assert first.kwargs["text"] == "Selfie has been added\n\nPlease share your location"
+    assert first.futures[1:] == second.futures
+
+
+def test_reply_keeps_its_target_when_a_plain_message_follows():
+    first = message("a", reply_to_message_id=7)
+    assert first.merge(message("b"))
+    assert first.kwargs["reply_to_message_id"] == 7
+
+
+def test_replies_to_different_messages_are_not_merged():
+    first = message("a", reply_to_message_id=7)
+    assert not first.merge(message("b", reply_to_message_id=8))
+    assert first.kwargs["text"] == "a"
+
+
+def test_different_options_are_not_merged():
+    assert not message("a", parse_mode="HTML").merge(message("b"))
+    assert not message("a", parse_mode="HTML").merge(message("b", parse_mode="MarkdownV2"))
+
+
+def test_only_text_messages_are_merged():
+    document = _Outgoing("send_document", 1, {"chat_id": 1, "document": b""})
+    assert not message("a").merge(document)
+    assert not document.merge(message("a"))
+
+
+def test_merge_stays_within_the_message_length():
+    # the two texts are joined by a blank line
+    assert message("a" * (MAX_MESSAGE_LENGTH - 3)).merge(message("b"))
+    first = message("a" * (MAX_MESSAGE_LENGTH - 2))
+    assert not first.merge(message("b"))
+    assert len(first.futures) == 1
@@ -0,0 +1,69 @@
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from timezones import DayCalendar
+
+ZONES = ["America/New_York", "Europe/London", "Australia/Lord_Howe", "Asia/Kolkata"]
+
+
+def hourly(start: datetime, hours: int):
+    # every 15 minutes, so the instants next to each transition are included
+    return [start + timedelta(minutes=15 * n) for n in range(hours * 4)]
+
+
+def local(timestamp: datetime, zone_name: str):
+    return timestamp.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(zone_name))
+
+
+@pytest.fixture(scope="module", params=ZONES)
+def calendar(request):
+    return DayCalendar(request.param, date(2024, 1, 1), date(2024, 12, 31))
+
+
+@pytest.mark.parametrize(
+    "day, hours",
+    [(date(2024, 3, 10), 23), (date(2024, 11, 3), 25), (date(2024, 3, 11), 24)],
+)
+def test_new_york_days_are_23_or_25_hours_long_across_dst(day, hours):
+    calendar = DayCalendar("America/New_York", date(2024, 1, 1), date(2024, 12, 31))
+    start, end = calendar.bounds(day)
+    assert end - start == timedelta(hours=hours)
+    assert local(start, "America/New_York").replace(tzinfo=None) == datetime.combine(day, datetime.min.time())
+
+
+@pytest.mark.parametrize(
+    "start",
+    [
+        datetime(2024, 3, 9),  # United States spring forward
+        datetime(2024, 3, 30),  # European spring forward
+        datetime(2024, 4, 6),  # Lord Howe falls back half an hour
+        datetime(2024, 10, 26),  # European fall back
+        datetime(2024, 11, 2),  # United States fall back
+    ],
+)
+def test_conversions_match_zoneinfo_around_transitions(calendar, start):
+    timestamps = hourly(start, 72)
+    expected_local = [local(t, calendar.zone_name).replace(tzinfo=None) for t in timestamps]
+    expected_days = [t.date() for t in expected_local]
+    assert calendar.to_local_many(timestamps) == expected_local
+    assert calendar.days_of(timestamps) == expected_days
+    assert [calendar.day_of(t) for t in timestamps] == expected_days
+    for timestamp, day in zip(timestamps, expected_days):
+        day_start, day_end = calendar.day_bounds_of(timestamp)
+        assert day_start <= timestamp < day_end
+        assert calendar.day_of(day_start) == day
+
+
+def test_outside_the_window_is_converted_directly(calendar):
+    timestamps = [datetime(2023, 7, 1, 12), datetime(2025, 7, 1, 12)]
+    expected = [local(t, calendar.zone_name).replace(tzinfo=None) for t in timestamps]
+    assert calendar.to_local_many(timestamps) == expected
+    assert calendar.days_of(timestamps) == [t.date() for t in expected]
+
+
+def test_month_bounds_are_local_midnights(calendar):
+    start, end = calendar.month_bounds(2024, 3)
+    assert local(start, calendar.zone_name).replace(tzinfo=None) == datetime(2024, 3, 1)
+    assert local(end, calendar.zone_name).replace(tzinfo=None) == datetime(2024, 4, 1)
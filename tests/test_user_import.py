@@ -0,0 +1,143 @@
+import csv
+
+import pytest
+
+from models import User
+from user_import import ImportFileError, error_report, import_users, read_employee_ids
+
+HEADER = ["Employee ID", "Full Name", "Role", "OTP"]
+
+
+class Hasher:
+    """
+    Stands in for CredentialService; records whether a transaction was open
+    """
+
+    def __init__(self, session, during=None):
+        self.session = session
+        self.during = during
+        self.in_transaction = None
+
+    def hash_many(self, passwords):
+        self.in_transaction = self.session().in_transaction()
+        if self.during:
+            self.during()
+        return [f"hashed-{password}" for password in passwords]
+
+
+def write_csv(tmp_path, rows, header=HEADER, name="users.csv"):
+    path = tmp_path / name
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        csv.writer(file).writerows([header, *rows])
+    return str(path)
+
+
+def test_valid_list_is_imported_with_hashed_otps(session, tmp_path):
+    path = write_csv(
+        tmp_path, [["E1", "One", "employee", "111"], ["E2", "Two", "HR", "222"], []]
+    )
+    hasher = Hasher(session)
+
+    assert import_users(path, hasher, session=session) == (2, [])
+    assert hasher.in_transaction is False
+    assert not session().in_transaction()  # committed by the import
+    users = session.query(User).order_by(User.employee_id).all()
+    assert [(u.employee_id, u.role, u.temp_pwd) for u in users] == [
+        ("E1", "Employee", "hashed-111"),
+        ("E2", "HR", "hashed-222"),
+    ]
+
+
+def test_invalid_rows_are_reported_and_nothing_is_imported(session, tmp_path):
+    session.add(User(employee_id="TAKEN", fullname="Old", role="Employee"))
+    session.commit()
+    path = write_csv(
+        tmp_path,
+        [
+            ["E1", "One", "employee", "111"],
+            ["", "No ID", "employee", "1"],
+            ["E2", "Two", "manager", ""],
+            ["E1", "Again", "hr", "3"],
+            ["E3", "x" * 31, "hr", "4"],
+            ["TAKEN", "New", "employee", "5"],
+        ],
+    )
+    hasher = Hasher(session)
+
+    created, errors = import_users(path, hasher, session=session)
+    assert created == 0
+    assert hasher.in_transaction is None  # nothing hashed
+    assert errors == [
+        (3, "", "employee_id is empty"),
+        (4, "E2", "otp is empty; role must be Employee or HR"),
+        (5, "E1", "employee ID repeats row 2"),
+        (6, "E3", "fullname is longer than 30 characters"),
+        (7, "TAKEN", "employee ID exists"),
+    ]
+    assert session.query(User).count() == 1
+
+
+def test_employee_id_taken_while_hashing_fails_the_file(session, tmp_path):
+    path = write_csv(
+        tmp_path, [["E1", "One", "employee", "1"], ["E2", "Two", "hr", "2"]]
+    )
+
+    def concurrent_create():
+        # another HR creates E2 between validation and insert
+        session.add(User(employee_id="E2", fullname="Other", role="HR"))
+        session.commit()
+
+    created, errors = import_users(
+        path, Hasher(session, concurrent_create), session=session
+    )
+    assert (created, errors) == (0, [(3, "E2", "employee ID exists")])
+    assert [u.fullname for u in session.query(User)] == ["Other"]
+
+
+def test_xlsx_list_is_read(session, tmp_path):
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    workbook.active.append(HEADER)
+    workbook.active.append([1001.0, "Numeric", "Employee", 4321])
+    path = str(tmp_path / "users.xlsx")
+    workbook.save(path)
+
+    assert import_users(path, Hasher(session), session=session) == (1, [])
+    user = session.query(User).one()
+    assert (user.employee_id, user.temp_pwd) == ("1001", "hashed-4321")
+
+
+@pytest.mark.parametrize(
+    "name, header, rows, message",
+    [
+        ("users.txt", HEADER, [], "Please upload a .csv or .xlsx file"),
+        ("users.csv", ["Employee ID", "Name", "Role"], [], "Column 'otp' is missing"),
+        ("users.csv", HEADER, [["E1", "A", "hr", "1"]] * 3, "At most 2 users"),
+    ],
+)
+def test_unreadable_files_are_refused(session, tmp_path, name, header, rows, message):
+    path = write_csv(tmp_path, rows, header=header, name=name)
+    with pytest.raises(ImportFileError, match=message):
+        import_users(path, Hasher(session), max_rows=2, session=session)
+
+
+def test_employee_ids_come_from_the_header_column_or_the_first(tmp_path):
+    with_header = write_csv(
+        tmp_path, [["x", "E1"], ["y", "E2"]], header=["name", "emp id"]
+    )
+    assert read_employee_ids(with_header) == ["E1", "E2"]
+    without = write_csv(tmp_path, [["E2"], [""]], header=["E1"], name="ids.csv")
+    assert read_employee_ids(without) == ["E1", "E2"]
+
+
+def test_error_report_has_a_row_per_error():
+    report = error_report(
+        [(3, "", "employee_id is empty"), (7, "E9", "employee ID exists")]
+    )
+    assert report.startswith(b"\xef\xbb\xbf")  # BOM, so Excel reads it as UTF-8
+    assert list(csv.reader(report.decode("utf-8-sig").splitlines())) == [
+        ["row", "employee_id", "error"],
+        ["3", "", "employee_id is empty"],
+        ["7", "E9", "employee ID exists"],
+    ]
@@ -0,0 +1,92 @@
+import http.client
+import json
+import threading
+import time
+
+import pytest
+import telebot
+
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = "test-secret"
+
+
+def update(update_id):
+    return json.dumps(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": 1, "type": "private"},
+                "from": {"id": 1, "is_bot": False, "first_name": "t"},
+                "text": "hello",
+            },
+        }
+    )
+
+
+def post(server, body, secret=SECRET):
+    connection = http.client.HTTPConnection("127.0.0.1", server.port)
+    connection.request("POST", "/webhook", body=body, headers={SECRET_HEADER: secret})
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def blocked():
+    """
+    Bot whose handler holds its dispatcher until the event is set
+    """
+    bot = telebot.TeleBot("0:test", threaded=False)
+    release = threading.Event()
+    handled = []
+
+    @bot.message_handler(func=lambda message: True)
+    def hold(message):
+        handled.append(message.message_id)
+        release.wait(5)
+
+    bot.release, bot.handled = release, handled
+    return bot
+
+
+def test_full_queue_is_answered_with_503(blocked):
+    server = WebhookServer(blocked, SECRET, "127.0.0.1", 0, queue_size=1, batch_size=1)
+    server.start()
+    try:
+        assert post(server, update(1)) == 200
+        wait_for(lambda: blocked.handled == [1])  # the only dispatcher is busy
+        assert post(server, update(2)) == 200  # waits in the queue
+        assert post(server, update(3)) == 503
+        assert (server.accepted, server.dropped) == (2, 1)
+
+        blocked.release.set()
+        wait_for(lambda: blocked.handled == [1, 2])
+        assert post(server, update(4)) == 200
+    finally:
+        blocked.release.set()
+        server.stop()
+
+
+def test_requests_without_the_secret_are_refused(blocked):
+    server = WebhookServer(blocked, SECRET, "127.0.0.1", 0)
+    server.start()
+    try:
+        assert post(server, update(1), secret="wrong") == 403
+        assert server.rejected == 1 and server.updates.empty()
+    finally:
+        server.stop()
+
+
+def test_threaded_bot_is_refused():
+    with pytest.raises(ValueError):
+        WebhookServer(telebot.TeleBot("0:test"), SECRET, "127.0.0.1", 0)
@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from models import Office
+from write_behind import WriteBehindQueue
+
+
+def add_office(name):
+    def operation(session):
+        office = Office(name=name, latitude=0, longitude=0, radius_meters=100)
+        session.add(office)
+        session.flush()
+        return office.id
+
+    return operation
+
+
+def fail(session):
+    raise ValueError("bad operation")
+
+
+@pytest.fixture
+def writer(session):
+    # a long delay gathers everything submitted below into one batch
+    writer = WriteBehindQueue(max_batch=10, max_delay=0.2)
+    yield writer
+    writer.stop()
+
+
+def office_names(session):
+    session.rollback()
+    return sorted(name for name, in session.query(Office.name))
+
+
+def test_batch_is_committed_at_once(session, writer):
+    futures = [writer.submit(add_office(f"O{n}")) for n in range(3)]
+    ids = [future.result(5) for future in futures]
+    assert len(set(ids)) == 3
+    assert office_names(session) == ["O0", "O1", "O2"]
+    assert writer.stats()["batches"] == 1
+    assert writer.stats()["batch_size"]["max"] == 3
+
+
+def test_failed_batch_is_replayed_one_operation_at_a_time(session, writer):
+    futures = [
+        writer.submit(add_office("A")),
+        writer.submit(fail),
+        writer.submit(add_office("B")),
+    ]
+    assert futures[0].result(5) and futures[2].result(5)
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert office_names(session) == ["A", "B"]
+
+
+def test_conflicting_operation_fails_alone(session, writer):
+    # the second insert of a name only fails at flush, inside the batch
+    futures = [writer.submit(add_office(name)) for name in ("A", "A", "B")]
+    assert futures[0].result(5)
+    with pytest.raises(IntegrityError):
+        futures[1].result(5)
+    assert futures[2].result(5)
+    assert office_names(session) == ["A", "B"]
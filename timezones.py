@@ -0,0 +1,208 @@
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+import threading
+from zoneinfo import ZoneInfo
+
+from settings import CALENDAR_FUTURE_DAYS, CALENDAR_PAST_DAYS, TIMEZONE
+
+EPOCH = datetime(1970, 1, 1)
+
+
+@lru_cache(maxsize=None)
+def get_zone(name: str = TIMEZONE):
+    """
+    Timezone by its IANA name, built once per name
+    :raises zoneinfo.ZoneInfoNotFoundError: unknown name
+    """
+    return ZoneInfo(name)
+
+
+def _seconds(timestamp: datetime):
+    return int((timestamp - EPOCH).total_seconds())
+
+
+class DayCalendar:
+    """
+    Local days of one timezone with their UTC [start, end) bounds computed
+    once, so turning a day or a month into an indexed range on the naive
+    UTC columns is a lookup, and UTC timestamps are turned into local days
+    or local times by a bisect instead of a timezone conversion each.
+    Days outside the precomputed window are converted directly.
+    """
+
+    def __init__(self, zone_name: str, first_day: date, last_day: date):
+        """
+        :param zone_name: IANA name of the timezone
+        :param first_day: first precomputed local day
+        :param last_day: last precomputed local day
+        """
+        self.zone_name = zone_name
+        self.zone = get_zone(zone_name)
+        self.first_day = first_day
+        self.last_day = last_day
+        days = (last_day - first_day).days + 2  # and the start of the next one
+        # naive UTC start of every day in the window
+        self._starts = [
+            self._start_of(first_day + timedelta(days=n)) for n in range(days)
+        ]
+        self._start_seconds = [_seconds(start) for start in self._starts]
+        self._days = [first_day + timedelta(days=n) for n in range(days)]
+        # UTC offset changes within the window: offset in effect from each instant
+        self._instants, self._offsets = [], []
+        previous = None
+        for start in self._start_seconds:
+            offset = self._offset_at(start)
+            if previous is None:
+                self._instants.append(start)
+                self._offsets.append(offset)
+            elif offset != self._offsets[-1]:
+                self._instants.append(self._transition(previous, start))
+                self._offsets.append(offset)
+            previous = start
+        self._deltas = [timedelta(seconds=offset) for offset in self._offsets]
+
+    def _start_of(self, day: date):
+        local = datetime.combine(day, time(), tzinfo=self.zone)
+        return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def _offset_at(self, seconds: int):
+        moment = datetime.fromtimestamp(seconds, timezone.utc).astimezone(self.zone)
+        return int(moment.utcoffset().total_seconds())
+
+    def _transition(self, low: int, high: int):
+        # first second in (low, high] with the offset in effect at high
+        offset = self._offset_at(high)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self._offset_at(middle) == offset:
+                high = middle
+            else:
+                low = middle
+        return high
+
+    def _in_window(self, seconds: int):
+        return self._start_seconds[0] <= seconds < self._start_seconds[-1]
+
+    def bounds(self, day: date):
+        """
+        UTC [start, end) of a local day
+        :param day: local date
+        :return: tuple of naive UTC timestamps
+        """
+        index = (day - self.first_day).days
+        if 0 <= index < len(self._starts) - 1:
+            return self._starts[index], self._starts[index + 1]
+        return self._start_of(day), self._start_of(day + timedelta(days=1))
+
+    def month_bounds(self, year: int, month: int):
+        """
+        UTC [start, end) of a local month
+        :param year: year of the month
+        :param month: month number (1-12)
+        :return: tuple of naive UTC timestamps
+        """
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return (
+            self.bounds(date(year, month, 1))[0],
+            self.bounds(date(next_year, next_month, 1))[0],
+        )
+
+    def day_of(self, timestamp: datetime):
+        """
+        Local day of a UTC timestamp
+        :param timestamp: naive UTC timestamp
+        """
+        seconds = _seconds(timestamp)
+        if not self._in_window(seconds):
+            return self.to_local(timestamp).date()
+        return self._days[bisect_right(self._start_seconds, seconds) - 1]
+
+    def day_bounds_of(self, timestamp: datetime):
+        """
+        UTC [start, end) of the local day a UTC timestamp falls in
+        :param timestamp: naive UTC timestamp
+        """
+        return self.bounds(self.day_of(timestamp))
+
+    def to_local(self, timestamp: datetime):
+        """
+        Local time of a UTC timestamp
+        :param timestamp: naive UTC timestamp
+        :return: aware local timestamp
+        """
+        return timestamp.replace(tzinfo=timezone.utc).astimezone(self.zone)
+
+    def to_local_many(self, timestamps):
+        """
+        Vectorized `to_local` for many timestamps at once, e.g. a batch of
+        report rows: one NumPy search for the UTC offset of all of them
+        instead of a timezone conversion each
+        :param timestamps: naive UTC timestamps
+        :return: list of naive local timestamps
+        """
+        timestamps = list(timestamps)
+        seconds, index = self._search(timestamps, self._instants)
+        local = [
+            timestamp + self._deltas[position]
+            for timestamp, position in zip(timestamps, index.tolist())
+        ]
+        for position in self._outside(seconds):
+            local[position] = self.to_local(timestamps[position]).replace(tzinfo=None)
+        return local
+
+    def days_of(self, timestamps):
+        """
+        Vectorized `day_of` for many timestamps at once
+        :param timestamps: naive UTC timestamps
+        :return: list of local dates
+        """
+        timestamps = list(timestamps)
+        seconds, index = self._search(timestamps, self._start_seconds)
+        days = [self._days[position] for position in index.tolist()]
+        for position in self._outside(seconds):
+            days[position] = self.to_local(timestamps[position]).date()
+        return days
+
+    @staticmethod
+    def _search(timestamps: list, boundaries: list):
+        import numpy as np
+
+        seconds = np.fromiter(
+            ((timestamp - EPOCH).total_seconds() for timestamp in timestamps),
+            dtype=np.float64,
+            count=len(timestamps),
+        )
+        return seconds, np.searchsorted(boundaries, seconds, side="right") - 1
+
+    def _outside(self, seconds):
+        import numpy as np
+
+        return np.flatnonzero(
+            (seconds < self._start_seconds[0]) | (seconds >= self._start_seconds[-1])
+        ).tolist()
+
+
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+
+def get_calendar(zone_name: str = None):
+    """
+    Calendar of a timezone, precomputed around today on first use
+    :param zone_name: IANA name, TIMEZONE when None
+    :raises zoneinfo.ZoneInfoNotFoundError: unknown name
+    """
+    zone_name = zone_name or TIMEZONE
+    calendar = _calendars.get(zone_name)
+    if calendar is None:
+        with _calendars_lock:
+            calendar = _calendars.get(zone_name)
+            if calendar is None:
+                today = date.today()
+                calendar = _calendars[zone_name] = DayCalendar(
+                    zone_name,
+                    today - timedelta(days=CALENDAR_PAST_DAYS),
+                    today + timedelta(days=CALENDAR_FUTURE_DAYS),
+                )
+    return calendar
@@ -0,0 +1,231 @@
+import csv
+import io
+import os
+
+from db_backend import db_session
+from models import User
+
+# header of an import file, with the spellings accepted for each column
+IMPORT_COLUMNS = {
+    "employee_id": ("employee id", "employee_id", "emp id"),
+    "fullname": ("full name", "fullname", "name"),
+    "role": ("role",),
+    "otp": ("otp", "password"),
+}
+ROLES = {"employee": "Employee", "hr": "HR"}
+
+
+class ImportFileError(ValueError):
+    """
+    The file can't be read as a user list at all
+    """
+
+
+def read_rows(path: str, max_rows: int = None):
+    """
+    Stream the rows of a CSV or XLSX user list as dicts keyed like
+    IMPORT_COLUMNS; XLSX files are read in read-only mode, one row at a time
+    :param path: path of the file, its extension tells the format
+    :param max_rows: fail past this many data rows
+    :return: iterator of (row number in the file, row dict)
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        rows = _csv_rows(path)
+    elif extension == ".xlsx":
+        rows = _xlsx_rows(path)
+    else:
+        raise ImportFileError("Please upload a .csv or .xlsx file")
+
+    header = next(rows, None)
+    if header is None:
+        raise ImportFileError("The file is empty")
+    positions = {}
+    names = [str(cell or "").strip().lower() for cell in header]
+    for column, spellings in IMPORT_COLUMNS.items():
+        matches = [index for index, name in enumerate(names) if name in spellings]
+        if not matches:
+            raise ImportFileError(f"Column '{spellings[0]}' is missing in the header")
+        positions[column] = matches[0]
+
+    for number, row in enumerate(rows, start=2):
+        if not any(cell not in (None, "") for cell in row):
+            continue  # blank line
+        if max_rows is not None and number - 1 > max_rows:
+            raise ImportFileError(f"At most {max_rows} users can be imported at once")
+        yield number, {column: _cell(row, index) for column, index in positions.items()}
+
+
+def read_employee_ids(path: str, max_rows: int = None):
+    """
+    Employee IDs listed in a CSV or XLSX file: the "employee id" column when
+    the file has that header, the first column otherwise
+    :param path: path of the file, its extension tells the format
+    :param max_rows: fail past this many IDs
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        rows = _csv_rows(path)
+    elif extension == ".xlsx":
+        rows = _xlsx_rows(path)
+    else:
+        raise ImportFileError("Please upload a .csv or .xlsx file")
+
+    employee_ids, column = [], 0
+    for number, row in enumerate(rows, start=1):
+        if number == 1:
+            names = [str(cell or "").strip().lower() for cell in row]
+            spellings = IMPORT_COLUMNS["employee_id"]
+            headers = [index for index, name in enumerate(names) if name in spellings]
+            if headers:
+                column = headers[0]
+                continue
+        employee_id = _cell(row, column)
+        if employee_id:
+            employee_ids.append(employee_id)
+        if max_rows is not None and len(employee_ids) > max_rows:
+            raise ImportFileError(f"At most {max_rows} employee IDs at once")
+    return employee_ids
+
+
+def _csv_rows(path: str):
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        yield from csv.reader(file)
+
+
+def _xlsx_rows(path: str):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _cell(row, index: int):
+    value = row[index] if index < len(row) else None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # numeric IDs/OTPs typed into a spreadsheet
+    return "" if value is None else str(value).strip()
+
+
+def validate(rows, session=None):
+    """
+    Check every row of a user list before anything is written
+    :param rows: iterator of (row number, row dict) from `read_rows`
+    :param session: session to be used instead of the thread's session
+    :return: valid users as dicts and errors as (row number, employee ID, message)
+    """
+    users, errors, seen = [], [], {}
+    limits = {
+        column: User.__table__.c[column].type.length
+        for column in ("employee_id", "fullname")
+    }
+    for number, row in rows:
+        problems = [
+            f"{column} is empty"
+            for column in IMPORT_COLUMNS
+            if not row[column] and column != "role"
+        ]
+        for column, limit in limits.items():
+            if len(row[column]) > limit:
+                problems.append(f"{column} is longer than {limit} characters")
+        role = ROLES.get(row["role"].lower())
+        if role is None:
+            problems.append("role must be Employee or HR")
+        employee_id = row["employee_id"]
+        if employee_id in seen:
+            problems.append(f"employee ID repeats row {seen[employee_id]}")
+        elif employee_id:
+            seen[employee_id] = number
+        if problems:
+            errors.append((number, employee_id, "; ".join(problems)))
+        else:
+            users.append(
+                {
+                    "row": number,
+                    "employee_id": employee_id,
+                    "fullname": row["fullname"],
+                    "role": role,
+                    "otp": row["otp"],
+                }
+            )
+
+    existing = User.get_existing_emp_ids(list(seen), session=session)
+    errors = [
+        (
+            (number, employee_id, problems + "; employee ID exists")
+            if employee_id in existing
+            else (number, employee_id, problems)
+        )
+        for number, employee_id, problems in errors
+    ]
+    for user in users:
+        if user["employee_id"] in existing:
+            errors.append((user["row"], user["employee_id"], "employee ID exists"))
+    errors.sort()
+    return [user for user in users if user["employee_id"] not in existing], errors
+
+
+def import_users(path: str, credential_service, max_rows: int = None, session=None):
+    """
+    Create the users of a CSV or XLSX list. The whole file is validated
+    first and the read transaction ended; only when every row is valid are
+    the OTPs hashed in parallel, with no transaction open, and all users
+    inserted with one executemany in a short transaction of their own. A
+    file is imported entirely or not at all.
+    :param path: path of the file
+    :param credential_service: CredentialService hashing the OTPs
+    :param max_rows: most users accepted in one file
+    :param session: session to be used instead of the thread's session
+    :return: number of users created and the errors found, see `validate`
+    """
+    session = db_session if session is None else session
+    users, errors = validate(read_rows(path, max_rows), session=session)
+    session.rollback()  # nothing written yet; don't hold the read while hashing
+    if errors or not users:
+        return 0, errors
+
+    hashes = credential_service.hash_many([user["otp"] for user in users])
+    try:
+        # employee IDs may have been taken while the OTPs were hashed
+        existing = User.get_existing_emp_ids(
+            [user["employee_id"] for user in users], session=session
+        )
+        if existing:
+            session.rollback()
+            return 0, [
+                (user["row"], user["employee_id"], "employee ID exists")
+                for user in users
+                if user["employee_id"] in existing
+            ]
+        User.bulk_create(
+            [
+                {
+                    "employee_id": user["employee_id"],
+                    "fullname": user["fullname"],
+                    "role": user["role"],
+                    "temp_pwd": pwd,
+                }
+                for user, pwd in zip(users, hashes)
+            ],
+            session=session,
+        )
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return len(users), errors
+
+
+def error_report(errors: list):
+    """
+    Per row error report of an import as CSV bytes
+    :param errors: (row number, employee ID, message) from `import_users`
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["row", "employee_id", "error"])
+    writer.writerows(errors)
+    return output.getvalue().encode("utf-8-sig")
@@ -0,0 +1,186 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
+import threading
+
+from db_backend import session_scope
+from log import get_logger
+
+log = get_logger("verification")
+
+# outcomes recorded on attendance.verification
+MATCH = "match"
+MISMATCH = "mismatch"
+NO_REFERENCE = "no_reference"
+ERROR = "error"
+
+# The hash covers the whole picture, background included, not a detected
+# face: a match says the selfie looks like the reference photo, not that it
+# shows the same person. Outcomes are shown with these labels, as a hint for
+# HR to review the selfie, never as proof of identity
+LABELS = {
+    MATCH: "similar scene",
+    MISMATCH: "different scene",
+    NO_REFERENCE: "no reference",
+    ERROR: "not checked",
+}
+
+HASH_SIZE = 8  # 8x8 gradient bits, a 64 bit hash
+
+
+def selfie_features(path: str, hash_size: int = HASH_SIZE):
+    """
+    Difference hash of an image: the sign of the horizontal brightness
+    gradient on a tiny grayscale copy. Close images give hashes a few bits
+    apart whatever their size or JPEG quality. It describes the whole
+    scene, so it tells similar photos apart, not faces. Runs in a worker
+    process.
+    :param path: path of the image
+    :param hash_size: rows and columns of gradient bits
+    :return: hash as an int
+    """
+    import numpy
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image).convert("L")
+        image = image.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+        pixels = numpy.asarray(image, dtype=numpy.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(numpy.packbits(bits).tobytes(), "big")
+
+
+def distance(features_a: int, features_b: int):
+    """
+    Number of differing bits between two hashes
+    """
+    return (features_a ^ features_b).bit_count()
+
+
+class SelfieVerifier:
+    """
+    Compares stored selfies with the employee's enrolled reference photo,
+    as an advisory scene similarity (see LABELS), not face recognition.
+    Image decoding and hashing run in a small process pool so neither the
+    handler threads nor the GIL pay for them; at most `max_pending` images
+    are hashed or waiting at once and callers wait for a free slot. The
+    features of each employee's reference are kept in an LRU cache, so a
+    check-in costs one hash of the new selfie.
+    """
+
+    def __init__(
+        self,
+        store,
+        workers: int = 1,
+        max_pending: int = 32,
+        max_distance: int = 10,
+        cache_size: int = 4096,
+    ):
+        """
+        :param store: SelfieStore holding selfies and references
+        :param workers: worker processes
+        :param max_pending: images hashed or waiting at once
+        :param max_distance: most differing hash bits still counted as a match
+        :param cache_size: employees whose reference features are cached
+        """
+        self.store = store
+        self.workers = workers
+        self.max_distance = max_distance
+        self.cache_size = cache_size
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._references = OrderedDict()  # {user_id: (sha256, features)}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pool is None:
+                methods = multiprocessing.get_all_start_methods()
+                # fork is unsafe with the bot's threads running
+                context = multiprocessing.get_context(
+                    "forkserver" if "forkserver" in methods else "spawn"
+                )
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+        return self
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def invalidate(self, user_id: int):
+        """
+        Forget the cached reference of an employee, e.g. after enrolment
+        """
+        with self._lock:
+            self._references.pop(user_id, None)
+
+    def features(self, sha256: str):
+        """
+        Hash a photo of the store in the pool, waiting for a free slot
+        """
+        self.start()
+        self._slots.acquire()
+        try:
+            return self._pool.submit(selfie_features, self.store.path(sha256)).result()
+        finally:
+            self._slots.release()
+
+    def reference(self, user_id: int, sha256: str):
+        """
+        Features of an employee's reference photo, hashed on first use
+        :param user_id: user ID of user
+        :param sha256: digest of their current reference photo
+        """
+        with self._lock:
+            cached = self._references.get(user_id)
+            if cached is not None and cached[0] == sha256:
+                self._references.move_to_end(user_id)
+                return cached[1]
+        features = self.features(sha256)
+        with self._lock:
+            self._references[user_id] = (sha256, features)
+            self._references.move_to_end(user_id)
+            while len(self._references) > self.cache_size:
+                self._references.popitem(last=False)
+        return features
+
+    def verify(self, file_unique_id: str, sha256: str):
+        """
+        Compare a stored selfie with its employee's reference and record the
+        outcome on the attendance row; called once the photo is downloaded
+        :param file_unique_id: primary key of the selfie row
+        :param sha256: digest of the photo in the store
+        :return: outcome, e.g. MATCH
+        """
+        from models import Attendance, Selfie, User
+
+        with session_scope() as session:
+            selfie = session.get(Selfie, file_unique_id)
+            user = session.get(User, selfie.user_id)
+            attendance_id, user_id = selfie.attendance_id, user.id
+            reference = user.reference_sha256
+
+        bits = None
+        try:
+            if reference is None or not self.store.has(reference):
+                outcome = NO_REFERENCE
+            else:
+                bits = distance(
+                    self.features(sha256), self.reference(user_id, reference)
+                )
+                outcome = MATCH if bits <= self.max_distance else MISMATCH
+        except Exception:
+            log.exception(
+                "Selfie verification failed",
+                extra={"file_unique_id": file_unique_id, "user_id": user_id},
+            )
+            outcome = ERROR
+
+        with session_scope() as session:
+            Attendance.record_verification(
+                attendance_id, outcome, bits, datetime.utcnow(), session=session
+            )
+        return outcome
@@ -0,0 +1,162 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
+import queue
+import threading
+
+from telebot import types
+
+from log import get_logger
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+log = get_logger("webhook")
+
+
+class WebhookServer:
+    """
+    Embedded HTTP receiver for Telegram webhook updates.
+    Requests carrying the right secret token are acknowledged right away and
+    their updates pushed into a bounded queue; dispatcher threads drain the
+    queue in batches into `bot.process_new_updates`. When the queue is full
+    the request is answered with 503, so Telegram retries it later.
+    The dispatchers run the handlers themselves, so the bot has to be
+    created with `threaded=False`: a threaded bot returns at once and piles
+    the updates up in its own unbounded pool, and the queue never fills.
+    One bot process serves a database (see `acquire_instance_lock`); raise
+    `dispatchers` for throughput instead of adding processes.
+    """
+
+    def __init__(
+        self,
+        bot,
+        secret: str,
+        host: str,
+        port: int,
+        path: str = "/webhook",
+        queue_size: int = 1000,
+        dispatchers: int = 1,
+        batch_size: int = 100,
+    ):
+        """
+        :param bot: TeleBot instance whose handlers process the updates
+        :param secret: secret token expected in every request
+        :param host: interface to listen on
+        :param port: port to listen on
+        :param path: URL path of the webhook
+        :param queue_size: maximum number of updates waiting for dispatch
+        :param dispatchers: number of dispatcher threads
+        :param batch_size: maximum number of updates handed to the bot at once
+        """
+        if not secret:
+            raise ValueError("Webhook secret token is required")
+        if getattr(bot, "threaded", False):
+            raise ValueError("Webhook bot must be created with threaded=False")
+        self.bot = bot
+        self.secret = secret.encode()
+        self.path = path
+        self.batch_size = batch_size
+        self.updates = queue.Queue(maxsize=queue_size)
+        self.accepted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._request_handler())
+        self.httpd.daemon_threads = True
+        self._dispatchers = [
+            threading.Thread(
+                target=self._dispatch, name=f"webhook-dispatch-{i}", daemon=True
+            )
+            for i in range(dispatchers)
+        ]
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def register(self, url: str, **kwargs):
+        """
+        Point Telegram at this receiver
+        :param url: public HTTPS URL routed to this server
+        """
+        self.bot.remove_webhook()
+        return self.bot.set_webhook(
+            url=url, secret_token=self.secret.decode(), **kwargs
+        )
+
+    def start(self):
+        """
+        Start dispatchers and serve HTTP on a background thread
+        """
+        for dispatcher in self._dispatchers:
+            dispatcher.start()
+        threading.Thread(
+            target=self.httpd.serve_forever, name="webhook-http", daemon=True
+        ).start()
+
+    def serve_forever(self):
+        """
+        Start dispatchers and serve HTTP on the calling thread
+        """
+        for dispatcher in self._dispatchers:
+            dispatcher.start()
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for _ in self._dispatchers:
+            self.updates.put(None)
+
+    def _dispatch(self):
+        while True:
+            update = self.updates.get()
+            if update is None:
+                return
+            batch = [update]
+            while len(batch) < self.batch_size:
+                try:
+                    update = self.updates.get_nowait()
+                except queue.Empty:
+                    break
+                if update is None:
+                    self.updates.put(None)
+                    break
+                batch.append(update)
+            try:
+                self.bot.process_new_updates(batch)
+            except Exception:
+                log.exception(
+                    "Failed to dispatch updates", extra={"updates": len(batch)}
+                )
+
+    def _request_handler(self):
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    return self._respond(404)
+                token = self.headers.get(SECRET_HEADER, "").encode()
+                if not hmac.compare_digest(token, server.secret):
+                    server.rejected += 1
+                    return self._respond(403)
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    update = types.Update.de_json(self.rfile.read(length).decode())
+                except ValueError:
+                    return self._respond(400)
+                try:
+                    server.updates.put_nowait(update)
+                except queue.Full:
+                    server.dropped += 1
+                    return self._respond(503)
+                server.accepted += 1
+                self._respond(200)
+
+            def _respond(self, status: int):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return RequestHandler
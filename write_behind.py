@@ -0,0 +1,153 @@
+from collections import deque
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+from db_backend import db_session
+
+
+class WriteBehindQueue:
+    """
+    Group commit for writes coming from many handler threads.
+    Handlers submit an operation (a callable taking the session) and wait on
+    the returned future; a single writer thread runs every operation queued
+    within `max_delay` seconds (up to `max_batch` of them) in one transaction,
+    so a burst of messages costs one commit/fsync instead of one per message.
+    A future is resolved only after the transaction holding its operation is
+    committed; if any operation of a batch fails the batch is retried one
+    operation per transaction, so only the bad one sees the exception.
+    """
+
+    def __init__(
+        self, max_batch: int = 200, max_delay: float = 0.005, history: int = 10000
+    ):
+        """
+        :param max_batch: maximum number of operations per transaction
+        :param max_delay: seconds to wait for more operations after the first one
+        :param history: number of recent batches kept for `stats`
+        """
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._batch_sizes = deque(maxlen=history)
+        self._commit_latencies = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, operation):
+        """
+        Queue an operation for the next group commit
+        :param operation: callable receiving the writer's session
+        :return: future resolved with the operation's return value once committed
+        """
+        self.start()
+        future = Future()
+        self._queue.put((operation, future))
+        return future
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="write-behind", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        """
+        Commit everything queued so far and stop the writer thread
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def pending(self):
+        """
+        Number of operations waiting for the writer
+        """
+        return self._queue.qsize()
+
+    def stats(self):
+        """
+        Batch size and commit latency (milliseconds) distribution of recent batches
+        """
+        with self._lock:
+            sizes = sorted(self._batch_sizes)
+            latencies = sorted(self._commit_latencies)
+        return {
+            "batches": len(sizes),
+            "batch_size": _distribution(sizes),
+            "commit_ms": _distribution(latencies),
+        }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            stopping = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = (
+                        self._queue.get(timeout=timeout)
+                        if timeout > 0
+                        else self._queue.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            results = [operation(db_session) for operation, _ in batch]
+            db_session.commit()
+        except Exception:
+            # one bad operation must not fail the others; retry them one by one
+            db_session.rollback()
+            for item in batch:
+                self._write_one(*item)
+            return
+        finally:
+            db_session.remove()
+
+        with self._lock:
+            self._batch_sizes.append(len(batch))
+            self._commit_latencies.append((time.perf_counter() - start) * 1000)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _write_one(self, operation, future):
+        try:
+            result = operation(db_session)
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            db_session.remove()
+
+
+def _distribution(values):
+    if not values:
+        return {}
+    return {
+        "p50": round(values[len(values) // 2], 3),
+        "p95": round(values[int(len(values) * 0.95)], 3),
+        "p99": round(values[int(len(values) * 0.99)], 3),
+        "max": round(values[-1], 3),
+    }